@@ -1,12 +1,43 @@
 #!/usr/bin/env python
 # PTB.py
+# Finds the coordination phrases of PTB.ext, one bracketed tree per line,
+# in a single pass. Phrases of every arity are written to
+# csv/PTB/PTB_coords.parquet, with the categories and texts of their
+# conjuncts as list columns, and the two-termed ones are also written to
+# csv/PTB/PTB_ccps.csv in the usual one-row-per-phrase layout. The
+# latter can be made again from the former alone (--view), without
+# reading the treebank. PTB.ext is read in batches of lines, which are
+# handed to a pool of worker processes (--workers), and the rows are
+# written as the batches come back, in order, so that memory stays
+# bounded.
 
-import pandas as pd
+import argparse
+import multiprocessing as mp
 import os
-import re
-from nltk import ParentedTree
+import sys
+
+import pandas as pd
+from nltk import Tree
 from tqdm import tqdm
+
 from linecounter import rawgencount
+from tablestore import TableAppender, iter_table, table_format
+from ccpfinder import pool_results
+
+
+COLUMNS = ['1st Conjunct Category', '1st Conjunct Text',
+           '2nd Conjunct Category', '2nd Conjunct Text',
+           'Phrase Category', 'Phrase Text',
+           'Conjunction', 'Sentence Text', 'Sentence Parse Tree']
+
+# Columns of the phrases of every arity. Conjunct Categories and Conjunct
+# Texts are lists, in the order of the conjuncts in the phrase.
+NARY_COLUMNS = ['Conjunct Categories', 'Conjunct Texts',
+                'Number of Conjuncts', 'Phrase Category', 'Phrase Text',
+                'Conjunction', 'Sentence Text', 'Sentence Parse Tree']
+
+# Lines of PTB.ext handed to a worker at a time
+BATCH_LINES = 2000
 
 
 '''
@@ -16,12 +47,7 @@ Input: NLTK tree
 Output: sentence string
 '''
 def get_tree_text(tree):
-    non_trace_leaves = []
-    for leaf in tree.leaves():
-        if not re.search('\*', leaf):
-            non_trace_leaves.append(leaf)
-
-    return " ".join(non_trace_leaves)
+    return " ".join([leaf for leaf in tree.leaves() if '*' not in leaf])
 
 
 '''
@@ -59,57 +85,206 @@ def get_coordphrases(tree):
 
 
 '''
-Main function.
+Function: Get the rows of the coordination phrases of every arity of a
+batch of lines of PTB.ext. Run in the worker processes.
+Input: list of lines (strings, each one bracketed tree)
+Output: number of lines read (int), list of rows (lists, with the columns
+    of NARY_COLUMNS)
 '''
-if __name__ == "__main__":
+def get_rows(lines):
+    rows = []
+    for sent_tree in lines:
 
-    print("Beginning parse of PTB.ext...")
+        # Parse this sent_tree into an NLTK tree object. Parent pointers
+        # are not needed, so a plain Tree will do.
+        tree = Tree.fromstring(sent_tree)
 
-    data = []
-    num_lines = rawgencount("PTB.ext")
+        # Get all phrases in this tree, and the sentence text only once
+        sent_text = None
+        for phrase in get_coordphrases(tree):
 
-    with open('PTB.ext', encoding='utf-8') as f:
-        for sent_tree in tqdm(f, total=num_lines):
+            conjuncts = phrase[0]
+            conjunction = phrase[1]
+            phrase_cat = phrase[2]
+            phrase_text = phrase[3]
 
-            # Parse this sent_tree into an NLTK tree object
-            tree = ParentedTree.fromstring(sent_tree)
+            if sent_text is None:
+                sent_text = get_tree_text(tree)
 
-            # Get all phrases in this tree
-            for phrase in get_coordphrases(tree):
+            rows.append([[cat.split('-')[0] for (cat, text) in conjuncts],
+                         [text for (cat, text) in conjuncts],
+                         len(conjuncts),
+                         phrase_cat.split('-')[0],
+                         phrase_text,
+                         conjunction,
+                         sent_text,
+                         sent_tree])
 
-                conjuncts = phrase[0]
-                conjunction = phrase[1]
-                phrase_cat = phrase[2]
-                phrase_text = phrase[3]
-                sent_text = get_tree_text(tree)
+    return len(lines), rows
+
+
+'''
+Function: Get the Parquet schema of the phrases of every arity, so that
+every chunk is written with list<string> conjunct columns, even one in
+which all the lists are empty.
+Input: None
+Output: pyarrow schema
+'''
+def nary_schema():
+    import pyarrow as pa
+
+    types = {'Conjunct Categories': pa.list_(pa.string()),
+             'Conjunct Texts': pa.list_(pa.string()),
+             'Number of Conjuncts': pa.int64()}
+    return pa.schema([(column, types.get(column, pa.string()))
+                      for column in NARY_COLUMNS])
+
+
+'''
+Function: Get the Parquet schema of the two-termed coordination phrases,
+in which every column is a string, so that the type of a column does not
+depend on the first chunk written.
+Input: None
+Output: pyarrow schema
+'''
+def ccps_schema():
+    import pyarrow as pa
+
+    return pa.schema([(column, pa.string()) for column in COLUMNS])
+
+
+'''
+Function: Get the two-termed coordination phrases of a table of phrases
+of every arity, in the layout of PTB_ccps.csv.
+Input: pandas DataFrame with the columns of NARY_COLUMNS
+Output: pandas DataFrame with the columns of COLUMNS
+'''
+def two_conjunct_view(df):
+    df = df[df['Number of Conjuncts'] == 2]
+    cats = list(df['Conjunct Categories'])
+    texts = list(df['Conjunct Texts'])
+    view = pd.DataFrame({
+        '1st Conjunct Category': [c[0] for c in cats],
+        '1st Conjunct Text': [t[0] for t in texts],
+        '2nd Conjunct Category': [c[1] for c in cats],
+        '2nd Conjunct Text': [t[1] for t in texts]})
+    for column in COLUMNS[4:]:
+        view[column] = df[column].to_numpy()
+    return view[COLUMNS]
+
+
+'''
+Function: Read a file in batches of lines.
+Input: open file, lines per batch (int)
+Output: generator of lists of lines
+'''
+def read_batches(f, batch_lines):
+    batch = []
+    for line in f:
+        batch.append(line)
+        if len(batch) == batch_lines:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Find the coordination phrases of PTB.ext.')
+    parser.add_argument('input_file', nargs='?', type=str, default='PTB.ext',
+                        help='path to PTB.ext (default: PTB.ext)')
+    parser.add_argument('--coords', type=str,
+                        default='csv/PTB/PTB_coords.parquet',
+                        help='path of the phrases of every arity, a Parquet '
+                        'file (default: csv/PTB/PTB_coords.parquet)')
+    parser.add_argument('--output', type=str,
+                        default='csv/PTB/PTB_ccps.csv',
+                        help='path of the two-termed phrases '
+                        '(default: csv/PTB/PTB_ccps.csv)')
+    parser.add_argument('--view', action='store_true',
+                        help='only write --output, from the phrases in '
+                        '--coords, without reading the treebank')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes, 0 for one per core '
+                        '(default: 1, which works in this process)')
+    parser.add_argument('--batch-lines', type=int, default=BATCH_LINES,
+                        help='lines handed to a worker at a time (default: '
+                        + str(BATCH_LINES) + ')')
+    args = parser.parse_args()
+    if table_format(args.coords) != 'parquet':
+        parser.error('--coords must be a Parquet file')
+    return args
+
+
+'''
+Function: Make the directory of an output file, if it does not exist.
+Input: path (string)
+Output: None
+'''
+def make_dir(path):
+    dest_dir = os.path.dirname(path)
+    if dest_dir and not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
+
+
+'''
+Main function.
+'''
+if __name__ == "__main__":
 
-                # Only include two-termed coordinations
-                if len(conjuncts) != 2:
-                    continue
+    args = get_args()
+    make_dir(args.output)
+    schema = None
+    if table_format(args.output) == 'parquet':
+        schema = ccps_schema()
+    out = TableAppender(args.output, COLUMNS, schema=schema)
 
-                row = []
-                for (cat, text) in conjuncts:
-                    row.append(cat.split('-')[0])
-                    row.append(text)
+    if args.view:
+        print("Reading the phrases of " + args.coords + "...")
+        for chunk in tqdm(iter_table(args.coords)):
+            view = two_conjunct_view(chunk)
+            if len(view):
+                out.append(view)
+        out.close()
+        print("All done! The result is stored in " + args.output + ".")
+        sys.exit(0)
 
-                row.append(phrase_cat.split('-')[0])
-                row.append(phrase_text)
-                row.append(conjunction)
-                row.append(sent_text)
-                row.append(sent_tree)
+    print("Beginning parse of " + args.input_file + "...")
 
-                data.append(row)
+    num_lines = rawgencount(args.input_file)
+    workers = args.workers or os.cpu_count()
+    pool = mp.Pool(workers) if workers > 1 else None
 
-    columns = ['1st Conjunct Category', '1st Conjunct Text',
-               '2nd Conjunct Category', '2nd Conjunct Text',
-               'Phrase Category', 'Phrase Text',
-               'Conjunction', 'Sentence Text', 'Sentence Parse Tree']
+    make_dir(args.coords)
+    coords = TableAppender(args.coords, NARY_COLUMNS, schema=nary_schema())
 
-    df = pd.DataFrame(data, columns=columns)
+    with open(args.input_file, encoding='utf-8') as f:
+        tasks = ((get_rows, (batch,))
+                 for batch in read_batches(f, args.batch_lines))
+        if pool is None:
+            results = (func(*task_args) for func, task_args in tasks)
+        else:
+            results = pool_results(pool, tasks, 2 * workers)
 
-    if not os.path.exists('csv/PTB/'):
-        os.makedirs('csv/PTB/')
+        with tqdm(total=num_lines) as progress:
+            for (n, rows) in results:
+                if rows:
+                    df = pd.DataFrame(rows, columns=NARY_COLUMNS)
+                    coords.append(df)
+                    view = two_conjunct_view(df)
+                    if len(view):
+                        out.append(view)
+                progress.update(n)
 
-    df.to_csv('csv/PTB/PTB_ccps.csv', index=False)
+    coords.close()
+    out.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    print("All done! The result is stored in csv/PTB/PTB.csv.")
\ No newline at end of file
+    print("All done! The phrases are stored in " + args.coords
+          + ", the two-termed ones in " + args.output + ".")
@@ -0,0 +1,1140 @@
+#!/usr/bin/env python
+# benchmark.py
+# Benchmarks and differential checks for the corpus processing stages.
+# Each stage has its own subcommand, e.g.:
+#     python benchmark.py clean COCA/*/*
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+
+# Hand-written lines that exercise every rule of COCAcleaner.clean_html,
+# including the orderings in which one rule creates or destroys a match
+# for a later one.
+CLEAN_SAMPLES = [
+    "##4001234 <p> The cat (a tabby) sat on the mat. </p>\n",
+    "@!SMITH: Thank you for having me. @!JONES// Of course!\n",
+    "<script type='x'>var a = 1 < 2;</script> Body text <b>here</b>.\n",
+    "<STYLE>p {}</style><!-- a comment with > inside --> text\n",
+    "<a <!-- > --> still text > more\n",
+    "Unclosed (parenthetical and <tag without end\n",
+    "alt=\"img\" src=\"x.jpg\" trailing words\n",
+    "Prices rose 5% & then %&% Title Here %&% fell.\n",
+    "Some \t tabs\tand   spaces\x0b and\x1c odd whitespace\n",
+    "http://example.com/path // double slashes ///\n",
+    "((nested (parens)) remain) after\n",
+    "##12##34 header## ##5 x\n",
+    "   \n",
+    "\n",
+    "Plain sentence with nothing to clean.\n",
+    "<!--unterminated comment <b>bold</b>\n",
+    "@@!!name text ^^ ** :: \"quotes\"\n",
+    "café — naïve  nbsp　ideographic space\n",
+]
+
+# Hand-written parse strings that exercise every branch of
+# ccpfinder.get_simple_coordphrases, and the strings it rejects or trips
+# over, which treescan hands back to it.
+CCP_SAMPLES = [
+    "(S (NP (NP (DT the) (NN cat)) (CC and) (NP (DT the) (NN dog))) (VP (VBD sat)))",
+    "(S (NP (CC neither) (NP (NN tea)) (CC nor) (NP (NN coffee))) (VP (VBZ is)))",
+    "(S (NP (PRP I)) (VP (VBD saw) (NP (NN a)) (CC and) (NP (NN b))))",
+    "(S (VP (VB go) (NP (NN a)) (CC or) (PP (IN in) (NP (NN b)))))",
+    "(X (CC and) (CC or) (CC but))",
+    "(NP (NP (NN a)) (, ,) (NP (NN b)) (CC or) (NP (NN c)))",
+    "(S (CC But) (NP (PRP he)) (VP (VBD left)))",
+    "(NP (NP (NN a)) (CC and))",
+    "( (S (NP (NN a)) (CC and) (NP (NN b))))",
+    "(S\n  (NP (NN a))\t(CC  and)(NP (NN b)))",
+    "(S (NP (NN a)) (CC and) b)",
+    "(VP (VB a) (NP b) and (NP c))",
+    "(CC and)",
+    "(S (NP (NN a)) (CC and) (NP (NN b))) extra",
+    "(S (NP (NN a))",
+    "",
+]
+
+CLEAN_ALPHABET = ['<', '>', '!', '-', '#', '1', '(', ')', '@', 'a', ' ',
+                  '  ', '\t', '/', '%', '&', 'alt=', ' src=', 'script',
+                  'style', '<!--', '-->', '\n', 'word', '.', '"', ':']
+
+
+def random_clean_lines(n, seed):
+    '''
+    Function: Generate random lines built from the characters and
+    substrings that the cleaning rules react to.
+    Input: number of lines (int), random seed
+    Output: list of strings
+    '''
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n):
+        pieces = [rng.choice(CLEAN_ALPHABET)
+                  for _ in range(rng.randint(0, 40))]
+        lines.append("".join(pieces) + "\n")
+    return lines
+
+
+def read_lines(files):
+    '''
+    Function: Read all lines of the given files.
+    Input: list of file paths
+    Output: list of strings
+    '''
+    lines = []
+    for file in files:
+        with open(file, encoding='utf-8') as f:
+            lines.extend(f)
+    return lines
+
+
+def time_per_line(func, lines):
+    '''
+    Function: Apply func to every line and time it.
+    Input: function, list of strings
+    Output: list of results, elapsed seconds
+    '''
+    start = time.perf_counter()
+    results = [func(line) for line in lines]
+    return results, time.perf_counter() - start
+
+
+def report_rate(name, count, elapsed, unit):
+    print("  " + name.ljust(12) + "{:>12.0f}".format(count / max(elapsed, 1e-9))
+          + " " + unit + "/sec  (" + "{:.2f}".format(elapsed) + " s)")
+
+
+def bench_clean(args):
+    '''
+    Differential check and throughput comparison of COCAcleaner.clean_html
+    and COCAcleaner.clean_line.
+    '''
+    from COCAcleaner import clean_html, clean_line
+
+    if args.input_files:
+        lines = read_lines(args.input_files)
+    else:
+        lines = CLEAN_SAMPLES + random_clean_lines(args.random, args.seed)
+    print("Comparing cleaners on " + str(len(lines)) + " lines...")
+
+    expected, ref_time = time_per_line(clean_html, lines)
+    actual, fast_time = time_per_line(clean_line, lines)
+
+    mismatches = [i for i in range(len(lines)) if expected[i] != actual[i]]
+    for i in mismatches[:10]:
+        print("MISMATCH on line " + str(i) + ": " + repr(lines[i]))
+        print("  clean_html: " + repr(expected[i]))
+        print("  clean_line: " + repr(actual[i]))
+
+    report_rate("clean_html", len(lines), ref_time, "lines")
+    report_rate("clean_line", len(lines), fast_time, "lines")
+    print(str(len(mismatches)) + " mismatching line(s).")
+    return 1 if mismatches else 0
+
+
+def bench_segment(args):
+    '''
+    Differential check and throughput comparison of per-line
+    nltk.sent_tokenize and the batched COCAcleaner.segment.
+    '''
+    import nltk
+    from COCAcleaner import clean_line, segment
+
+    cleaned = [clean_line(line) for line in read_lines(args.input_files)]
+    print("Comparing segmenters on " + str(len(cleaned)) + " lines...")
+
+    start = time.perf_counter()
+    expected = []
+    for text in cleaned:
+        for sent in nltk.sent_tokenize(text):
+            sent_len = len(sent.split())
+            if sent_len > 3 and sent_len < 300:
+                expected.append(sent)
+    ref_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = segment(cleaned)
+    batch_time = time.perf_counter() - start
+
+    report_rate("per-line", len(cleaned), ref_time, "lines")
+    report_rate("batched", len(cleaned), batch_time, "lines")
+    if expected != actual:
+        print("MISMATCH: " + str(len(expected)) + " sentences expected, "
+              + str(len(actual)) + " produced.")
+        return 1
+    print("Identical output (" + str(len(actual)) + " sentences).")
+    return 0
+
+
+def bench_io(args):
+    '''
+    Wall-clock time and bytes on disk of the cleaning stage and the line
+    counter for plain and compressed copies of the given COCA files.
+    '''
+    from corpusio import COMPRESSIONS, open_file, split_compression
+    from COCAcleaner import clean_file
+    from linecounter import rawgencount
+
+    workdir = tempfile.mkdtemp(dir=args.tmpdir)
+    try:
+        print("format".ljust(8) + "input bytes".rjust(15)
+              + "output bytes".rjust(15) + "write s".rjust(10)
+              + "count s".rjust(10) + "clean s".rjust(10))
+        for fmt in args.formats:
+            ext = '' if fmt == 'none' else COMPRESSIONS[fmt]
+            in_bytes = out_bytes = 0
+            write_time = count_time = clean_time = 0.0
+
+            for file in args.input_files:
+                name = split_compression(os.path.basename(file))[0]
+                src = os.path.join(workdir, 'in_' + name + ext)
+                dest = os.path.join(workdir, 'out_' + name + ext)
+
+                start = time.perf_counter()
+                with open_file(file, 'rb') as fin:
+                    with open_file(src, 'wb') as fout:
+                        shutil.copyfileobj(fin, fout, 1024 * 1024)
+                write_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                rawgencount(src)
+                count_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                clean_file(src, dest)
+                clean_time += time.perf_counter() - start
+
+                in_bytes += os.path.getsize(src)
+                out_bytes += os.path.getsize(dest)
+                os.remove(src)
+                os.remove(dest)
+
+            print(fmt.ljust(8) + str(in_bytes).rjust(15)
+                  + str(out_bytes).rjust(15)
+                  + "{:.2f}".format(write_time).rjust(10)
+                  + "{:.2f}".format(count_time).rjust(10)
+                  + "{:.2f}".format(clean_time).rjust(10))
+    finally:
+        shutil.rmtree(workdir)
+    return 0
+
+
+def parse_size(text):
+    '''
+    Function: Parse a size such as 512K, 100M or 10G into bytes.
+    Input: string
+    Output: int
+    '''
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+
+def write_test_file(path, size, seed):
+    '''
+    Function: Write a text file of the given size made of random-length
+    lines, by repeating a 1 MiB block.
+    Input: path (string), size in bytes (int), random seed
+    '''
+    rng = random.Random(seed)
+    block = bytearray()
+    while len(block) < 1024 * 1024:
+        block += b'x' * rng.randint(0, 300) + b'\n'
+    block = bytes(block[:1024 * 1024])
+
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            chunk = block[:size - written]
+            f.write(chunk)
+            written += len(chunk)
+
+
+def bench_count(args):
+    '''
+    Compare the original 1 MiB read loop with the parallel mmap line
+    counter and its cache, on generated files of the given sizes.
+    '''
+    import linecounter
+
+    workdir = tempfile.mkdtemp(dir=args.tmpdir)
+    linecounter.CACHE_PATH = os.path.join(workdir, 'linecounts.json')
+    try:
+        print("size".rjust(8) + "serial s".rjust(11) + "mmap s".rjust(11)
+              + "cached s".rjust(11) + "speedup".rjust(9))
+        for text in args.sizes:
+            path = os.path.join(workdir, 'lines_' + text + '.txt')
+            write_test_file(path, parse_size(text), args.seed)
+
+            start = time.perf_counter()
+            expected = linecounter.serial_count(path)
+            serial_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = linecounter.rawgencount(path, args.workers)
+            mmap_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cached = linecounter.rawgencount(path, args.workers)
+            cached_time = time.perf_counter() - start
+
+            os.remove(path)
+            if not expected == actual == cached:
+                print("MISMATCH for " + text + ": " + str(expected) + ", "
+                      + str(actual) + ", " + str(cached))
+                return 1
+
+            print(text.rjust(8) + "{:.3f}".format(serial_time).rjust(11)
+                  + "{:.3f}".format(mmap_time).rjust(11)
+                  + "{:.4f}".format(cached_time).rjust(11)
+                  + "{:.1f}x".format(serial_time / max(mmap_time, 1e-9)).rjust(9))
+    finally:
+        shutil.rmtree(workdir)
+    return 0
+
+
+def read_head(file, n):
+    '''
+    Function: Read the first n lines of a (possibly compressed) file.
+    Input: path (string), number of lines (int)
+    Output: list of strings
+    '''
+    from itertools import islice
+    from corpusio import open_file
+
+    with open_file(file) as f:
+        return list(islice(f, n))
+
+
+def bench_parse(args):
+    '''
+    Sentences/sec of fileparser.parse_lines at several batch sizes, with a
+    check that every batch size gives the rows of the per-line mode. With
+    --workers, also the throughput of the parser pool at each worker count.
+    '''
+    import fileparser
+    from fileparser import load_model, parse_lines
+
+    lines = read_head(args.input_file, args.lines)
+    nlp = load_model()
+
+    # Warm up the models, so that the first batch size is not penalized
+    list(parse_lines(nlp, lines[:10]))
+
+    print("Parsing " + str(len(lines)) + " lines of " + args.input_file
+          + "...")
+    expected = None
+    status = 0
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        rows = list(parse_lines(nlp, lines, batch_size))
+        elapsed = time.perf_counter() - start
+
+        report_rate("batch " + str(batch_size), len(rows), elapsed,
+                    "sentences")
+        if expected is None:
+            expected = rows
+        elif rows != expected:
+            print("  MISMATCH: rows differ from batch size "
+                  + str(args.batch_sizes[0]))
+            status = 1
+
+    for workers in args.workers:
+        pool = fileparser.create_pool(workers)
+        # Let the workers load their models before timing
+        pool.starmap(fileparser.parse_shard,
+                     [(None, None, None, lines[:1], 1, False)] * workers)
+
+        tasks = [(None, None, None, lines[k:k + args.shard_lines],
+                  args.batch_sizes[0], False)
+                 for k in range(0, len(lines), args.shard_lines)]
+        start = time.perf_counter()
+        results = pool.starmap(fileparser.parse_shard, tasks, chunksize=1)
+        elapsed = time.perf_counter() - start
+        pool.close()
+        pool.join()
+
+        rows = [row for (shard_rows, _) in results for row in shard_rows]
+        report_rate(str(workers) + " workers", len(rows), elapsed,
+                    "sentences")
+        if rows != expected:
+            print("  MISMATCH: pool rows differ from the single process")
+            status = 1
+    return status
+
+
+def bench_bucket(args):
+    '''
+    Padding efficiency and sentences/sec of fileparser.parse_lines with
+    plain and length-bucketed batches, one window of --shard-lines lines at
+    a time as in the parser, with a check that both give the same rows.
+    '''
+    from fileparser import load_model, parse_lines, batch_padding
+
+    lines = read_head(args.input_file, args.lines)
+    windows = [lines[k:k + args.shard_lines]
+               for k in range(0, len(lines), args.shard_lines)]
+
+    print("Padding efficiency of " + str(len(lines)) + " lines of "
+          + args.input_file + ":")
+    for batch_size in args.batch_sizes:
+        for bucket in [False, True]:
+            tokens = 0
+            padded = 0
+            for window in windows:
+                t, p = batch_padding(window, batch_size, bucket)
+                tokens += t
+                padded += p
+            name = ('bucketed ' if bucket else 'plain ') + str(batch_size)
+            print("  " + name.ljust(12) + "{:>11.1f}".format(
+                100 * tokens / max(padded, 1)) + "%")
+
+    nlp = load_model()
+    list(parse_lines(nlp, lines[:10]))
+
+    print("Parsing " + str(len(lines)) + " lines...")
+    status = 0
+    for batch_size in args.batch_sizes:
+        results = []
+        for bucket in [False, True]:
+            start = time.perf_counter()
+            rows = [row for window in windows
+                    for row in parse_lines(nlp, window, batch_size, bucket)]
+            elapsed = time.perf_counter() - start
+            name = ('bucketed ' if bucket else 'plain ') + str(batch_size)
+            report_rate(name, len(rows), elapsed, "sentences")
+            results.append(rows)
+        if results[0] != results[1]:
+            print("  MISMATCH: bucketed rows differ from plain batches")
+            status = 1
+    return status
+
+
+def bench_cache(args):
+    '''
+    Lines/sec of fileparser.parse_lines without the parse cache, with an
+    empty cache and with the cache filled by the previous run, along with
+    the hit rate of each, and a check that all three give the same rows.
+    '''
+    from collections import Counter
+    from fileparser import load_model, parse_lines, open_cache, model_version
+
+    lines = read_head(args.input_file, args.lines)
+    nlp = load_model()
+    list(parse_lines(nlp, lines[:10]))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = open_cache(model_version(nlp),
+                           os.path.join(tmpdir, 'parsecache.sqlite'))
+        print("Parsing " + str(len(lines)) + " lines of " + args.input_file
+              + "...")
+        expected = None
+        status = 0
+        for name, run_cache in [('no cache', None), ('cold cache', cache),
+                                ('warm cache', cache)]:
+            stats = Counter()
+            start = time.perf_counter()
+            rows = list(parse_lines(nlp, lines, args.batch_size, False,
+                                    run_cache, stats))
+            elapsed = time.perf_counter() - start
+            report_rate(name, len(lines), elapsed, "lines")
+            print("  " + ' ' * 12 + "{:>11.1f}".format(
+                100 * stats['cached'] / max(stats['lines'], 1))
+                + "% hit rate")
+            if expected is None:
+                expected = rows
+            elif rows != expected:
+                print("  MISMATCH: rows with the " + name
+                      + " differ from parsing every line")
+                status = 1
+        cache.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return status
+
+
+def bench_heads(args):
+    '''
+    Rows/sec of headfinder with one get_head call per conjunct, as before,
+    against find_heads without a cache, with an empty cache and with the
+    cache filled by the previous run, along with the share of distinct
+    conjunct texts, and a check that all of them give the same heads.
+    '''
+    from collections import Counter
+    from functools import partial
+    from tablestore import read_table
+    from parsecache import ParseCache
+    from nlpmodels import load_pipeline, pipeline_version
+    import headfinder
+
+    df = read_table(args.input_file,
+                    columns=['1st Conjunct Text', '2nd Conjunct Text'])
+    if args.rows:
+        df = df[:args.rows]
+    phrases = ([str(text) for text in df['1st Conjunct Text']]
+               + [str(text) for text in df['2nd Conjunct Text']])
+    headfinder.nlp = load_pipeline("en_core_web_lg")
+    find = partial(headfinder.get_heads, batch_size=args.batch_size)
+
+    print("Finding heads of the conjuncts of " + str(len(df)) + " rows of "
+          + args.input_file + "...")
+    start = time.perf_counter()
+    expected = [headfinder.get_head(phrase) for phrase in phrases]
+    report_rate('get_head', len(df), time.perf_counter() - start, "rows")
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(os.path.join(tmpdir, 'parsecache.sqlite'),
+                           headfinder.CACHE_MODEL,
+                           pipeline_version(headfinder.nlp),
+                           normalize_keys=False)
+        status = 0
+        for name, run_cache in [('no cache', None), ('cold cache', cache),
+                                ('warm cache', cache)]:
+            stats = Counter()
+            start = time.perf_counter()
+            heads = headfinder.find_heads(phrases, find, run_cache, stats)
+            report_rate(name, len(df), time.perf_counter() - start, "rows")
+            print("  " + ' ' * 12 + "{:>11.1f}".format(
+                100 * stats['unique'] / max(stats['phrases'], 1))
+                + "% distinct, " + str(stats['cached']) + " cached")
+            if heads != expected:
+                print("  MISMATCH: heads with " + name
+                      + " differ from get_head")
+                status = 1
+        cache.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return status
+
+
+def bench_profile(args):
+    '''
+    Sentences/sec of fileparser.parse_lines with each pipeline profile,
+    with the time spent in each component, and a check that every profile
+    gives the rows of the full pipeline.
+    '''
+    from fileparser import load_model, parse_lines
+    from nlpmodels import component_times, format_times
+
+    lines = read_head(args.input_file, args.lines)
+    print("Parsing " + str(len(lines)) + " lines of " + args.input_file
+          + "...")
+    expected = None
+    status = 0
+    for profile in args.profiles:
+        nlp = load_model(profile, timed=True)
+        list(parse_lines(nlp, lines[:10]))
+
+        before = component_times(nlp)
+        start = time.perf_counter()
+        rows = list(parse_lines(nlp, lines, args.batch_size))
+        elapsed = time.perf_counter() - start
+        times = {name: seconds - before[name]
+                 for name, seconds in component_times(nlp).items()}
+
+        report_rate(profile, len(rows), elapsed, "sentences")
+        print("    " + format_times(times))
+        if expected is None:
+            expected = rows
+        elif rows != expected:
+            print("  MISMATCH: rows differ from the " + args.profiles[0]
+                  + " profile")
+            status = 1
+    return status
+
+
+def bench_store(args):
+    '''
+    Load times of csv tables and of the same tables stored as Parquet, in
+    full and for a single column, along with their sizes, and a check that
+    every Parquet table reads back as the csv does.
+    '''
+    import pandas as pd
+    from tablestore import read_table, write_table
+
+    tmpdir = tempfile.mkdtemp()
+    status = 0
+    try:
+        for file in args.input_files:
+            dest = os.path.join(tmpdir, 'table.parquet')
+            df = read_table(file)
+            write_table(df, dest)
+            column = args.column if args.column in df.columns \
+                else df.columns[-1]
+
+            print(file + " (" + str(len(df.index)) + " rows): csv "
+                  + "{:.1f}".format(os.path.getsize(file) / 1000000)
+                  + " MB, parquet "
+                  + "{:.1f}".format(os.path.getsize(dest) / 1000000) + " MB")
+            for name, path, columns in [('csv', file, None),
+                                        ('parquet', dest, None),
+                                        ('csv 1 col', file, [column]),
+                                        ('parquet 1 col', dest, [column])]:
+                start = time.perf_counter()
+                table = read_table(path, columns)
+                elapsed = time.perf_counter() - start
+                report_rate(name, len(table.index), elapsed, "rows")
+
+            # Parquet keeps fields like 'NA' as strings, which read_csv
+            # turns into missing values by default, so compare as strings.
+            expected = df.astype(str)
+            if not read_table(dest).astype(str).equals(expected):
+                print("  MISMATCH: the Parquet table differs from the csv")
+                status = 1
+    finally:
+        shutil.rmtree(tmpdir)
+    return status
+
+
+def bench_ccp(args):
+    '''
+    Rows/sec of treescan.find_coordphrases and of the original
+    ParentedTree-based extraction, with a check that both give the same
+    phrases and sentence text (or raise the same error) for every parse
+    tree of the input tables and for CCP_SAMPLES.
+    '''
+    from tablestore import read_table
+    from treescan import find_coordphrases, reference_coordphrases
+
+    def outcome(func, tree):
+        try:
+            return func(tree)
+        except Exception as e:
+            return type(e).__name__
+
+    trees = list(CCP_SAMPLES)
+    for file in args.input_files:
+        trees.extend(read_table(file, columns=['Sentence Parse Tree'])
+                     ['Sentence Parse Tree'].astype(str))
+    if args.rows:
+        trees = trees[:args.rows]
+
+    print("Extracting coordination phrases from " + str(len(trees))
+          + " parse trees...")
+    results = {}
+    for name, func in [('nltk', reference_coordphrases),
+                       ('treescan', find_coordphrases)]:
+        start = time.perf_counter()
+        results[name] = [outcome(func, tree) for tree in trees]
+        report_rate(name, len(trees), time.perf_counter() - start, "rows")
+
+    mismatches = [tree for tree, a, b in zip(trees, results['nltk'],
+                                             results['treescan']) if a != b]
+    for tree in mismatches[:10]:
+        print("  MISMATCH: " + repr(tree))
+    return 1 if mismatches else 0
+
+
+def bench_ccpchunks(args):
+    '''
+    Trees/sec of ccpfinder.find_file with several pool sizes, with a check
+    that the result equals the whole-table extraction followed by
+    drop_duplicates, also when the seen rows are moved to disk.
+    '''
+    import multiprocessing as mp
+    import pandas as pd
+    from ccpfinder import find_file, find_chunk, COLUMNS
+    from tablestore import read_table
+
+    tmpdir = tempfile.mkdtemp()
+    status = 0
+    try:
+        for file in args.input_files:
+            trees = read_table(file, columns=['Sentence Parse Tree'])
+            rows = find_chunk(trees['Sentence Parse Tree'].tolist())[0]
+            expected = pd.DataFrame(rows, columns=COLUMNS).drop_duplicates()
+            expected = expected.reset_index(drop=True).astype(str)
+            print(file + " (" + str(len(trees.index)) + " trees, "
+                  + str(len(expected.index)) + " unique rows)")
+
+            runs = [("workers " + str(w), w, args.max_seen)
+                    for w in args.workers]
+            runs.append(("workers 1, spilled", 1, 0))
+            for name, workers, max_seen in runs:
+                dest = os.path.join(tmpdir, 'ccps.csv')
+                pool = mp.Pool(workers) if workers > 1 else None
+                start = time.perf_counter()
+                find_file(file, dest, args.chunk_rows, pool=pool,
+                          workers=workers, max_seen=max_seen)
+                elapsed = time.perf_counter() - start
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+                report_rate(name, len(trees.index), elapsed, "trees")
+
+                result = pd.read_csv(dest, dtype=str, keep_default_na=False)
+                if not result.equals(expected):
+                    print("  MISMATCH: " + name + " differs from "
+                          "drop_duplicates")
+                    status = 1
+    finally:
+        shutil.rmtree(tmpdir)
+    return status
+
+
+def bench_treestore(args):
+    '''
+    Rows/sec of coordination phrase extraction and of the sentence text,
+    from nltk trees, from the bracket scanner and from a tree store, with a
+    check that the store gives the same phrases and text (or raises the
+    same error) and the same parse string for every tree of the input
+    tables and of CCP_SAMPLES.
+    '''
+    import pandas as pd
+    from nltk import ParentedTree
+    from tablestore import read_table, write_table
+    from treescan import (find_coordphrases, reference_coordphrases,
+                          scan)
+    from treestore import build_store, TreeStore
+
+    def outcome(func, *func_args):
+        try:
+            return func(*func_args)
+        except Exception as e:
+            return type(e).__name__
+
+    trees = list(CCP_SAMPLES)
+    for file in args.input_files:
+        trees.extend(read_table(file, columns=['Sentence Parse Tree'])
+                     ['Sentence Parse Tree'].astype(str))
+    if args.rows:
+        trees = trees[:args.rows]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        table = os.path.join(tmpdir, 'trees.parquet')
+        write_table(pd.DataFrame({'Sentence Parse Tree': trees}), table)
+        start = time.perf_counter()
+        build_store(table, os.path.join(tmpdir, 'trees.trees'))
+        report_rate('build', len(trees), time.perf_counter() - start, "rows")
+        store = TreeStore(os.path.join(tmpdir, 'trees.trees'))
+
+        print("Extracting coordination phrases from " + str(len(trees))
+              + " parse trees...")
+        results = {}
+        for name, func, items in [
+                ('nltk', reference_coordphrases, trees),
+                ('treescan', find_coordphrases, trees),
+                ('treestore', lambda tree: tree.coordphrases(), store)]:
+            start = time.perf_counter()
+            results[name] = [outcome(func, item) for item in items]
+            report_rate(name, len(trees), time.perf_counter() - start,
+                        "rows")
+
+        print("Getting the sentence text of " + str(len(trees))
+              + " parse trees...")
+        for name, func, items in [
+                ('nltk', lambda tree: " ".join(
+                    ParentedTree.fromstring(tree).leaves()), trees),
+                ('treescan', lambda tree: " ".join(scan(tree)[5]), trees),
+                ('treestore', lambda tree: tree.text(), store)]:
+            start = time.perf_counter()
+            for item in items:
+                outcome(func, item)
+            report_rate(name, len(trees), time.perf_counter() - start,
+                        "rows")
+
+        mismatches = [tree for tree, a, b in zip(trees, results['nltk'],
+                                                 results['treestore'])
+                      if a != b]
+        mismatches.extend(tree for tree, stored in zip(trees, store)
+                          if stored.string() != tree)
+        print(str(len(store.raw)) + " of " + str(len(trees))
+              + " trees kept verbatim.")
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for tree in mismatches[:10]:
+        print("  MISMATCH: " + repr(tree))
+    return 1 if mismatches else 0
+
+
+def bench_treeindex(args):
+    '''
+    Time of a coordination phrase query through the index of treeindex.py
+    and by running ccpfinder over the whole tree store and filtering its
+    output, with a check that both give the same rows.
+    '''
+    import pandas as pd
+    from ccpfinder import find_file, COLUMNS
+    from treeindex import query_store, ccp_matches
+    from tablestore import TableAppender
+
+    tmpdir = tempfile.mkdtemp()
+    status = 0
+    try:
+        for path in args.stores:
+            print(path + ": first " + str(args.first) + ", second "
+                  + str(args.second) + ", conjunction " + str(args.conj))
+
+            dest = os.path.join(tmpdir, 'scan.csv')
+            start = time.perf_counter()
+            find_file(path, dest)
+            df = pd.read_csv(dest, dtype=str, keep_default_na=False)
+            phrases = zip(zip(df['1st Conjunct Category'],
+                              df['1st Conjunct Text']),
+                          df['Conjunction'],
+                          zip(df['2nd Conjunct Category'],
+                              df['2nd Conjunct Text']))
+            expected = df[[ccp_matches(phrase, args.first, args.second,
+                                       args.conj) for phrase in phrases]]
+            elapsed = time.perf_counter() - start
+            print("  full scan          " + str(len(expected.index))
+                  + " rows  ({:.2f} s)".format(elapsed))
+
+            dest = os.path.join(tmpdir, 'query.csv')
+            out = TableAppender(dest, COLUMNS)
+            start = time.perf_counter()
+            candidates, trees, rows = query_store(
+                path, args.first, args.second, args.conj, out=out)
+            out.close()
+            elapsed = time.perf_counter() - start
+            print("  index              " + str(rows) + " rows  ({:.2f} s, "
+                  .format(elapsed) + str(candidates) + " of " + str(trees)
+                  + " trees matched)")
+
+            result = pd.read_csv(dest, dtype=str, keep_default_na=False)
+            expected = expected.reset_index(drop=True)
+            if not result.equals(expected):
+                print("  MISMATCH: the index query differs from the scan")
+                status = 1
+    finally:
+        shutil.rmtree(tmpdir)
+    return status
+
+
+def bench_treequery(args):
+    '''
+    Rows/sec of the ccp reference query of treequery.py, alone and along
+    with extra queries in the same pass, against the nltk implementation,
+    with a check that the reference query finds the same phrases as
+    get_simple_coordphrases for every parse tree of the input tables and
+    of CCP_SAMPLES on which the latter does not raise.
+    '''
+    from collections import OrderedDict
+    from tablestore import read_table
+    from treescan import reference_coordphrases, Fallback
+    from treequery import Matcher, ScannedTree, REFERENCE_QUERIES
+
+    trees = list(CCP_SAMPLES)
+    for file in args.input_files:
+        trees.extend(read_table(file, columns=['Sentence Parse Tree'])
+                     ['Sentence Parse Tree'].astype(str))
+    if args.rows:
+        trees = trees[:args.rows]
+
+    def engine(matcher, tree):
+        try:
+            tree = ScannedTree(tree)
+        except Fallback:
+            return None
+        return [((found[0][1], found[0][2]), found[1][2],
+                 (found[2][1], found[2][2]))
+                for name, found in matcher.match(tree) if name == 'ccp']
+
+    def reference(tree):
+        try:
+            return reference_coordphrases(tree)[0]
+        except Exception:
+            return None
+
+    print("Matching " + str(len(trees)) + " parse trees...")
+    start = time.perf_counter()
+    expected = [reference(tree) for tree in trees]
+    report_rate('nltk', len(trees), time.perf_counter() - start, "rows")
+
+    extra = OrderedDict((str(k), 'CC in *(@a=* ^ @b=* @c=*)')
+                        for k in range(args.extra))
+    runs = [('ccp query', REFERENCE_QUERIES),
+            ('ccp + ' + str(args.extra) + ' more',
+             OrderedDict(list(REFERENCE_QUERIES.items())
+                         + list(extra.items())))]
+    status = 0
+    for name, queries in runs:
+        matcher = Matcher(queries)
+        start = time.perf_counter()
+        results = [engine(matcher, tree) for tree in trees]
+        report_rate(name, len(trees), time.perf_counter() - start, "rows")
+
+        # The capture order of a match is the order of the captures in
+        # the query: first, conj, second.
+        checked = [(tree, a, b) for tree, a, b
+                   in zip(trees, expected, results) if a is not None]
+        mismatches = [tree for tree, a, b in checked if a != b]
+        print("  " + str(len(checked)) + " trees checked, "
+              + str(len(trees) - len(checked))
+              + " on which nltk raises skipped")
+        for tree in mismatches[:10]:
+            print("  MISMATCH: " + repr(tree))
+        if mismatches:
+            status = 1
+    return status
+
+
+def bench_ptb(args):
+    '''
+    Lines/sec of PTB.get_rows, which finds the phrases of every arity,
+    against the per-line ParentedTree loop it replaced, which only kept the
+    two-termed ones, with a check that two_conjunct_view of the former
+    gives the rows of the latter.
+    '''
+    import re
+    from itertools import islice
+    from nltk import ParentedTree
+    import pandas as pd
+    from PTB import get_rows, two_conjunct_view, NARY_COLUMNS
+
+    with open(args.input_file, encoding='utf-8') as f:
+        lines = list(islice(f, args.lines)) if args.lines else f.readlines()
+
+    def tree_text(tree):
+        return " ".join([leaf for leaf in tree.leaves()
+                         if not re.search('\\*', leaf)])
+
+    def baseline(lines):
+        rows = []
+        for sent_tree in lines:
+            tree = ParentedTree.fromstring(sent_tree)
+            for s in tree.subtrees(lambda t: "-CCP" in t.label()):
+                conjuncts = []
+                conjunction = None
+                for child in s:
+                    if "-COORD" in child.label():
+                        conjuncts.append((child.label(), tree_text(child)))
+                    if "CC-CC" in child.label():
+                        conjunction = tree_text(child)
+                if conjunction is None or len(conjuncts) != 2:
+                    continue
+                sent_text = tree_text(tree)
+                row = []
+                for (cat, text) in conjuncts:
+                    row.append(cat.split('-')[0])
+                    row.append(text)
+                rows.append(row + [s.label().split('-')[0], tree_text(s),
+                                   conjunction, sent_text, sent_tree])
+        return rows
+
+    print("Reading " + str(len(lines)) + " lines of " + args.input_file
+          + "...")
+    start = time.perf_counter()
+    expected = baseline(lines)
+    report_rate('nltk', len(lines), time.perf_counter() - start, "lines")
+
+    start = time.perf_counter()
+    n, nary = get_rows(lines)
+    report_rate('get_rows', n, time.perf_counter() - start, "lines")
+
+    rows = two_conjunct_view(
+        pd.DataFrame(nary, columns=NARY_COLUMNS)).values.tolist()
+    print("  " + str(len(nary)) + " phrases, " + str(len(rows))
+          + " two-termed, "
+          + ("same" if rows == expected else "MISMATCH"))
+    return 0 if rows == expected else 1
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark and cross-check corpus processing stages.')
+    subparsers = parser.add_subparsers(dest='stage')
+    subparsers.required = True
+
+    clean = subparsers.add_parser(
+        'clean', help='compare clean_html against clean_line')
+    clean.add_argument('input_files', nargs='*', type=str,
+                       help='COCA file(s); random lines are used if omitted')
+    clean.add_argument('--random', type=int, default=200000,
+                       help='number of random lines to generate')
+    clean.add_argument('--seed', type=int, default=0,
+                       help='seed for the random lines')
+    clean.set_defaults(func=bench_clean)
+
+    segment = subparsers.add_parser(
+        'segment', help='compare nltk.sent_tokenize against segment')
+    segment.add_argument('input_files', nargs='+', type=str,
+                         help='COCA file(s)')
+    segment.set_defaults(func=bench_segment)
+
+    io = subparsers.add_parser(
+        'io', help='time plain and compressed corpus I/O')
+    io.add_argument('input_files', nargs='+', type=str,
+                    help='COCA file(s), plain or compressed')
+    io.add_argument('--formats', nargs='+', default=['none', 'gz', 'xz', 'zst'],
+                    choices=['none', 'gz', 'xz', 'zst'],
+                    help='formats to compare')
+    io.add_argument('--tmpdir', type=str, default=None,
+                    help='directory for the temporary copies')
+    io.set_defaults(func=bench_io)
+
+    count = subparsers.add_parser(
+        'count', help='compare line counting implementations')
+    count.add_argument('--sizes', nargs='+', type=str,
+                       default=['1M', '10M', '100M', '1G', '10G'],
+                       help='sizes of the generated files')
+    count.add_argument('--workers', type=int, default=None,
+                       help='worker processes (default: all cores)')
+    count.add_argument('--seed', type=int, default=0,
+                       help='seed for the generated lines')
+    count.add_argument('--tmpdir', type=str, default=None,
+                       help='directory for the generated files')
+    count.set_defaults(func=bench_count)
+
+    parse = subparsers.add_parser(
+        'parse', help='sentences/sec of the parser at several batch sizes')
+    parse.add_argument('input_file', type=str,
+                       help='sampled file to parse')
+    parse.add_argument('--lines', type=int, default=2000,
+                       help='number of lines to parse')
+    parse.add_argument('--batch-sizes', nargs='+', type=int,
+                       default=[1, 8, 32, 128, 512],
+                       help='batch sizes to compare')
+    parse.add_argument('--workers', nargs='*', type=int, default=[],
+                       help='parser pool sizes to compare, using the first '
+                       'batch size')
+    parse.add_argument('--shard-lines', type=int, default=100,
+                       help='lines per pool task')
+    parse.set_defaults(func=bench_parse)
+
+    bucket = subparsers.add_parser(
+        'bucket', help='padding efficiency and sentences/sec of plain and '
+        'length-bucketed parser batches')
+    bucket.add_argument('input_file', type=str,
+                        help='sampled file to parse')
+    bucket.add_argument('--lines', type=int, default=2000,
+                        help='number of lines to parse')
+    bucket.add_argument('--batch-sizes', nargs='+', type=int,
+                        default=[8, 32, 128],
+                        help='batch sizes to compare')
+    bucket.add_argument('--shard-lines', type=int, default=500,
+                        help='lines per scheduling window, as in '
+                        'fileparser.py')
+    bucket.set_defaults(func=bench_bucket)
+
+    cache = subparsers.add_parser(
+        'cache', help='lines/sec and hit rate of the parse cache')
+    cache.add_argument('input_file', type=str,
+                       help='sampled file to parse')
+    cache.add_argument('--lines', type=int, default=2000,
+                       help='number of lines to parse')
+    cache.add_argument('--batch-size', type=int, default=32,
+                       help='parser batch size')
+    cache.set_defaults(func=bench_cache)
+
+    heads = subparsers.add_parser(
+        'heads', help='rows/sec and differential check of the batched, '
+        'deduplicated head finding of headfinder.py')
+    heads.add_argument('input_file', type=str,
+                       help='_ccps table, e.g. csv/acad/acad_ccps.csv')
+    heads.add_argument('--rows', type=int, default=0,
+                       help='number of rows to use (default: all)')
+    heads.add_argument('--batch-size', type=int, default=256,
+                       help='conjunct texts per nlp.pipe batch')
+    heads.set_defaults(func=bench_heads)
+
+    profile = subparsers.add_parser(
+        'profile', help='sentences/sec and component times of the spaCy '
+        'pipeline profiles')
+    profile.add_argument('input_file', type=str,
+                         help='sampled file to parse')
+    profile.add_argument('--lines', type=int, default=2000,
+                         help='number of lines to parse')
+    profile.add_argument('--batch-size', type=int, default=32,
+                         help='parser batch size')
+    profile.add_argument('--profiles', nargs='+', default=['full', 'lean'],
+                         help='profiles to compare, the first one being '
+                         'the reference')
+    profile.set_defaults(func=bench_profile)
+
+    store = subparsers.add_parser(
+        'store', help='load times of csv and Parquet tables')
+    store.add_argument('input_files', nargs='+', type=str,
+                       help='csv tables, e.g. csv/*/*.csv csv/*/*_ccps.csv')
+    store.add_argument('--column', type=str, default='Sentence Parse Tree',
+                       help='column to load on its own (default: the parse '
+                       'tree, or the last column of tables without one)')
+    store.set_defaults(func=bench_store)
+
+    ccp = subparsers.add_parser(
+        'ccp', help='rows/sec and differential check of the bracket '
+        'scanner of ccpfinder.py')
+    ccp.add_argument('input_files', nargs='*', type=str,
+                     help='parse tables, e.g. csv/*/*.csv')
+    ccp.add_argument('--rows', type=int, default=0,
+                     help='number of trees to use (default: all)')
+    ccp.set_defaults(func=bench_ccp)
+
+    ccpchunks = subparsers.add_parser(
+        'ccpchunks', help='trees/sec and check of the chunked, parallel '
+        'ccpfinder.py')
+    ccpchunks.add_argument('input_files', nargs='+', type=str,
+                           help='parse tables, e.g. csv/*/*.csv')
+    ccpchunks.add_argument('--workers', nargs='+', type=int,
+                           default=[1, 2, 4],
+                           help='pool sizes to compare')
+    ccpchunks.add_argument('--chunk-rows', type=int, default=10000,
+                           help='parse trees per chunk')
+    ccpchunks.add_argument('--max-seen', type=int, default=2000000,
+                           help='row digests kept in memory')
+    ccpchunks.set_defaults(func=bench_ccpchunks)
+
+    treestore = subparsers.add_parser(
+        'treestore', help='rows/sec and differential check of the tree '
+        'store of treestore.py')
+    treestore.add_argument('input_files', nargs='*', type=str,
+                           help='parse tables, e.g. csv/*/*.csv')
+    treestore.add_argument('--rows', type=int, default=0,
+                           help='number of trees to use (default: all)')
+    treestore.set_defaults(func=bench_treestore)
+
+    treeindex = subparsers.add_parser(
+        'treeindex', help='time and check of an indexed coordination '
+        'phrase query against a full scan')
+    treeindex.add_argument('stores', nargs='+', type=str,
+                           help='indexed tree stores, e.g. csv/*/*.trees')
+    treeindex.add_argument('--first', type=str, default='ADJP',
+                           help='category of the first conjunct')
+    treeindex.add_argument('--second', type=str, default='PP',
+                           help='category of the second conjunct')
+    treeindex.add_argument('--conj', type=str, default='but',
+                           help='conjunction')
+    treeindex.set_defaults(func=bench_treeindex)
+
+    treequery = subparsers.add_parser(
+        'treequery', help='rows/sec and differential check of the '
+        'reference query of treequery.py')
+    treequery.add_argument('input_files', nargs='*', type=str,
+                           help='parse tables, e.g. csv/*/*.csv')
+    treequery.add_argument('--rows', type=int, default=0,
+                           help='number of trees to use (default: all)')
+    treequery.add_argument('--extra', type=int, default=10,
+                           help='extra queries run in the same pass')
+    treequery.set_defaults(func=bench_treequery)
+
+    ptb = subparsers.add_parser(
+        'ptb', help='lines/sec and differential check of PTB.get_rows')
+    ptb.add_argument('input_file', nargs='?', type=str, default='PTB.ext',
+                     help='path to PTB.ext (default: PTB.ext)')
+    ptb.add_argument('--lines', type=int, default=0,
+                     help='number of lines to use (default: all)')
+    ptb.set_defaults(func=bench_ptb)
+
+    return parser.parse_args()
+
+
+'''
+Main function.
+'''
+if __name__ == "__main__":
+
+    args = get_args()
+    sys.exit(args.func(args))
@@ -4,20 +4,57 @@
 # must have two columns: "Sentence Text", and "Sentence Parse Tree".
 # This script iterates over all rows and find the two-termed coordination
 # phrases in the parse trees. If the input is named 'sample.csv' (or
-# the result is written to 'sample_ccps.csv'.
+# the result is written to 'sample_ccps.csv'. The input may also be a
+# Parquet table ('sample.parquet'), in which case so is the result, and
+# only the parse tree column is read. Or it may be the tree store of a
+# table ('sample.trees', see treestore.py), which is faster to read.
+#
+# The input is read in chunks, which can be handed to a pool of worker
+# processes (--workers), and the result is written chunk by chunk, so that
+# memory stays bounded however large the input is. Duplicate rows are
+# dropped across the whole file, keeping the first occurrence, as
+# DataFrame.drop_duplicates does: a digest of every row written so far is
+# kept in memory, and moved to an sqlite file next to the result once there
+# are more than --max-seen of them.
 
 import pandas as pd
 import os
 import argparse
 import re
-
-from nltk import ParentedTree
+import hashlib
+import sqlite3
+import tempfile
+import multiprocessing as mp
+from collections import deque
 
 from tqdm import tqdm
 
+from manifest import Manifest
+from corpusio import split_compression
+from tablestore import iter_table, table_path, TableAppender, FORMATS
+from treescan import find_coordphrases, reference_coordphrases
+from treestore import TreeStore, is_store, store_meta
+
 
 nor_pattern = re.compile(r'^neither.*nor.*')
 
+COLUMNS = ['1st Conjunct Category', '1st Conjunct Text',
+           '2nd Conjunct Category', '2nd Conjunct Text',
+           'Conjunction', 'Sentence Text', 'Sentence Parse Tree']
+
+# Parse trees read at a time
+CHUNK_ROWS = 50000
+
+# Row digests kept in memory before they are moved to disk (16 bytes each,
+# plus the overhead of the set)
+MAX_SEEN = 2000000
+
+# Digests looked up per sqlite query
+LOOKUP_CHUNK = 500
+
+# Tree stores opened by each worker process
+_stores = {}
+
 
 def get_tree_text(tree):
     '''
@@ -81,6 +118,226 @@ def get_simple_coordphrases(tree):
     return phrases
 
 
+def get_dest(file, compress=None, fmt=None):
+    '''
+    Function: Get the path of the coordination phrases of a parse table,
+    next to it and in the same format unless fmt says otherwise.
+    Input: path to parse table (string), output compression ('none', 'gz',
+        'xz', 'zst', or None), 'csv', 'parquet' or None
+    Output: path (string)
+    '''
+    return table_path(
+        os.path.splitext(split_compression(file)[0])[-2] + '_ccps', file,
+        fmt, compress)
+
+
+def find_chunk(trees, reference=False):
+    '''
+    Function: Find the coordination phrases of a chunk of parse trees. Run
+    in the worker processes.
+    Input: list of parse strings, whether to use the nltk implementation
+    Output: list of rows (lists), list of the digest of each row (bytes),
+        and the number of parse trees (int)
+    '''
+    coordphrases = reference_coordphrases if reference else find_coordphrases
+    rows = []
+    for parse_tree in trees:
+        phrases, sent = coordphrases(parse_tree)
+        for coord in phrases:
+            category1 = coord[0][0]
+            conjunct1 = coord[0][1]
+            conjunction = coord[1]
+            category2 = coord[2][0]
+            conjunct2 = coord[2][1]
+            rows.append([category1, conjunct1, category2, conjunct2,
+                         conjunction, sent, parse_tree])
+    return rows, row_digests(rows), len(trees)
+
+
+def find_store_chunk(path, start, stop, reference=False):
+    '''
+    Function: Find the coordination phrases of the trees start to stop of
+    a tree store (see treestore.py). Run in the worker processes.
+    Input: path to tree store (string), first and last tree (ints),
+        whether to use the nltk implementation
+    Output: as find_chunk
+    '''
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = TreeStore(path)
+
+    rows = []
+    for i in range(start, stop):
+        tree = store[i]
+        if reference:
+            phrases, sent = reference_coordphrases(tree.string())
+        else:
+            phrases, sent = tree.coordphrases()
+        if phrases:
+            parse_tree = tree.string()
+        for coord in phrases:
+            rows.append([coord[0][0], coord[0][1], coord[2][0], coord[2][1],
+                         coord[1], sent, parse_tree])
+    return rows, row_digests(rows), stop - start
+
+
+def row_digests(rows):
+    '''
+    Function: Get the digest of each row, by which duplicates are found.
+    Input: list of rows (lists)
+    Output: list of 16-byte digests (bytes)
+    '''
+    return [hashlib.blake2b(repr(row).encode('utf-8'),
+                            digest_size=16).digest() for row in rows]
+
+
+class SeenRows:
+    '''
+    Set of the digests of the rows written so far. It is kept in memory
+    until it holds more than max_seen digests, and from then on in a
+    temporary sqlite file in directory, which is removed by close.
+    '''
+
+    def __init__(self, directory, max_seen=MAX_SEEN):
+        self.directory = directory
+        self.max_seen = max_seen
+        self.seen = set()
+        self.path = None
+        self.db = None
+
+    def add_many(self, digests):
+        '''
+        Function: Add digests to the set.
+        Input: list of digests (bytes)
+        Output: list of booleans, true for the digests that were not in the
+            set yet, counting earlier digests of the same list
+        '''
+        if self.db is None:
+            new = []
+            for digest in digests:
+                new.append(digest not in self.seen)
+                self.seen.add(digest)
+            if len(self.seen) > self.max_seen:
+                self.spill()
+            return new
+
+        known = set()
+        unique = list(set(digests))
+        for k in range(0, len(unique), LOOKUP_CHUNK):
+            part = unique[k:k + LOOKUP_CHUNK]
+            known.update(digest for (digest,) in self.db.execute(
+                "SELECT digest FROM seen WHERE digest IN ("
+                + ",".join("?" * len(part)) + ")", part))
+        new = []
+        for digest in digests:
+            new.append(digest not in known)
+            known.add(digest)
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)",
+                            [(digest,) for digest, first
+                             in zip(digests, new) if first])
+        return new
+
+    def spill(self):
+        '''
+        Function: Move the digests from memory to a temporary sqlite file.
+        '''
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite', prefix='.seen-',
+                                         dir=self.directory)
+        os.close(fd)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("CREATE TABLE seen (digest BLOB PRIMARY KEY) "
+                        "WITHOUT ROWID")
+        self.db.executemany("INSERT INTO seen VALUES (?)",
+                            ((digest,) for digest in self.seen))
+        self.seen = set()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.path)
+            self.db = None
+
+
+def find_file(file, dest, chunk_rows=CHUNK_ROWS, reference=False, pool=None,
+              workers=1, max_seen=MAX_SEEN):
+    '''
+    Function: Find the coordination phrases of a table of parse trees, or
+    of a tree store, reading and writing it chunk by chunk, and drop
+    duplicate rows across the whole table, keeping the first occurrence.
+    Input: input path (string), output path (string), parse trees per
+        chunk (int), whether to use the nltk implementation, process pool
+        (or None to work in this process) and its number of processes
+        (int), row digests kept in memory (int)
+    Output: number of rows written (int)
+    '''
+    if is_store(file):
+        tasks = ((find_store_chunk, (file, start,
+                                     min(start + chunk_rows, num_trees),
+                                     reference))
+                 for num_trees in [len(TreeStore(file))]
+                 for start in range(0, num_trees, chunk_rows))
+    else:
+        tasks = ((find_chunk, (chunk["Sentence Parse Tree"].tolist(),
+                               reference))
+                 for chunk in iter_table(file, ["Sentence Parse Tree"],
+                                         chunk_rows))
+    return write_results(tasks, dest, COLUMNS, pool, workers, max_seen)
+
+
+def write_results(tasks, dest, columns, pool=None, workers=1,
+                  max_seen=MAX_SEEN):
+    '''
+    Function: Run tasks, in this process or on a pool, and write the rows
+    they find to a table as they come in, in order, dropping duplicate rows
+    across the whole table and keeping the first occurrence.
+    Input: iterable of (function, arguments) tasks, each returning rows,
+        their digests and the number of trees, as find_chunk does; output
+        path (string), columns of the table (list), process pool (or None)
+        and its number of processes (int), row digests kept in memory (int)
+    Output: number of rows written (int)
+    '''
+    if pool is None:
+        results = (func(*task_args) for func, task_args in tasks)
+    else:
+        results = pool_results(pool, tasks, 2 * workers)
+
+    out = TableAppender(dest, columns)
+    seen = SeenRows(os.path.dirname(os.path.abspath(dest)), max_seen)
+    written = 0
+    try:
+        with tqdm(unit=' trees') as progress:
+            for rows, digests, n in results:
+                rows = [row for row, first
+                        in zip(rows, seen.add_many(digests)) if first]
+                if rows:
+                    out.append(pd.DataFrame(rows, columns=columns))
+                    written += len(rows)
+                progress.update(n)
+    finally:
+        seen.close()
+    out.close()
+    return written
+
+
+def pool_results(pool, tasks, window):
+    '''
+    Function: Hand chunks of parse trees to a process pool, keeping at most
+    window of them in flight, and yield the results in input order.
+    Input: process pool, iterable of (function, arguments) tasks, number of
+        chunks in flight (int)
+    Output: generator of the results of the tasks
+    '''
+    pending = deque()
+    for func, task_args in tasks:
+        pending.append(pool.apply_async(func, task_args))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
 def get_args():
     '''
     Parse command-line arguments.
@@ -88,7 +345,30 @@ def get_args():
     parser = argparse.ArgumentParser(
         description='Get coordination stats from csv input file(s) containing parsed sentences.')
     parser.add_argument('input_files', nargs='+', type=str,
-                        help='path to input csv file(s)')
+                        help='path to input csv file(s), Parquet file(s) or '
+                        'tree store(s)')
+    parser.add_argument('--reference', action='store_true',
+                        help='use the original nltk.ParentedTree '
+                        'implementation instead of the bracket scanner')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='format of the output tables (default: same as '
+                        'the input)')
+    parser.add_argument('--compress', choices=['none', 'gz', 'xz', 'zst'],
+                        help='compression of the output csv files (default: '
+                        'same as the input)')
+    parser.add_argument('--force', action='store_true',
+                        help='process files even if the manifest says their '
+                        'output is up to date')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes, 0 for one per core '
+                        '(default: 1, which works in this process)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='parse trees read at a time (default: '
+                        + str(CHUNK_ROWS) + ')')
+    parser.add_argument('--max-seen', type=int, default=MAX_SEEN,
+                        help='row digests kept in memory for dropping '
+                        'duplicates before they are moved to disk '
+                        '(default: ' + str(MAX_SEEN) + ')')
     return parser.parse_args()
 
 
@@ -98,6 +378,11 @@ if __name__ == "__main__":
     Main function.
     '''
     args = get_args()
+    workers = args.workers or os.cpu_count()
+    pool = mp.Pool(workers) if workers > 1 else None
+
+    manifest = Manifest()
+    params = {'reference': args.reference}
 
     i = 1
     tot = str(len(args.input_files))
@@ -105,33 +390,24 @@ if __name__ == "__main__":
     for file in args.input_files:
 
         print("(" + str(i) + "/" + tot + ")")
-        print("Gathering coordination stats from " + file + "...")
 
-        sents = pd.read_csv(file)
-        data = []
-
-        for index, row in tqdm(sents.iterrows(), total=len(sents.index)):
-            parse_tree = row["Sentence Parse Tree"]
-            tree = ParentedTree.fromstring(parse_tree)
-            sent = get_tree_text(tree)
-            for coord in get_simple_coordphrases(tree):
-                category1 = coord[0][0]
-                conjunct1 = coord[0][1]
-                conjunction = coord[1]
-                category2 = coord[2][0]
-                conjunct2 = coord[2][1]
-                data.append([category1, conjunct1, category2, conjunct2,
-                             conjunction, sent, parse_tree])
-
-        columns = ['1st Conjunct Category', '1st Conjunct Text',
-                   '2nd Conjunct Category', '2nd Conjunct Text',
-                   'Conjunction', 'Sentence Text', 'Sentence Parse Tree']
-        df = pd.DataFrame(data, columns=columns)
-        df.drop_duplicates(inplace=True)
-        df.reset_index(inplace=True, drop=True)
-
-        dest = os.path.splitext(file)[-2] + '_ccps.csv'
-        df.to_csv(dest, index=False)
+        dest = get_dest(file, args.compress, args.format)
+        # A tree store is recorded by its metadata, which holds the hash of
+        # the table it was built from
+        source = store_meta(file) if is_store(file) else file
+        if not args.force and manifest.is_up_to_date(dest, source, params):
+            print(dest + " is up to date, skipping.\n")
+            i = i + 1
+            continue
+
+        print("Gathering coordination stats from " + file + "...")
+        find_file(file, dest, args.chunk_rows, args.reference, pool, workers,
+                  args.max_seen)
+        manifest.record('ccp', dest, source, params)
 
         print("All done! The result is stored in " + dest + ".\n")
         i = i + 1
+
+    if pool is not None:
+        pool.close()
+        pool.join()
@@ -2,10 +2,15 @@
 # coordination.py
 
 import sys
+import argparse
 
-import spacy
 from nltk import ParentedTree
-from benepar.spacy_plugin import BeneparComponent
+
+from nlpmodels import load_pipeline, PROFILES, DEFAULT_PROFILE
+from parseserver import connect, SOCKET_PATH
+
+# Models of the parser. The parse server is only used if it serves them.
+MODEL_NAME = 'en_core_web_sm + benepar_en2'
 
 # a class to represent benepar parse trees
 class BeneparTree:
@@ -39,10 +44,10 @@ class BeneparTree:
         return phrases
 
 
-# Given an input sent, gets the parse and coordinations and
+# Given the parse string of a sentence, gets the coordinations and
 # prints the output to stdout.
-def print_output(sent, display_tree=True):
-    tree = BeneparTree(sent._.parse_string)
+def print_output(parse_string, display_tree=True):
+    tree = BeneparTree(parse_string)
     if display_tree:
         tree.pretty_print()
 
@@ -58,19 +63,58 @@ def print_output(sent, display_tree=True):
         i += 1
 
 
+# Parses a line and returns the (text, parse string) of each of its
+# sentences, on the parse server if client is given.
+def parse_sentences(nlp, client, line):
+    if client is not None:
+        return client.parse([line])[0][0]
+    return [(sent.string.strip(), sent._.parse_string)
+            for sent in nlp(line).sents]
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Parse sentences from stdin and print their coordination phrases.')
+    parser.add_argument('--profile', choices=sorted(PROFILES),
+                        default=DEFAULT_PROFILE,
+                        help='spaCy components to load; lean leaves out the '
+                        'tagger and ner, which are not used '
+                        '(default: ' + DEFAULT_PROFILE + ')')
+    parser.add_argument('--server', type=str, default=SOCKET_PATH,
+                        help='socket of the parse server, used instead of '
+                        'loading the models if it is running (default: '
+                        + SOCKET_PATH + ')')
+    parser.add_argument('--no-server', action='store_true',
+                        help='always load the models in this process')
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
 
-    # Load spacy model and integrate with benepar
-    nlp = spacy.load("en_core_web_sm")
-    nlp.add_pipe(BeneparComponent('benepar_en2'))
+    args = get_args()
+
+    # Use the parse server if it is running, or load spacy model and
+    # integrate with benepar
+    nlp = None
+    client = None
+    if not args.no_server:
+        client = connect(args.server, MODEL_NAME, args.profile)
+    if client is not None:
+        print("Using the parse server at " + args.server + " ("
+              + client.info()['model'] + ").")
+    else:
+        nlp = load_pipeline("en_core_web_sm", args.profile, 'benepar_en2')
 
-    doc = nlp("the cat and the dog")
+    sents = parse_sentences(nlp, client, "the cat and the dog")
     print("======================================================================================================================")
     print("\033[96m\033[1mReady to parse.\033[0m")
     print("Below is an example output for the phrase \"the cat and the dog\".\n")
     print("the cat and the dog")
-    for sent in doc.sents:
-        print_output(sent)
+    for (text, parse_string) in sents:
+        print_output(parse_string)
     print("\nEnter your sentences and phrases below.")
     print("======================================================================================================================")
 
@@ -78,7 +122,6 @@ if __name__ == "__main__":
         line = sys.stdin.readline().strip()
         if not line:
             break
-        doc = nlp(line)
-        for sent in doc.sents:
-            print(sent)
-            print_output(sent)
\ No newline at end of file
+        for (text, parse_string) in parse_sentences(nlp, client, line):
+            print(text)
+            print_output(parse_string)
\ No newline at end of file
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# corpusio.py
+# Opens corpus files (COCA text, cleaned/, sampled/ and the parse csvs)
+# transparently, whether they are plain text or compressed with gzip,
+# xz or zstd. The compression is chosen from the file extension, and
+# compressed files are always read and written as streams.
+
+import gzip
+import io
+import lzma
+import os
+
+
+# File extension for each supported compression format.
+COMPRESSIONS = {'gz': '.gz', 'xz': '.xz', 'zst': '.zst'}
+
+# Compression levels used when writing. gzip's default of 9 is several
+# times slower than 6 for a barely smaller file.
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def split_compression(path):
+    '''
+    Function: Split the compression extension off the given path.
+    Input: path (string)
+    Output: path without the compression extension (string), and the
+        extension (string, empty if the file is not compressed)
+    '''
+    base, ext = os.path.splitext(path)
+    if ext in COMPRESSIONS.values():
+        return base, ext
+    return path, ''
+
+
+def is_compressed(path):
+    '''
+    Function: Check whether the given path names a compressed file.
+    Input: path (string)
+    Output: boolean
+    '''
+    return split_compression(path)[1] != ''
+
+
+def output_ext(input_path, compress=None):
+    '''
+    Function: Get the compression extension for an output file. Outputs
+    are compressed like their input unless compress says otherwise.
+    Input: path of the input file (string), and 'none', 'gz', 'xz', 'zst'
+        or None to follow the input
+    Output: extension (string)
+    '''
+    if compress is None:
+        return split_compression(input_path)[1]
+    if compress == 'none':
+        return ''
+    return COMPRESSIONS[compress]
+
+
+def _open_zstd(path, mode):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing " + path + " requires the "
+                          "zstandard package (pip install zstandard).")
+
+    binary_mode = mode.replace('t', '')
+    if 'b' not in binary_mode:
+        binary_mode += 'b'
+    f = open(path, binary_mode)
+    if 'r' in mode:
+        return zstandard.ZstdDecompressor().stream_reader(
+            f, read_across_frames=True, closefd=True)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+        f, closefd=True)
+
+
+def open_file(path, mode='r', encoding='utf-8', newline=None):
+    '''
+    Function: Open a plain or compressed file, like the built-in open.
+    Text mode decodes with the given encoding and newline handling
+    (universal newlines by default), exactly as open(path,
+    encoding=encoding, newline=newline) does.
+    Input: path (string), mode ('r', 'w', 'a', with optional 'b' or 't'),
+        encoding for text mode (string), newline as for open
+    Output: file object
+    '''
+    ext = split_compression(path)[1]
+    binary = 'b' in mode
+
+    if ext == '':
+        if binary:
+            return open(path, mode)
+        return open(path, mode, encoding=encoding, newline=newline)
+
+    if ext == '.gz':
+        if binary:
+            return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+        return gzip.open(path, mode.replace('t', '') + 't',
+                         compresslevel=GZIP_LEVEL, encoding=encoding,
+                         newline=newline)
+
+    if ext == '.xz':
+        if binary:
+            return lzma.open(path, mode)
+        return lzma.open(path, mode.replace('t', '') + 't', encoding=encoding,
+                         newline=newline)
+
+    f = _open_zstd(path, mode)
+    if binary:
+        return f
+    return io.TextIOWrapper(f, encoding=encoding, newline=newline)
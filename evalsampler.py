@@ -7,6 +7,8 @@ import os
 
 import argparse
 
+from tablestore import read_table, carry_columns, ANALYSIS_COLUMNS
+
 
 CONJUNCTIONS = ['and', 'or', 'but', 'nor']
 CATEGORIES = ['NP', 'VP', 'PP', 'ADJP', 'ADVP', 'SBAR']
@@ -16,6 +18,11 @@ VERB_CATEGORIES = ['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ', 'VP']
 ADJ_CATEGORIES = ['JJ', 'JJR', 'JJS', 'ADJP']
 ADV_CATEGORIES = ['RB', 'RBR', 'RBS', 'ADVP']
 
+# Columns holding the input file (by its position in the list of files)
+# and the row of that file each coordination comes from, so that the other
+# columns of the sampled rows can be read back once they are sampled.
+SOURCE_COLUMNS = ['Source File', 'Source Row']
+
 # SUPPORTED CONFIDENCE LEVELS: 50%, 68%, 90%, 95%, and 99%
 CONFIDENCE_LEVELS = [50, .67], [68, .99], [90, 1.64], [95, 1.96], [99, 2.57]
 
@@ -107,12 +114,16 @@ def likes_df(df):
 
 def df_from_files(files):
     '''
-    Concatenate all CSV files in the files list into one dataframe.
+    Concatenate all CSV files in the files list into one dataframe, with
+    only the columns needed to sample them, and the source of each row in
+    SOURCE_COLUMNS.
     '''
 
     li = []
-    for filename in files:
-        df = pd.read_csv(filename, index_col=None, header=0)
+    for k, filename in enumerate(files):
+        df = read_table(filename, columns=ANALYSIS_COLUMNS)
+        df[SOURCE_COLUMNS[0]] = k
+        df[SOURCE_COLUMNS[1]] = df.index
         li.append(df)
 
     if li == []:
@@ -122,6 +133,22 @@ def df_from_files(files):
     return df
 
 
+def with_all_columns(files, df):
+    '''
+    Add back the columns of the files that df_from_files did not read to
+    the sampled rows of df, keeping their order, and drop SOURCE_COLUMNS.
+    '''
+
+    li = []
+    for k, filename in enumerate(files):
+        rows = df[df[SOURCE_COLUMNS[0]] == k]
+        if len(rows.index) > 0:
+            li.append(carry_columns(filename, rows, rows[SOURCE_COLUMNS[1]]))
+
+    df = pd.concat(li, axis=0).loc[df.index]
+    return df.drop(columns=SOURCE_COLUMNS)
+
+
 def get_args():
     '''
     Parse command-line arguments.
@@ -172,6 +199,7 @@ if __name__ == "__main__":
 
     # Write all samples to file
     result = pd.concat(sampled_dfs, axis=0, ignore_index=True)
+    result = with_all_columns(args.input_files, result)
     result['uid'] = result.index
     result.to_csv('csv/evaluation/samples.csv', index=False)
 
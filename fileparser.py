@@ -6,17 +6,554 @@
 # '/data/sample.txt', or the input is in any number of nested
 # subdirectories), the result is written to '/csv/sample/sample.csv'.
 
-from sys import stderr
+from sys import stderr, exit
 import spacy
 from benepar.spacy_plugin import BeneparComponent
 
 import pandas as pd
 
 import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
 import os
+import shutil
+from collections import Counter, deque
+from itertools import islice
 
 from tqdm import tqdm
 from linecounter import rawgencount
+from lineindex import get_index, LineIndex
+from manifest import Manifest
+from corpusio import open_file, split_compression
+from tablestore import table_path, table_format, TableAppender, FORMATS
+from parsecache import ParseCache, CACHE_PATH, CACHE_BYTES
+from parseserver import ParseClient, connect, SOCKET_PATH
+from nlpmodels import (load_pipeline, instrument, component_times,
+                       format_times, PROFILES, DEFAULT_PROFILE)
+
+
+COLUMNS = ['Sentence Text', 'Sentence Parse Tree']
+
+# Parameters recorded in the manifest for every parsed file, along with the
+# profile of the spaCy pipeline (see get_params).
+PARAMS = {'model': 'en_core_web_lg', 'benepar': 'benepar_en2'}
+
+# Name of the models, as used in parse cache keys and checked against the
+# parse server.
+MODEL_NAME = PARAMS['model'] + ' + ' + PARAMS['benepar']
+
+# Thread pools of the numerical libraries are capped in every worker of the
+# parser pool, so that N workers use N cores instead of competing for them.
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS',
+                   'TF_NUM_INTEROP_THREADS']
+
+# Model and parse cache of each worker process of the parser pool, loaded
+# once.
+_worker_nlp = None
+_worker_cache = None
+
+
+'''
+Get the path of the table that the parse of the given file is written to:
+a csv, compressed like the input file unless compress says otherwise, or a
+Parquet file if fmt is 'parquet'.
+'''
+def get_dest(file, compress=None, fmt='csv'):
+    name = split_compression(os.path.basename(file))[0]
+    dest_name = os.path.splitext(name)[-2]
+    return table_path('csv/' + dest_name + '/' + dest_name, file, fmt,
+                      compress)
+
+
+'''
+Load spaCy's large English model with the components of the given profile
+(see nlpmodels.py) and integrate it with benepar. With timed, the time spent
+in each component is recorded.
+'''
+def load_model(profile=DEFAULT_PROFILE, timed=False):
+    # Load spacy model
+    print("Loading spaCy's large English model (" + profile + " profile)...")
+    nlp = load_pipeline("en_core_web_lg", profile)
+
+    # Integrate with benepar
+    print("Integrating spaCy model with Benepar...")
+    print("You may ignore any messages about TensorFlow not being optimized.")
+    nlp.add_pipe(BeneparComponent('benepar_en2'))
+    if timed:
+        instrument(nlp)
+    print()
+    return nlp
+
+
+'''
+Get the versions of spaCy, the spaCy model and benepar, which the parse
+cache keys depend on along with the model names.
+'''
+def model_version(nlp):
+    try:
+        import pkg_resources
+        benepar_version = pkg_resources.get_distribution('benepar').version
+    except Exception:
+        benepar_version = 'unknown'
+    return ('spacy ' + spacy.__version__ + ', model '
+            + nlp.meta.get('version', 'unknown') + ', benepar '
+            + benepar_version)
+
+
+'''
+Get the parameters of a parse with the given profile, as recorded in the
+manifest and in checkpoints. The profile is part of them, since its
+components may change the sentence boundaries and thus the rows.
+'''
+def get_params(profile=DEFAULT_PROFILE):
+    return dict(PARAMS, profile=profile)
+
+
+'''
+Open the parse cache at path for the models of the given version (see
+model_version) loaded with the given profile, or return None if path is
+None.
+'''
+def open_cache(version, path, max_bytes=CACHE_BYTES, profile=DEFAULT_PROFILE):
+    if path is None:
+        return None
+    return ParseCache(path, MODEL_NAME, version + ', ' + profile + ' profile',
+                      max_bytes)
+
+
+'''
+Get the [sentence text, parse tree] rows of every sentence in a parsed doc.
+'''
+def doc_rows(doc):
+    return [[sent.string.strip(), sent._.parse_string] for sent in doc.sents]
+
+
+'''
+Parse a single line and get its rows, and whether it parsed without errors.
+If parsing fails, the error is printed to stderr and the rows of the
+sentences parsed so far are kept.
+'''
+def parse_line(nlp, line):
+    rows = []
+    try:
+        doc = nlp(line)
+        for sent in doc.sents:
+            rows.append([sent.string.strip(), sent._.parse_string])
+    except Exception as e:
+        print(str(e), file=stderr)
+        return rows, False
+    return rows, True
+
+
+'''
+Get the length of a line in whitespace tokens, which is close enough to the
+number of spaCy tokens for grouping lines of similar length.
+'''
+def line_length(line):
+    return len(line.split())
+
+
+'''
+Split line numbers into batches of at most batch_size lines. With bucket,
+the lines are first sorted by length, longest first, so that each batch
+holds lines of similar length (little padding) and the longest batches are
+parsed first instead of straggling at the end. Lines of equal length keep
+their input order.
+'''
+def get_batches(lengths, batch_size, bucket=False):
+    order = list(range(len(lengths)))
+    if bucket:
+        order.sort(key=lambda i: -lengths[i])
+    return [order[k:k + batch_size] for k in range(0, len(order), batch_size)]
+
+
+'''
+Count the tokens of the given lines, and the tokens the parser pads them to
+when it batches them like parse_lines does: every line of a batch is as long
+as the longest one. Padding efficiency is the ratio of the two.
+'''
+def batch_padding(lines, batch_size, bucket=False):
+    lengths = [line_length(line) for line in lines]
+    tokens = 0
+    padded = 0
+    for batch in get_batches(lengths, max(batch_size, 1), bucket):
+        tokens += sum(lengths[i] for i in batch)
+        padded += len(batch) * max(lengths[i] for i in batch)
+    return tokens, padded
+
+
+'''
+Parse a batch of lines with nlp.pipe and get the rows of each line, and
+whether it parsed without errors. If anything in the batch fails, it is
+parsed again one line at a time, so that only the failing lines are logged
+and skipped, exactly as in the per-line mode.
+'''
+def parse_batch(nlp, batch):
+    try:
+        return [(doc_rows(doc), True)
+                for doc in nlp.pipe(batch, batch_size=len(batch))]
+    except Exception:
+        return [parse_line(nlp, line) for line in batch]
+
+
+'''
+Parse the given lines and generate one [sentence text, parse tree] row per
+sentence, in input order. With batch_size > 1, the lines are parsed with
+nlp.pipe in batches of that size, so that spaCy and benepar can batch their
+work. With bucket, the batches are formed from lines of similar length,
+longest first (see get_batches), and the rows are put back in input order.
+
+nlp may also be a client of the parse server (see parseserver.py), which
+then batches the lines the same way. With a parse cache, lines found in the
+cache and repeats of a line are not parsed again, and lines that parse without errors are added to the cache.
+The number of lines, of lines that did not need parsing, of tokens and of
+padded tokens are added to stats, if given (a Counter).
+'''
+def parse_lines(nlp, lines, batch_size=1, bucket=False, cache=None,
+                stats=None):
+    lines = list(lines)
+    repeats = []
+    if cache is None:
+        results = [None] * len(lines)
+        todo = list(range(len(lines)))
+    else:
+        results = cache.get_many(lines)
+        first = {}
+        todo = []
+        for i, rows in enumerate(results):
+            if rows is None:
+                key = cache.key(lines[i])
+                if key in first:
+                    repeats.append((i, first[key]))
+                else:
+                    first[key] = i
+                    todo.append(i)
+
+    lengths = [line_length(lines[i]) for i in todo]
+    if isinstance(nlp, ParseClient):
+        served = nlp.parse([lines[i] for i in todo], batch_size, bucket)
+
+    parsed = []
+    for batch in get_batches(lengths, max(batch_size, 1), bucket):
+        if isinstance(nlp, ParseClient):
+            line_rows = [served[j] for j in batch]
+        elif batch_size <= 1:
+            line_rows = [parse_line(nlp, lines[todo[batch[0]]])]
+        else:
+            line_rows = parse_batch(nlp, [lines[todo[j]] for j in batch])
+
+        for j, (rows, ok) in zip(batch, line_rows):
+            results[todo[j]] = rows
+            if ok:
+                parsed.append((lines[todo[j]], rows))
+
+        if stats is not None:
+            stats['tokens'] += sum(lengths[j] for j in batch)
+            stats['padded'] += len(batch) * max(lengths[j] for j in batch)
+
+    for (i, j) in repeats:
+        results[i] = results[j]
+    if cache is not None:
+        cache.put_many(parsed)
+    if stats is not None:
+        stats['lines'] += len(lines)
+        stats['cached'] += len(lines) - len(todo)
+
+    for rows in results:
+        yield from rows
+
+
+'''
+Initializer of the parser pool workers: load the model and open the parse
+cache once per worker.
+'''
+def init_worker(cache_path=None, cache_bytes=CACHE_BYTES,
+                profile=DEFAULT_PROFILE, timed=False):
+    global _worker_nlp, _worker_cache
+    with contextlib.redirect_stdout(io.StringIO()):
+        _worker_nlp = load_model(profile, timed)
+    _worker_cache = open_cache(model_version(_worker_nlp), cache_path,
+                               cache_bytes, profile)
+
+
+'''
+Parse lines with parse_lines and get their rows and stats. The stats also
+hold the time spent in each timed component of nlp, as 'seconds <name>',
+unless nlp is a client of the parse server.
+'''
+def parse_counted(nlp, lines, batch_size, bucket, cache):
+    stats = Counter()
+    if isinstance(nlp, ParseClient):
+        return list(parse_lines(nlp, lines, batch_size, bucket, cache,
+                                stats)), stats
+
+    before = component_times(nlp)
+    rows = list(parse_lines(nlp, lines, batch_size, bucket, cache, stats))
+    for name, seconds in component_times(nlp).items():
+        stats['seconds ' + name] += seconds - before[name]
+    return rows, stats
+
+
+'''
+Worker function of the parser pool. A task is either a line range of an
+indexed file, which the worker reads itself, or a list of lines read by the
+coordinator from a file without an index. Returns the rows and the stats
+of the shard (see parse_lines).
+'''
+def parse_shard(file, start, stop, lines, batch_size, bucket=False):
+    if lines is None:
+        lines = LineIndex(file).read_lines(start, stop)
+    return parse_counted(_worker_nlp, lines, batch_size, bucket,
+                         _worker_cache)
+
+
+'''
+Generate the shards of a file, starting at line first_line: tuples of
+(file, first line, one-past-last line, None) for an indexed file, and of
+(file, None, None, lines) for a file without an index, which is read here.
+'''
+def get_shards(file, index, shard_lines, first_line=0):
+    if index is not None:
+        for start in range(first_line, len(index), shard_lines):
+            yield file, start, min(start + shard_lines, len(index)), None
+        return
+
+    # Lines end at '\n' only, as in the line index and the line counts
+    with open_file(file, newline='\n') as f:
+        lines = islice(f, first_line, None)
+        while True:
+            shard = list(islice(lines, shard_lines))
+            if not shard:
+                break
+            yield file, None, None, shard
+
+
+'''
+Create a pool of parser workers, each holding its own copy of the model and
+limited to threads_per_worker threads, and sharing the parse cache at
+cache_path, if any. The models are loaded with the given profile, and timed
+if timed is set. Workers are started with 'spawn' rather than fork, since
+TensorFlow is not fork-safe.
+'''
+def create_pool(workers, threads_per_worker=1, cache_path=None,
+                cache_bytes=CACHE_BYTES, profile=DEFAULT_PROFILE,
+                timed=False):
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads_per_worker)
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(workers, initializer=init_worker,
+                        initargs=(cache_path, cache_bytes, profile, timed))
+
+
+'''
+Parse the shards of a file and generate (rows, stats) for each shard, in
+the original line order. Shards are parsed in this process with nlp and
+cache, or by the parser pool if one is given, with at most 2 shards per
+worker in flight at any time. With bucket, each shard is the window within
+which lines are grouped by length.
+'''
+def parse_shards(file, index, first_line, shard_lines, batch_size,
+                 bucket=False, nlp=None, cache=None, pool=None, workers=1):
+    shards = get_shards(file, index, shard_lines, first_line)
+
+    if pool is None:
+        for (_, start, stop, lines) in shards:
+            if lines is None:
+                lines = index.read_lines(start, stop)
+            yield parse_counted(nlp, lines, batch_size, bucket, cache)
+        return
+
+    pending = deque()
+    for (_, start, stop, lines) in shards:
+        pending.append(pool.apply_async(
+            parse_shard, (file, start, stop, lines, batch_size, bucket)))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+'''
+Paths of the part files and of the checkpoint of a csv that is being
+written. They are dotfiles next to the csv, so that globs over csv/ do not
+pick them up.
+'''
+def part_path(dest, k):
+    head, tail = os.path.split(split_compression(dest)[0])
+    return os.path.join(head, '.' + tail + '.part{:05d}'.format(k))
+
+
+def checkpoint_path(dest):
+    head, tail = os.path.split(split_compression(dest)[0])
+    return os.path.join(head, '.' + tail + '.checkpoint.json')
+
+
+'''
+Delete the part files (and their temporary files) and the checkpoint of
+dest, whatever run they were left over from.
+'''
+def remove_parts(dest):
+    head, tail = os.path.split(split_compression(dest)[0])
+    for path in glob.glob(os.path.join(glob.escape(head),
+                                       glob.escape('.' + tail) + '.part*')):
+        os.remove(path)
+    for path in [checkpoint_path(dest), checkpoint_path(dest) + '.tmp']:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+'''
+Load the checkpoint of dest. It is only valid if it was written for the
+current version of the input file, with the given parameters (see
+get_params), and if all of its part files still exist. Returns None otherwise.
+'''
+def load_checkpoint(dest, file, params):
+    try:
+        with open(checkpoint_path(dest), encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    st = os.stat(file)
+    if (checkpoint['source'] != file or checkpoint['params'] != params
+            or checkpoint['source_stat'] != [st.st_size, st.st_mtime_ns]):
+        return None
+    if not all(os.path.exists(part_path(dest, k))
+               for k in range(checkpoint['parts'])):
+        return None
+    return checkpoint
+
+
+'''
+Record that the first lines_done lines of file are parsed with the given
+parameters and stored in the first num_parts part files of dest.
+'''
+def save_checkpoint(dest, file, params, lines_done, num_parts):
+    st = os.stat(file)
+    checkpoint = {'source': file, 'params': params,
+                  'source_stat': [st.st_size, st.st_mtime_ns],
+                  'lines_done': lines_done, 'parts': num_parts}
+    tmp = checkpoint_path(dest) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, checkpoint_path(dest))
+
+
+'''
+Write rows to a part file of dest, without a header. The part is written
+under a temporary name and only renamed once it is complete.
+'''
+def write_part(dest, k, rows):
+    tmp = part_path(dest, k) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        pd.DataFrame(rows, columns=COLUMNS).to_csv(f, header=False,
+                                                   index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, part_path(dest, k))
+
+
+'''
+Concatenate the header and the part files of dest into dest, or write the
+parts as the row groups of a Parquet dest, then delete the parts and the
+checkpoint.
+'''
+def merge_parts(dest, num_parts):
+    if table_format(dest) == 'parquet':
+        # Every part becomes a row group. Every field is a string, and
+        # empty ones must not be read as missing.
+        out = TableAppender(dest, COLUMNS)
+        for k in range(num_parts):
+            out.append(pd.read_csv(part_path(dest, k), header=None,
+                                   names=COLUMNS, dtype=str,
+                                   keep_default_na=False))
+        out.close()
+    else:
+        merge_csv_parts(dest, num_parts)
+
+    for k in range(num_parts):
+        os.remove(part_path(dest, k))
+    os.remove(checkpoint_path(dest))
+
+
+def merge_csv_parts(dest, num_parts):
+    with open_file(dest, 'w') as out:
+        out.write(pd.DataFrame(columns=COLUMNS).to_csv(index=False))
+        for k in range(num_parts):
+            # Copied untranslated, since fields may hold a bare '\r'
+            with open(part_path(dest, k), encoding='utf-8',
+                      newline='') as part:
+                shutil.copyfileobj(part, out, 1024 * 1024)
+
+
+'''
+Parse file into the csv dest. Rows are streamed to part files, one part per
+checkpoint_lines input lines, and a checkpoint is recorded after each part,
+so memory stays flat however large the input is. If an earlier run of the
+same file was interrupted, parsing resumes after its last checkpoint,
+unless force is set. Otherwise, the parts and checkpoint left over from
+any earlier run are deleted before the first part is written, so that they
+cannot end up in the output. The checkpoint records the profile the lines
+are parsed with. Returns the stats of the lines parsed in this run (see
+parse_lines).
+'''
+def parse_file(file, dest, shard_lines, batch_size, checkpoint_lines,
+               bucket=False, nlp=None, cache=None, pool=None, workers=1,
+               force=False, profile=DEFAULT_PROFILE):
+    params = get_params(profile)
+    index = get_index(file)
+    if index is not None:
+        num_lines = len(index)
+    else:
+        num_lines = rawgencount(file)
+
+    dest_dir = os.path.dirname(dest)
+    if not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
+
+    checkpoint = None if force else load_checkpoint(dest, file, params)
+    if checkpoint is not None:
+        lines_done = checkpoint['lines_done']
+        num_parts = checkpoint['parts']
+        print("Resuming after line " + str(lines_done) + " from a checkpoint.")
+    else:
+        remove_parts(dest)
+        lines_done = 0
+        num_parts = 0
+        save_checkpoint(dest, file, params, lines_done, num_parts)
+
+    rows = []
+    pending_lines = 0
+    totals = Counter()
+    with tqdm(total=num_lines, initial=lines_done) as progress:
+        for (shard_rows, stats) in parse_shards(
+                file, index, lines_done, shard_lines, batch_size,
+                bucket, nlp, cache, pool, workers):
+            rows.extend(shard_rows)
+            totals.update(stats)
+            pending_lines += stats['lines']
+            progress.update(stats['lines'])
+
+            if pending_lines >= checkpoint_lines:
+                write_part(dest, num_parts, rows)
+                num_parts += 1
+                lines_done += pending_lines
+                save_checkpoint(dest, file, params, lines_done, num_parts)
+                rows = []
+                pending_lines = 0
+
+    if pending_lines > 0:
+        write_part(dest, num_parts, rows)
+        num_parts += 1
+
+    merge_parts(dest, num_parts)
+
+    return totals
 
 
 '''
@@ -27,6 +564,60 @@ def get_args():
         description='Generate parse tree for each line of the cleaned input file(s).')
     parser.add_argument('input_files', nargs='+', type=str,
                         help='path to input file(s)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='number of lines parsed together with nlp.pipe '
+                        '(default: 1, one nlp call per line)')
+    parser.add_argument('--bucket', action='store_true',
+                        help='batch lines of similar length together, '
+                        'longest first, within each shard; larger shards '
+                        'give tighter buckets (requires --batch-size > 1)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of parser processes, each loading its '
+                        'own copy of the models; 0 uses all cores '
+                        '(default: 1, parse in this process)')
+    parser.add_argument('--shard-lines', type=int, default=500,
+                        help='lines per shard, the unit of work of the '
+                        'parser processes '
+                        '(default: 500)')
+    parser.add_argument('--checkpoint-lines', type=int, default=5000,
+                        help='input lines per part file and checkpoint '
+                        '(default: 5000)')
+    parser.add_argument('--threads-per-worker', type=int, default=1,
+                        help='threads each parser process may use '
+                        '(default: 1)')
+    parser.add_argument('--profile', choices=sorted(PROFILES),
+                        default=DEFAULT_PROFILE,
+                        help='spaCy components to load; lean leaves out the '
+                        'tagger and ner, which the output does not use '
+                        '(default: ' + DEFAULT_PROFILE + ')')
+    parser.add_argument('--timing', action='store_true',
+                        help='report the time spent in each pipeline '
+                        'component')
+    parser.add_argument('--server', type=str, default=SOCKET_PATH,
+                        help='socket of the parse server, used instead of '
+                        'loading the models if it is running (default: '
+                        + SOCKET_PATH + ')')
+    parser.add_argument('--no-server', action='store_true',
+                        help='always load the models in this process')
+    parser.add_argument('--cache', type=str, default=CACHE_PATH,
+                        help='parse cache shared by all files and runs '
+                        '(default: ' + CACHE_PATH + ')')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every line, without the parse cache')
+    parser.add_argument('--cache-size', type=int,
+                        default=CACHE_BYTES // 1000000,
+                        help='size limit of the parse cache in MB, beyond '
+                        'which the least recently used parses are evicted '
+                        '(default: ' + str(CACHE_BYTES // 1000000) + ')')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='format of the parse tables; parquet files are '
+                        'zstd-compressed (default: csv)')
+    parser.add_argument('--compress', choices=['none', 'gz', 'xz', 'zst'],
+                        help='compression of the csv files (default: same '
+                        'as the input)')
+    parser.add_argument('--force', action='store_true',
+                        help='parse files even if the manifest says their '
+                        'output is up to date')
     return parser.parse_args()
 
 
@@ -37,49 +628,85 @@ if __name__ == "__main__":
 
     args = get_args()
 
-    # Load spacy model
-    print("Loading spaCy's large English model...")
-    nlp = spacy.load("en_core_web_lg")
+    manifest = Manifest()
+    params = get_params(args.profile)
+    files = []
+    for file in reversed(args.input_files):
+        if args.force or not manifest.is_up_to_date(
+                get_dest(file, args.compress, args.format), file, params):
+            files.append(file)
 
-    # Integrate with benepar
-    print("Integrating spaCy model with Benepar...")
-    print("You may ignore any messages about TensorFlow not being optimized.")
-    nlp.add_pipe(BeneparComponent('benepar_en2'))
-    print()
+    if len(files) < len(args.input_files):
+        print("Skipping " + str(len(args.input_files) - len(files))
+              + " file(s) that are already up to date.\n")
+    if not files:
+        exit(0)
 
-    i = 1
-    tot = str(len(args.input_files))
+    cache_path = None if args.no_cache else args.cache
+    cache_bytes = args.cache_size * 1000000
 
-    input_files = reversed(args.input_files)
+    client = None
+    if not args.no_server:
+        client = connect(args.server, MODEL_NAME, args.profile)
 
-    for file in input_files:
+    workers = args.workers or os.cpu_count()
+    if client is not None:
+        # The server holds the only copy of the models, so a pool would
+        # only queue up behind it.
+        print("Using the parse server at " + args.server + ".\n")
+        workers = 1
+        nlp = client
+        cache = open_cache(client.info()['version'], cache_path, cache_bytes,
+                           args.profile)
+    elif workers > 1:
+        print("Starting " + str(workers) + " parser processes, each loading "
+              "spaCy's large English model and Benepar...\n")
+        pool = create_pool(workers, args.threads_per_worker, cache_path,
+                           cache_bytes, args.profile, args.timing)
+    else:
+        nlp = load_model(args.profile, args.timing)
+        cache = open_cache(model_version(nlp), cache_path, cache_bytes,
+                           args.profile)
 
-        data = []
-        num_lines = rawgencount(file)
+    i = 1
+    tot = str(len(files))
+
+    for file in files:
+
+        dest = get_dest(file, args.compress, args.format)
 
         print("(" + str(i) + "/" + tot + ")")
         print("Beginning parse of " + file
               + "! If the input file is large, this may take a few hours...")
-        with open(file, encoding='utf-8') as f:
-            for line in tqdm(f, total=num_lines):
-                try:
-                    doc = nlp(line)
-                    for sent in doc.sents:
-                        data.append([sent.string.strip(), sent._.parse_string])
-                except Exception as e:
-                    print(str(e), file=stderr)
+        if workers > 1:
+            stats = parse_file(file, dest, args.shard_lines, args.batch_size,
+                               args.checkpoint_lines, args.bucket, pool=pool,
+                               workers=workers, force=args.force,
+                               profile=args.profile)
+        else:
+            stats = parse_file(file, dest, args.shard_lines, args.batch_size,
+                               args.checkpoint_lines, args.bucket, nlp=nlp,
+                               cache=cache, force=args.force,
+                               profile=args.profile)
+        manifest.record('parse', dest, file, params)
 
-        columns = ['Sentence Text', 'Sentence Parse Tree']
-        df = pd.DataFrame(data, columns=columns)
+        if args.batch_size > 1 and stats['padded'] > 0:
+            print("Padding efficiency: "
+                  + "{:.1f}".format(100 * stats['tokens'] / stats['padded'])
+                  + "%")
+        if cache_path is not None and stats['lines'] > 0:
+            print("Parse cache: " + str(stats['cached']) + " of "
+                  + str(stats['lines']) + " lines needed no parsing ("
+                  + "{:.1f}".format(100 * stats['cached'] / stats['lines'])
+                  + "% hit rate)")
+        times = {key[len('seconds '):]: value
+                 for key, value in stats.items() if key.startswith('seconds ')}
+        if args.timing and times:
+            print("Component times: " + format_times(times))
 
-        dest_name = os.path.splitext(os.path.basename(file))[-2]
-        dest_dir = 'csv/' + dest_name
-
-        if not os.path.exists(dest_dir):
-            os.makedirs(dest_dir)
-
-        df.to_csv(dest_dir + '/' + dest_name + '.csv', index=False)
-
-        print("All done! The result is stored in " +
-              dest_dir + '/' + dest_name + '.csv.\n')
+        print("All done! The result is stored in " + dest + ".\n")
         i = i + 1
+
+    if workers > 1:
+        pool.close()
+        pool.join()
@@ -3,11 +3,63 @@
 
 import random
 import argparse
+import heapq
 import os
 
+from manifest import Manifest
+from corpusio import open_file, split_compression, output_ext, is_compressed
+from lineindex import write_index
+
 
 BYTES_TO_SAMPLE = 10000000
-MBYTES_TO_SAMPLE = BYTES_TO_SAMPLE / 100000
+MBYTES_TO_SAMPLE = BYTES_TO_SAMPLE / 1000000
+
+
+def sample_lines(lines, budget, rng):
+    '''
+    Function: Sample lines at random until more than budget bytes are taken,
+    in a single pass and with memory bounded by the budget. Every line gets
+    a random key; the result is the shortest run of lines, in order of
+    increasing key, whose size exceeds the budget (or all lines if the
+    input is smaller). This is the same sample as sorting all lines by key
+    and writing them until the budget is exceeded, but only the candidate
+    lines are ever kept, in a heap ordered by key.
+    Input: iterable of lines (strings), byte budget (int), random.Random
+    Output: list of sampled lines, in random order
+    '''
+    heap = []
+    total = 0
+
+    for line in lines:
+        key = rng.random()
+
+        # A line after the current largest key can only be kept if the
+        # budget is not exceeded yet.
+        if heap and total > budget and key > -heap[0][0]:
+            continue
+
+        size = len(line.encode('utf-8'))
+        heapq.heappush(heap, (-key, size, line))
+        total += size
+
+        # Drop the largest key while the rest alone exceeds the budget
+        while total - heap[0][1] > budget:
+            total -= heapq.heappop(heap)[1]
+
+    heap.sort(reverse=True)
+    return [line for _, _, line in heap]
+
+
+def get_dest(file, compress=None):
+    '''
+    Function: Get the path of the sample of the given file.
+    Input: path to cleaned file (string), output compression ('none', 'gz',
+        'xz', 'zst', or None to compress like the input)
+    Output: path in the sampled/ directory (string)
+    '''
+    name = split_compression(os.path.basename(file))[0]
+    return ('sampled/' + os.path.splitext(name)[-2] + '.txt'
+            + output_ext(file, compress))
 
 
 '''
@@ -18,6 +70,17 @@ def get_args():
         description="Sample " + str(MBYTES_TO_SAMPLE) + " MB from input file(s).")
     parser.add_argument('input_files', nargs='+', type=str,
                         help='path to input file(s)')
+    parser.add_argument('--bytes', type=int, default=BYTES_TO_SAMPLE,
+                        help='number of bytes to sample from each file '
+                        '(default: ' + str(BYTES_TO_SAMPLE) + ')')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed, for reproducible samples')
+    parser.add_argument('--compress', choices=['none', 'gz', 'xz', 'zst'],
+                        help='compression of the sampled files (default: '
+                        'same as the input)')
+    parser.add_argument('--force', action='store_true',
+                        help='sample files even if the manifest says their '
+                        'output is up to date')
     return parser.parse_args()
 
 
@@ -28,30 +91,55 @@ if __name__ == "__main__":
 
     args = get_args()
 
+    manifest = Manifest()
+    params = {'bytes': args.bytes, 'seed': args.seed}
+
     i = 1
     tot = str(len(args.input_files))
 
     for file in args.input_files:
 
         print("(" + str(i) + "/" + tot + ")")
-        print("Sampling " + str(MBYTES_TO_SAMPLE) + " MB from " + file + "...")
 
-        dest_name = os.path.splitext(os.path.basename(file))[-2]
-        dest = 'sampled/' + dest_name + '.txt'
+        dest = get_dest(file, args.compress)
+        dest_name = os.path.splitext(os.path.basename(
+            split_compression(dest)[0]))[0]
+
+        if not args.force and manifest.is_up_to_date(dest, file, params):
+            print(dest + " is up to date, skipping.\n")
+            i = i + 1
+            continue
+
+        print("Sampling " + str(args.bytes / 1000000) + " MB from "
+              + file + "...")
 
         if not os.path.exists('sampled/'):
             os.makedirs('sampled/')
 
-        with open(file) as f:
-            lines = [(random.random(), line) for line in f]
+        # Seed each file on its own, so that its sample does not depend on
+        # which other files are sampled in the same run.
+        if args.seed is None:
+            rng = random.Random()
+        else:
+            rng = random.Random(str(args.seed) + ':' + dest_name)
+
+        with open_file(file) as f:
+            lines = sample_lines(f, args.bytes, rng)
+
+        # Write the sample along with its line-offset index, which the
+        # parser uses for line counts and sharding.
+        offsets = [0]
+        with open_file(dest, 'w') as f:
+            for line in lines:
+                if not line.endswith('\n'):
+                    line += '\n'
+                f.write(line)
+                offsets.append(offsets[-1] + len(line.encode('utf-8')))
 
-        lines.sort()
+        if not is_compressed(dest):
+            write_index(dest, offsets)
 
-        with open(dest, 'w') as f:
-            for _, line in lines:
-                f.write(line)
-                if f.tell() > 10000000:
-                    break
+        manifest.record('sample', dest, file, params)
 
         print("All done! The result is stored in " + dest + ".\n")
         i = i + 1
@@ -1,24 +1,104 @@
 #!/usr/bin/env python
 # headfinder.py
+# Finds the syntactic head of the 1st and 2nd conjunct of each row of the
+# _ccps table(s), and writes them to the _heads table(s). Short conjuncts
+# ("the", "it", "students") repeat thousands of times, so each distinct
+# conjunct text of a table is only parsed once, in batches through
+# nlp.pipe, and the heads are kept in a persistent cache shared by all
+# tables and runs, so that texts seen before are not parsed at all.
 
-import pandas as pd
 import argparse
+import time
+from functools import partial
 
-import spacy
+from tablestore import (read_table, write_table, carry_columns,
+                        ANALYSIS_COLUMNS)
+from parsecache import ParseCache, CACHE_PATH, CACHE_BYTES
+from parseserver import connect, SOCKET_PATH
+
+from nlpmodels import (load_pipeline, pipeline_version, component_times,
+                       format_times, PROFILES, DEFAULT_PROFILE)
+
+# spaCy pipeline, loaded by the main function unless the parse server is
+# used, or by the first call to get_head or get_heads otherwise. Only the
+# dependency parser is needed, so the lean profile leaves out the tagger
+# and ner.
+nlp = None
+
+# Name of the model, as used in the keys of the cached heads, which keeps
+# them apart from the parses of fileparser.py in a shared cache.
+CACHE_MODEL = 'en_core_web_lg heads'
+
+# Texts per nlp.pipe batch
+BATCH_SIZE = 256
+
+'''
+Returns the spaCy pipeline, loading it with the default profile if the
+main function has not loaded it already.
+'''
+def get_nlp():
+    global nlp
+    if nlp is None:
+        nlp = load_pipeline("en_core_web_lg")
+    return nlp
 
-nlp = spacy.load("en_core_web_lg")
 
 """
 Returns the syntactic head of the phrase using spaCy's dependency
 parser, if it exists. Returns None otherwise.
 """
 def get_head(phrase):
-    doc = nlp(phrase)
+    doc = get_nlp()(phrase)
     sents = list(doc.sents)
     if sents != []:
         return str(list(doc.sents)[0].root)
 
 
+'''
+Returns the syntactic heads of several phrases, as get_head does, parsing
+them in batches with nlp.pipe.
+'''
+def get_heads(phrases, batch_size=BATCH_SIZE):
+    heads = []
+    for doc in get_nlp().pipe(phrases, batch_size=batch_size):
+        sents = list(doc.sents)
+        heads.append(str(sents[0].root) if sents else None)
+    return heads
+
+
+'''
+Returns the heads of a list of phrases, with repeats, by finding the head
+of each distinct phrase once. Heads in the cache, if any, are not found
+again, and the others are found by find (a function from a list of
+phrases to their heads) and added to the cache. Counts of the phrases,
+distinct phrases and cached ones are added to stats.
+'''
+def find_heads(phrases, find, cache=None, stats=None):
+    unique = list(dict.fromkeys(phrases))
+
+    heads = {}
+    todo = unique
+    if cache is not None:
+        todo = []
+        for phrase, found in zip(unique, cache.get_many(unique)):
+            if found is None:
+                todo.append(phrase)
+            else:
+                heads[phrase] = found[0]
+
+    found = find(todo) if todo else []
+    heads.update(zip(todo, found))
+    if cache is not None:
+        cache.put_many([(phrase, [head])
+                        for phrase, head in zip(todo, found)])
+
+    if stats is not None:
+        stats['phrases'] += len(phrases)
+        stats['unique'] += len(unique)
+        stats['cached'] += len(unique) - len(todo)
+    return [heads[phrase] for phrase in phrases]
+
+
 '''
 Parse command-line arguments.
 '''
@@ -27,6 +107,34 @@ def get_args():
         description='Get coordination stats from csv input file(s) containing parsed sentences.')
     parser.add_argument('input_files', nargs='+', type=str,
                         help='path to input csv file(s)')
+    parser.add_argument('--profile', choices=sorted(PROFILES),
+                        default=DEFAULT_PROFILE,
+                        help='spaCy components to load '
+                        '(default: ' + DEFAULT_PROFILE + ')')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='conjunct texts per nlp.pipe batch (default: '
+                        + str(BATCH_SIZE) + ')')
+    parser.add_argument('--timing', action='store_true',
+                        help='report the time spent in each pipeline '
+                        'component')
+    parser.add_argument('--server', type=str, default=SOCKET_PATH,
+                        help='socket of the parse server, used instead of '
+                        'loading the model if it is running (default: '
+                        + SOCKET_PATH + ')')
+    parser.add_argument('--no-server', action='store_true',
+                        help='always load the model in this process')
+    parser.add_argument('--cache', type=str, default=CACHE_PATH,
+                        help='cache of heads shared by all files and runs, '
+                        'which may be the parse cache of fileparser.py '
+                        '(default: ' + CACHE_PATH + ')')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='find the head of every distinct conjunct '
+                        'text, without the cache')
+    parser.add_argument('--cache-size', type=int,
+                        default=CACHE_BYTES // 1000000,
+                        help='size limit of the cache in MB, beyond which '
+                        'the least recently used entries are evicted '
+                        '(default: ' + str(CACHE_BYTES // 1000000) + ')')
     return parser.parse_args()
 
 
@@ -37,6 +145,27 @@ if __name__ == "__main__":
 
     args = get_args()
 
+    client = None
+    if not args.no_server:
+        client = connect(args.server, "en_core_web_lg", args.profile)
+    if client is not None:
+        print("Using the parse server at " + args.server + ".\n")
+        find = client.heads
+        info = client.info()
+        version = info.get('pipeline_version', info['version'])
+    else:
+        nlp = load_pipeline("en_core_web_lg", args.profile,
+                            timed=args.timing)
+        find = partial(get_heads, batch_size=args.batch_size)
+        version = pipeline_version(nlp)
+
+    # Heads depend on the exact text, whitespace included, so the keys
+    # are not normalized.
+    cache = None
+    if not args.no_cache:
+        cache = ParseCache(args.cache, CACHE_MODEL, version,
+                           args.cache_size * 1000000, normalize_keys=False)
+
     i = 1
     tot = str(len(args.input_files))
 
@@ -45,15 +174,33 @@ if __name__ == "__main__":
         print("(" + str(i) + "/" + tot + ")")
         print("Finding heads of conjuncts in " + file + "...")
 
-        df = pd.read_csv(file)
+        df = read_table(file, columns=ANALYSIS_COLUMNS)
 
-        df['1st Conjunct Head'] = df.apply(
-            lambda row: get_head(str(row['1st Conjunct Text'])), axis=1)
-        df['2nd Conjunct Head'] = df.apply(
-            lambda row: get_head(str(row['2nd Conjunct Text'])), axis=1)
+        start = time.perf_counter()
+        stats = {'phrases': 0, 'unique': 0, 'cached': 0}
+        first = [str(text) for text in df['1st Conjunct Text']]
+        second = [str(text) for text in df['2nd Conjunct Text']]
+        heads = find_heads(first + second, find, cache, stats)
+        df['1st Conjunct Head'] = heads[:len(first)]
+        df['2nd Conjunct Head'] = heads[len(first):]
+        seconds = time.perf_counter() - start
 
         dest = file.replace('_ccps', '_heads')
-        df.to_csv(dest, index=False)
-
+        write_table(carry_columns(file, df), dest)
+
+        if stats['phrases'] > 0:
+            print("Distinct conjunct texts: " + str(stats['unique'])
+                  + " of " + str(stats['phrases']) + " ("
+                  + "{:.1f}".format(100 * stats['unique'] / stats['phrases'])
+                  + "%), " + str(stats['cached']) + " of them cached")
+        print("Rows/sec: " + "{:.0f}".format(len(df) / max(seconds, 1e-9))
+              + " (" + str(len(df)) + " rows in "
+              + "{:.1f}".format(seconds) + " s)")
+        if args.timing and nlp is not None:
+            print("Component times so far: "
+                  + format_times(component_times(nlp)))
         print("All done! The result is stored in " + dest + ".\n")
         i = i + 1
+
+    if cache is not None:
+        cache.close()
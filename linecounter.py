@@ -2,6 +2,28 @@
 # linecounter.py
 # Programmatically counts the number of lines in a file.
 
+import json
+import mmap
+import multiprocessing
+import os
+
+import numpy as np
+
+from corpusio import open_file, is_compressed
+from lineindex import load_index
+
+
+# Line counts by absolute path, along with the size and mtime they are
+# valid for.
+CACHE_PATH = 'linecounts.json'
+
+# Files smaller than this are counted in the calling process.
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+
+# Bytes of the memory map compared at a time. Small enough for the
+# temporary boolean array to stay in cache.
+BLOCK_SIZE = 1024 * 1024
+
 
 def _make_gen(reader):
     b = reader(1024 * 1024)
@@ -11,9 +33,98 @@ def _make_gen(reader):
 
 
 '''
-Get number of lines in filename.
+Get number of lines in filename by reading it 1 MiB at a time. This is the
+original implementation, kept for reference and for compressed files.
+'''
+def serial_count(filename):
+    if is_compressed(filename):
+        # Count the decompressed stream without unpacking it
+        with open_file(filename, 'rb') as f:
+            return sum(buf.count(b'\n') for buf in _make_gen(f.read))
+
+    with open(filename, 'rb') as f:
+        f_gen = _make_gen(f.raw.read)
+        return sum(buf.count(b'\n') for buf in f_gen)
+
+
+'''
+Count the newlines in bytes [start, end) of filename through a memory map,
+without copying the data out of it.
+'''
+def count_range(filename, start, end):
+    count = 0
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = np.frombuffer(mm, dtype=np.uint8)
+            block = None
+            for pos in range(start, end, BLOCK_SIZE):
+                block = data[pos:min(pos + BLOCK_SIZE, end)]
+                count += int(np.count_nonzero(block == ord('\n')))
+            # The array must be released before the map can be closed
+            del data, block
+    return count
+
+
+'''
+Count the newlines in filename with a memory map, splitting large files
+into one byte range per worker process.
+'''
+def mmap_count(filename, workers=None):
+    size = os.path.getsize(filename)
+    if size == 0:
+        return 0
+
+    workers = workers or os.cpu_count()
+    if workers == 1 or size < PARALLEL_THRESHOLD:
+        return count_range(filename, 0, size)
+
+    step = -(-size // workers)
+    ranges = [(filename, start, min(start + step, size))
+              for start in range(0, size, step)]
+    with multiprocessing.Pool(workers) as pool:
+        return sum(pool.starmap(count_range, ranges))
+
+
+def _load_cache():
+    try:
+        with open(CACHE_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _store_cache(key, value):
+    # Reload before writing so that counts stored by other processes in
+    # the meantime are kept.
+    cache = _load_cache()
+    cache[key] = value
+    tmp = CACHE_PATH + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(tmp, CACHE_PATH)
+
+
+'''
+Get number of lines in filename. Counts are cached by path, size and
+mtime, so asking again for an unchanged file is instant. Otherwise the
+line-offset index of the file is used if an up-to-date one exists, and
+the file is counted in parallel chunks if not.
 '''
-def rawgencount(filename):
-    f = open(filename, 'rb')
-    f_gen = _make_gen(f.raw.read)
-    return sum(buf.count(b'\n') for buf in f_gen)
\ No newline at end of file
+def rawgencount(filename, workers=None):
+    st = os.stat(filename)
+    key = os.path.abspath(filename)
+    cached = _load_cache().get(key)
+    if cached is not None and cached[:2] == [st.st_size, st.st_mtime_ns]:
+        return cached[2]
+
+    if is_compressed(filename):
+        count = serial_count(filename)
+    else:
+        index = load_index(filename)
+        if index is not None:
+            count = index.newlines()
+        else:
+            count = mmap_count(filename, workers)
+
+    _store_cache(key, [st.st_size, st.st_mtime_ns, count])
+    return count
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# lineindex.py
+# Sidecar line-offset index of a text file. The index of 'dir/file.txt' is
+# stored in 'dir/.file.txt.idx' (a dotfile, so that globs like
+# 'sampled/*' do not pick it up) as a flat array of little-endian uint64
+# byte offsets: the start of every line, followed by the file size. It is
+# memory-mapped when loaded, which gives instant line counts, random
+# access to any line, and cheap sharding of a file into equal-line chunks.
+# Compressed files cannot be indexed.
+
+import io
+import os
+
+import numpy as np
+
+from corpusio import is_compressed
+
+
+DTYPE = np.dtype('<u8')
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def index_path(path):
+    '''
+    Function: Get the path of the index of the given file.
+    Input: path to file (string)
+    Output: path to index (string)
+    '''
+    head, tail = os.path.split(path)
+    return os.path.join(head, '.' + tail + '.idx')
+
+
+def write_index(path, offsets):
+    '''
+    Function: Write the index of the given file from a sequence of line
+    start offsets that ends with the file size. Used by stages that know
+    the offsets of the lines they write.
+    Input: path to file (string), iterable of offsets (ints)
+    '''
+    dest = index_path(path)
+    tmp = dest + '.tmp'
+    np.fromiter(offsets, dtype=DTYPE).tofile(tmp)
+    os.replace(tmp, dest)
+
+
+def build_index(path):
+    '''
+    Function: Build the index of the given file in one sequential read.
+    Input: path to file (string)
+    Output: LineIndex
+    '''
+    dest = index_path(path)
+    tmp = dest + '.tmp'
+    pos = 0
+    last = b''
+
+    with open(path, 'rb') as f, open(tmp, 'wb') as out:
+        np.zeros(1, dtype=DTYPE).tofile(out)
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8)
+                                      == ord('\n'))
+            (newlines + (pos + 1)).astype(DTYPE).tofile(out)
+            pos += len(block)
+            last = block[-1:]
+
+        # A last line without a newline still ends at the end of the file
+        if pos > 0 and last != b'\n':
+            np.array([pos], dtype=DTYPE).tofile(out)
+
+    os.replace(tmp, dest)
+    return LineIndex(path)
+
+
+def load_index(path):
+    '''
+    Function: Load the index of the given file, if there is one and it is
+    not older than the file.
+    Input: path to file (string)
+    Output: LineIndex, or None
+    '''
+    idx = index_path(path)
+    try:
+        if os.stat(idx).st_mtime_ns < os.stat(path).st_mtime_ns:
+            return None
+    except FileNotFoundError:
+        return None
+
+    index = LineIndex(path)
+    if index.offsets[-1] != os.path.getsize(path):
+        return None
+    return index
+
+
+def get_index(path):
+    '''
+    Function: Load the index of the given file, building it first if it is
+    missing or out of date.
+    Input: path to file (string)
+    Output: LineIndex, or None for compressed files
+    '''
+    if is_compressed(path):
+        return None
+    index = load_index(path)
+    if index is None:
+        index = build_index(path)
+    return index
+
+
+class LineIndex:
+    '''
+    Memory-mapped line-offset index of a text file.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = np.memmap(index_path(path), dtype=DTYPE, mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def newlines(self):
+        '''
+        Function: Get the number of newline characters in the file, which
+        is one less than the number of lines if the last line has none.
+        Output: int
+        '''
+        n = len(self)
+        if n == 0:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(int(self.offsets[-1]) - 1)
+            if f.read(1) != b'\n':
+                n -= 1
+        return n
+
+    def byte_range(self, start, stop):
+        '''
+        Function: Get the byte range covered by lines [start, stop).
+        Output: (start offset, end offset)
+        '''
+        return int(self.offsets[start]), int(self.offsets[stop])
+
+    def read_lines(self, start, stop, encoding='utf-8'):
+        '''
+        Function: Read lines [start, stop) of the file, decoded exactly as
+        iterating over open(path, encoding=encoding, newline='\n') would
+        decode them. Lines end at '\n' only, as in the index, so that a
+        bare '\r' does not split a line and shift the line numbers.
+        Input: first and one-past-last line numbers (ints)
+        Output: list of lines (strings)
+        '''
+        begin, end = self.byte_range(start, stop)
+        with open(self.path, 'rb') as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return io.TextIOWrapper(io.BytesIO(data), encoding=encoding,
+                                newline='\n').readlines()
+
+    def read_line(self, i, encoding='utf-8'):
+        '''
+        Function: Read line i of the file.
+        Output: string
+        '''
+        return self.read_lines(i, i + 1, encoding)[0]
+
+    def shards(self, n):
+        '''
+        Function: Split the file into n shards of (nearly) equal numbers of
+        lines. Empty shards are left out.
+        Input: number of shards (int)
+        Output: list of (first line, one-past-last line) tuples
+        '''
+        bounds = np.linspace(0, len(self), n + 1).astype(int)
+        return [(int(bounds[k]), int(bounds[k + 1]))
+                for k in range(n) if bounds[k] < bounds[k + 1]]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# manifest.py
+# Keeps track of the artifacts written by the preprocessing stages
+# (cleaned/, sampled/ and csv/). For every output file, the manifest
+# records the stage that wrote it, the content hash of its input, the
+# parameters that were used and the content hash of the output itself.
+# A stage can then skip any output that is already up to date, and a
+# crashed run resumes at the first file that was never recorded.
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+MANIFEST_PATH = 'manifest.json'
+
+
+def file_hash(path):
+    '''
+    Function: Compute the content hash of the given file, reading it in
+    1 MiB blocks.
+    Input: path to file (string)
+    Output: hex digest (string)
+    '''
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_stat(path):
+    '''
+    Function: Get the size and modification time of the given file.
+    Input: path to file (string)
+    Output: (size, mtime in ns) tuple, or None if it does not exist
+    '''
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class Manifest:
+    '''
+    JSON manifest of preprocessing artifacts, keyed by output path. The
+    file is only ever replaced atomically, and updates are serialized with
+    a lock file, so several stages may record into it at the same time.
+    '''
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _hash_if_changed(self, path, stat, size, mtime, digest):
+        '''
+        Function: Reuse the recorded hash of a file whose size and mtime
+        have not changed, and rehash it otherwise.
+        '''
+        if stat == (size, mtime):
+            return digest
+        return file_hash(path)
+
+    def get(self, dest):
+        '''
+        Function: Get the manifest entry of the given output path.
+        Input: output path (string)
+        Output: entry (dict), or None
+        '''
+        return self._load().get(dest)
+
+    def is_up_to_date(self, dest, source, params):
+        '''
+        Function: Check whether dest was produced from the current content
+        of source with the same parameters, and has not changed since.
+        Input: output path, input path, parameters (JSON-serializable dict)
+        Output: boolean
+        '''
+        entry = self.get(dest)
+        if entry is None or entry['params'] != params:
+            return False
+
+        dest_stat = file_stat(dest)
+        source_stat = file_stat(source)
+        if dest_stat is None or source_stat is None:
+            return False
+
+        if self._hash_if_changed(
+                dest, dest_stat, entry['dest_size'], entry['dest_mtime'],
+                entry['dest_hash']) != entry['dest_hash']:
+            return False
+
+        return self._hash_if_changed(
+            source, source_stat, entry['source_size'], entry['source_mtime'],
+            entry['source_hash']) == entry['source_hash']
+
+    def record(self, stage, dest, source, params):
+        '''
+        Function: Record that dest was completely written from source with
+        the given parameters. Must only be called once dest is complete.
+        Input: stage name, output path, input path, parameters (dict)
+        '''
+        source_size, source_mtime = file_stat(source)
+        dest_size, dest_mtime = file_stat(dest)
+        entry = {
+            'stage': stage,
+            'source': source,
+            'source_hash': file_hash(source),
+            'source_size': source_size,
+            'source_mtime': source_mtime,
+            'params': params,
+            'dest_hash': file_hash(dest),
+            'dest_size': dest_size,
+            'dest_mtime': dest_mtime,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+        with self._locked():
+            manifest = self._load()
+            manifest[dest] = entry
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
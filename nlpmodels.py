@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# nlpmodels.py
+# Loads the spaCy pipelines of the parsing scripts. A profile says which
+# components of spaCy's English models (tagger, parser and ner) are
+# loaded. None of the scripts reads POS tags or named entities: they only
+# need the dependency parser, for sentence boundaries and heads, and
+# benepar, which predicts its own tags. The 'lean' profile therefore
+# leaves out the tagger and ner, which otherwise run on every sentence.
+# Pipelines can also be instrumented to time each of their components.
+
+import time
+from itertools import islice
+
+import spacy
+
+
+# Components of spaCy's English models that each profile leaves out.
+PROFILES = {
+    'full': [],
+    'lean': ['tagger', 'ner'],
+}
+DEFAULT_PROFILE = 'lean'
+
+
+class TimedComponent:
+    '''
+    Wrapper of a pipeline component (or of the tokenizer) that adds up the
+    time spent in it. Any other attribute is looked up on the component.
+    '''
+
+    def __init__(self, component):
+        self.component = component
+        self.seconds = 0.0
+
+    def __call__(self, doc):
+        start = time.perf_counter()
+        doc = self.component(doc)
+        self.seconds += time.perf_counter() - start
+        return doc
+
+    def pipe(self, docs, batch_size=128, **kwargs):
+        # Pull each batch from the previous component before starting the
+        # clock, so that only this component's time is counted.
+        docs = iter(docs)
+        while True:
+            batch = list(islice(docs, batch_size))
+            if not batch:
+                break
+            start = time.perf_counter()
+            if hasattr(self.component, 'pipe'):
+                batch = list(self.component.pipe(batch, batch_size=batch_size,
+                                                 **kwargs))
+            else:
+                batch = [self.component(doc) for doc in batch]
+            self.seconds += time.perf_counter() - start
+            yield from batch
+
+    def __getattr__(self, name):
+        return getattr(self.component, name)
+
+
+def load_pipeline(model, profile=DEFAULT_PROFILE, benepar=None, timed=False):
+    '''
+    Function: Load a spaCy model with the components of the given profile,
+    and add benepar to it.
+    Input: spaCy model name (string), profile name (string), benepar model
+        name (string, or None for no benepar), whether to time each
+        component (boolean)
+    Output: spaCy Language
+    '''
+    nlp = spacy.load(model, disable=PROFILES[profile])
+    if benepar is not None:
+        from benepar.spacy_plugin import BeneparComponent
+        nlp.add_pipe(BeneparComponent(benepar))
+    if timed:
+        instrument(nlp)
+    return nlp
+
+
+def pipeline_version(nlp):
+    '''
+    Function: Get the versions of spaCy and of the model of a pipeline,
+    which cache keys of its results depend on.
+    Input: spaCy Language
+    Output: string
+    '''
+    return ('spacy ' + spacy.__version__ + ', model '
+            + nlp.meta.get('version', 'unknown'))
+
+
+def instrument(nlp):
+    '''
+    Function: Wrap the tokenizer and every component of a pipeline in a
+    TimedComponent.
+    Input: spaCy Language
+    '''
+    if not isinstance(nlp.tokenizer, TimedComponent):
+        nlp.tokenizer = TimedComponent(nlp.tokenizer)
+    for name in nlp.pipe_names:
+        component = nlp.get_pipe(name)
+        if not isinstance(component, TimedComponent):
+            nlp.replace_pipe(name, TimedComponent(component))
+
+
+def component_times(nlp):
+    '''
+    Function: Get the time spent so far in each timed component of a
+    pipeline.
+    Input: spaCy Language
+    Output: dict from component name to seconds
+    '''
+    times = {}
+    for name, component in [('tokenizer', nlp.tokenizer)] + nlp.pipeline:
+        if isinstance(component, TimedComponent):
+            times[name] = component.seconds
+    return times
+
+
+def format_times(times):
+    '''
+    Function: Format component times, largest first, with their share of
+    the total.
+    Input: dict from component name to seconds
+    Output: string
+    '''
+    total = sum(times.values())
+    return ', '.join(
+        name + ' ' + '{:.1f}'.format(seconds) + ' s ('
+        + '{:.0f}'.format(100 * seconds / max(total, 1e-9)) + '%)'
+        for name, seconds in sorted(times.items(), key=lambda t: -t[1]))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# parsecache.py
+# On-disk cache of parse results, shared by all files and runs of the
+# parser. COCA repeats many lines (boilerplate, transcript formulas,
+# reprinted news), and overlapping samples repeat whole files, so each
+# distinct line only needs to be parsed once. Entries are keyed by a hash
+# of the line, without its line terminator, and of the name and version of the models that
+# parsed it, and the least recently used entries are evicted once the
+# cache grows beyond its size limit. The cache is a SQLite database, so
+# several parser processes may use it at the same time.
+
+import hashlib
+import json
+import sqlite3
+import time
+
+
+CACHE_PATH = 'parsecache.sqlite'
+
+# Size limit of the cache, in MB as the --cache-size options take it
+CACHE_BYTES = 2000 * 1000000
+
+# When the cache is over its limit, entries are evicted until it is back
+# under this fraction of it, so that eviction does not run on every insert.
+EVICT_TO = 0.9
+
+# Keys per SELECT, below SQLite's limit on the number of parameters.
+LOOKUP_CHUNK = 500
+
+
+def normalize(text):
+    '''
+    Function: Normalize a line for use as a cache key by removing its line
+    terminator. Other whitespace is kept as it is: the cached rows include
+    the sentence text, so lines that differ in any other whitespace (tabs
+    and no-break spaces survive COCAcleaner) must not share an entry.
+    Input: line (string)
+    Output: normalized line (string)
+    '''
+    return text.rstrip('\r\n')
+
+
+class ParseCache:
+    '''
+    Size-bounded LRU cache from lines to the [sentence text, parse tree]
+    rows of their parse.
+    '''
+
+    def __init__(self, path=CACHE_PATH, model='', version='',
+                 max_bytes=CACHE_BYTES, normalize_keys=True):
+        self.path = path
+        self.prefix = (model + '\n' + version + '\n').encode('utf-8')
+        self.max_bytes = max_bytes
+        self.normalize_keys = normalize_keys
+
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS parses ('
+                            'key BLOB PRIMARY KEY, rows TEXT NOT NULL, '
+                            'size INTEGER NOT NULL, used INTEGER NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS parses_used '
+                            'ON parses (used)')
+
+        # Bytes added since the size of the cache was last checked
+        self.added = 0
+        self.evict()
+
+    def key(self, text):
+        '''
+        Function: Get the cache key of a line.
+        Input: line (string)
+        Output: key (bytes)
+        '''
+        if self.normalize_keys:
+            text = normalize(text)
+        h = hashlib.blake2b(self.prefix, digest_size=20)
+        h.update(text.encode('utf-8'))
+        return h.digest()
+
+    def get_many(self, texts):
+        '''
+        Function: Look up the rows of several lines at once, and mark the
+        ones that are found as recently used.
+        Input: list of lines (strings)
+        Output: list of rows (lists of [text, tree] lists), with None for
+            each line that is not in the cache
+        '''
+        keys = [self.key(text) for text in texts]
+        found = {}
+        unique = list(set(keys))
+        for k in range(0, len(unique), LOOKUP_CHUNK):
+            chunk = unique[k:k + LOOKUP_CHUNK]
+            query = ('SELECT key, rows FROM parses WHERE key IN ('
+                     + ','.join('?' * len(chunk)) + ')')
+            for key, rows in self.db.execute(query, chunk):
+                found[key] = json.loads(rows)
+
+        if found:
+            now = time.time_ns()
+            with self.db:
+                self.db.executemany('UPDATE parses SET used = ? WHERE key = ?',
+                                    [(now, key) for key in found])
+
+        return [found.get(key) for key in keys]
+
+    def put_many(self, items):
+        '''
+        Function: Store the rows of several lines, then evict the least
+        recently used entries if the cache is over its size limit.
+        Input: list of (line, rows) tuples
+        '''
+        if not items:
+            return
+        now = time.time_ns()
+        entries = []
+        for text, rows in items:
+            key = self.key(text)
+            value = json.dumps(rows, ensure_ascii=False)
+            size = len(key) + len(value.encode('utf-8'))
+            entries.append((key, value, size, now))
+            self.added += size
+
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO parses '
+                                '(key, rows, size, used) VALUES (?, ?, ?, ?)',
+                                entries)
+
+        if self.added > self.max_bytes * (1 - EVICT_TO):
+            self.evict()
+
+    def size(self):
+        '''
+        Function: Get the total size of the cached entries.
+        Output: bytes (int)
+        '''
+        return self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM parses').fetchone()[0]
+
+    def evict(self):
+        '''
+        Function: Delete the least recently used entries until the cache
+        is back under EVICT_TO of its size limit.
+        '''
+        self.added = 0
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        excess += self.max_bytes * (1 - EVICT_TO)
+
+        keys = []
+        freed = 0
+        for key, size in self.db.execute(
+                'SELECT key, size FROM parses ORDER BY used'):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+
+        with self.db:
+            self.db.executemany('DELETE FROM parses WHERE key = ?', keys)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# parseserver.py
+# Local parse server. Loading spaCy's large English model and benepar takes
+# tens of seconds and gigabytes of memory, so instead of every script
+# loading its own copy, the server loads them once and answers batched
+# requests on a Unix socket. fileparser.py, coordination.py and
+# headfinder.py use the server when it is running, and load the models
+# themselves when it is not.
+#
+# Start it in the background with:
+#     python parseserver.py --daemon
+# and stop it with:
+#     python parseserver.py --stop
+#
+# The protocol is one JSON object per line in each direction. Requests:
+#     {"op": "info"}
+#         -> {"model": ..., "version": ..., "pipeline_version": ...,
+#             "profile": ...}
+#     {"op": "parse", "texts": [...], "batch_size": n, "bucket": b}
+#         -> {"results": [[rows, ok], ...]}, one per text, where rows are
+#            the [sentence text, parse tree] of each sentence, and ok is
+#            false if parsing failed
+#     {"op": "heads", "texts": [...]}
+#         -> {"heads": [...]}, the root of the first sentence of each text
+#            (or null), from the dependency parser alone
+#     {"op": "shutdown"}
+# Failed requests get {"error": message}.
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+
+SOCKET_PATH = 'parseserver.sock'
+LOG_PATH = 'parseserver.log'
+
+# Texts per request sent by the client, to keep messages small.
+REQUEST_TEXTS = 1000
+
+
+class ParseClient:
+    '''
+    Client of a running parse server.
+    '''
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.file = self.sock.makefile('rwb')
+        self._info = None
+
+    def request(self, message):
+        '''
+        Function: Send a request to the server and wait for its reply.
+        Input: request (dict)
+        Output: reply (dict)
+        '''
+        self.file.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The parse server at " + self.path
+                                  + " closed the connection.")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RuntimeError("Parse server error: " + reply['error'])
+        return reply
+
+    def info(self):
+        '''
+        Function: Get the model name, version and profile of the server.
+        Output: dict
+        '''
+        if self._info is None:
+            self._info = self.request({'op': 'info'})
+        return self._info
+
+    def parse(self, texts, batch_size=1, bucket=False):
+        '''
+        Function: Parse texts on the server.
+        Input: list of texts (strings), batch size (int), whether to bucket
+            batches by length (boolean)
+        Output: list of (rows, ok) tuples, one per text
+        '''
+        results = []
+        for k in range(0, len(texts), REQUEST_TEXTS):
+            reply = self.request({'op': 'parse',
+                                  'texts': texts[k:k + REQUEST_TEXTS],
+                                  'batch_size': batch_size,
+                                  'bucket': bucket})
+            results.extend((rows, ok) for rows, ok in reply['results'])
+        return results
+
+    def heads(self, texts):
+        '''
+        Function: Get the syntactic head of each text on the server.
+        Input: list of texts (strings)
+        Output: list of heads (strings, or None)
+        '''
+        heads = []
+        for k in range(0, len(texts), REQUEST_TEXTS):
+            heads.extend(self.request(
+                {'op': 'heads', 'texts': texts[k:k + REQUEST_TEXTS]})['heads'])
+        return heads
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def connect(path=SOCKET_PATH, model=None, profile=None):
+    '''
+    Function: Connect to the parse server, if it is running and serves the
+    given models with the given profile, so that results do not depend on
+    whether it is running. model is either the full name of the models
+    ('en_core_web_lg + benepar_en2') or the name of the spaCy model alone,
+    for requests that only use spaCy. Either may be None to accept any.
+    Input: path to the server socket (string), model name (string or
+        None), profile name (string or None)
+    Output: ParseClient, or None
+    '''
+    try:
+        client = ParseClient(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+
+    info = client.info()
+    served = info['model'] + ' (' + info['profile'] + ' profile)'
+    if ((model is not None and info['model'] != model
+         and not info['model'].startswith(model + ' + '))
+            or (profile is not None and info['profile'] != profile)):
+        print("The parse server at " + path + " serves " + served
+              + " rather than " + (model or info['model']) + " ("
+              + (profile or info['profile']) + " profile), so it is not "
+              "used.")
+        client.close()
+        return None
+    return client
+
+
+class ParseHandler(socketserver.StreamRequestHandler):
+    '''
+    Answers the requests of one client connection, one line at a time.
+    '''
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.answer(json.loads(line))
+            except Exception as e:
+                reply = {'error': type(e).__name__ + ': ' + str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            if reply.get('shutdown'):
+                # shutdown() waits for serve_forever, so it cannot be
+                # called from the thread of a request.
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+class ParseServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    '''
+    Unix socket server around a single copy of the models. Every client
+    has its own thread, and requests are answered one at a time.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, path, profile):
+        import fileparser
+        from nlpmodels import pipeline_version
+
+        self.fileparser = fileparser
+        self.nlp = fileparser.load_model(profile)
+        self.model_info = {'model': fileparser.MODEL_NAME,
+                           'version': fileparser.model_version(self.nlp),
+                           'pipeline_version': pipeline_version(self.nlp),
+                           'profile': profile}
+        self.lock = threading.Lock()
+        socketserver.UnixStreamServer.__init__(self, path, ParseHandler)
+
+    def answer(self, message):
+        op = message['op']
+        if op == 'info':
+            return self.model_info
+        if op == 'shutdown':
+            return {'shutdown': True}
+
+        texts = message['texts']
+        with self.lock:
+            if op == 'parse':
+                return {'results': self.parse(
+                    texts, message.get('batch_size', 1),
+                    message.get('bucket', False))}
+            if op == 'heads':
+                return {'heads': self.heads(texts)}
+        raise ValueError("unknown op " + repr(op))
+
+    def parse(self, texts, batch_size, bucket):
+        fp = self.fileparser
+        if batch_size <= 1:
+            return [fp.parse_line(self.nlp, text) for text in texts]
+
+        results = [None] * len(texts)
+        lengths = [fp.line_length(text) for text in texts]
+        for batch in fp.get_batches(lengths, batch_size, bucket):
+            for i, result in zip(batch, fp.parse_batch(
+                    self.nlp, [texts[i] for i in batch])):
+                results[i] = result
+        return results
+
+    def heads(self, texts):
+        heads = []
+        with self.nlp.disable_pipes(*[name for name in self.nlp.pipe_names
+                                      if name != 'parser']):
+            for doc in self.nlp.pipe(texts):
+                sents = list(doc.sents)
+                heads.append(str(sents[0].root) if sents else None)
+        return heads
+
+
+def daemonize(log_path):
+    '''
+    Function: Detach from the terminal and continue in a background
+    process, writing its output to log_path. The foreground process exits.
+    Input: path to log file (string)
+    '''
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    pid = os.fork()
+    if pid > 0:
+        print("Parse server started in the background (pid " + str(pid)
+              + "). Its output is written to " + log_path + ".")
+        os._exit(0)
+
+    log = open(log_path, 'a')
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+    devnull = open(os.devnull)
+    os.dup2(devnull.fileno(), sys.stdin.fileno())
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    from nlpmodels import PROFILES, DEFAULT_PROFILE
+
+    parser = argparse.ArgumentParser(
+        description='Serve parses of spaCy and Benepar on a Unix socket.')
+    parser.add_argument('--socket', type=str, default=SOCKET_PATH,
+                        help='path of the socket '
+                        '(default: ' + SOCKET_PATH + ')')
+    parser.add_argument('--profile', choices=sorted(PROFILES),
+                        default=DEFAULT_PROFILE,
+                        help='spaCy components to load '
+                        '(default: ' + DEFAULT_PROFILE + ')')
+    parser.add_argument('--daemon', action='store_true',
+                        help='run in the background, logging to '
+                        + LOG_PATH)
+    parser.add_argument('--stop', action='store_true',
+                        help='stop the running server')
+    return parser.parse_args()
+
+
+'''
+Main function.
+'''
+if __name__ == "__main__":
+
+    args = get_args()
+
+    client = connect(args.socket)
+    if args.stop:
+        if client is None:
+            print("No parse server is running at " + args.socket + ".")
+            sys.exit(1)
+        client.request({'op': 'shutdown'})
+        print("Parse server at " + args.socket + " stopped.")
+        sys.exit(0)
+
+    if client is not None:
+        print("A parse server is already running at " + args.socket + ".")
+        sys.exit(1)
+
+    # Nothing answers on the socket, so it is left over from a server
+    # that did not shut down cleanly.
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+
+    if args.daemon:
+        daemonize(LOG_PATH)
+
+    server = ParseServer(args.socket, args.profile)
+    print("Parse server ready on " + args.socket + ".", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(args.socket)
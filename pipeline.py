@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# pipeline.py
+# Runs the preprocessing stages (COCAcleaner.py, filesampler.py,
+# fileparser.py and ccpfinder.py) as a dependency graph with one job per
+# stage and COCA file: the sample of a file only waits for the cleaning of
+# that file, its parse for its sample, and so on. Jobs whose inputs are
+# ready run at the same time, up to --jobs of them, and at most
+# --parse-jobs parses, since each parser loads its own copy of the models
+# (unless the parse server is running, in which case every parse job uses
+# it). A job is skipped when the manifest says that its output is up to
+# date, and the jobs that depend on a failed job are not run. Each job is
+# the stage script run on one file, with its output written to a log file
+# in logs/. At the end, a timing report gives the job time of every stage
+# and genre.
+#
+# preprocess runs the clean, sample and parse stages, e.g.:
+#     python pipeline.py --jobs 4 --stages clean sample parse -- COCA/*/*
+# and findccps runs the ccp stage on the parse tables already in csv/:
+#     python pipeline.py --tables csv/w_acad_????/w_acad_????.csv
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from manifest import Manifest
+from corpusio import split_compression
+from tablestore import table_path, FORMATS
+
+
+STAGES = ['clean', 'sample', 'parse', 'ccp']
+LOG_DIR = 'logs/'
+
+# The stage scripts are next to this one, and write their outputs relative
+# to the working directory.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Job:
+    '''
+    One stage of the pipeline, run on one file.
+    '''
+
+    def __init__(self, stage, name, genre, source, dest, command, params):
+        self.stage = stage
+        self.name = name
+        self.genre = genre
+        self.source = source
+        self.dest = dest
+        self.command = command
+        self.params = params
+        self.deps = []
+        self.state = 'waiting'
+        # Whether the output is up to date, checked once the jobs it
+        # depends on are done
+        self.up_to_date = None
+        self.seconds = 0.0
+        self.start = None
+        self.end = None
+
+    def __str__(self):
+        return self.stage + " " + self.name
+
+
+def parse_dest(file, compress=None, fmt='csv'):
+    '''
+    Function: Get the path of the parse table of a sampled file, as
+    fileparser.get_dest does (fileparser.py itself loads spaCy on import).
+    Input: path to sampled file (string), output compression, 'csv' or
+        'parquet'
+    Output: path in the csv/ directory (string)
+    '''
+    name = split_compression(os.path.basename(file))[0]
+    dest_name = os.path.splitext(name)[-2]
+    return table_path('csv/' + dest_name + '/' + dest_name, file, fmt,
+                      compress)
+
+
+def script(name):
+    '''
+    Function: Get the path of a stage script.
+    Input: file name (string)
+    Output: path (string)
+    '''
+    return os.path.join(SCRIPT_DIR, name)
+
+
+def build_jobs(files, stages, args):
+    '''
+    Function: Build the jobs of the given stages for every COCA file, each
+    depending on the job of the previous stage on the same file, if that
+    stage is run.
+    Input: paths to COCA files (list of strings), stages to run (list),
+        parsed command-line arguments
+    Output: list of jobs, in order of file and stage
+    '''
+    import COCAcleaner
+    import filesampler
+    import ccpfinder
+
+    python = [sys.executable]
+    force = ['--force'] if args.force else []
+    compress = ['--compress', args.compress] if args.compress else []
+    seed = ['--seed', str(args.seed)] if args.seed is not None else []
+
+    jobs = []
+    if args.tables:
+        for file in files:
+            name = os.path.splitext(
+                split_compression(os.path.basename(file))[0])[0]
+            jobs.append(Job('ccp', name, table_genre(name), file,
+                            ccpfinder.get_dest(file),
+                            python + [script('ccpfinder.py'), file] + force,
+                            {'reference': False}))
+        return jobs
+
+    for file in files:
+        genre = os.path.basename(os.path.dirname(os.path.abspath(file)))
+        name = os.path.splitext(
+            split_compression(os.path.basename(file))[0])[0]
+
+        cleaned = COCAcleaner.get_dest(file, args.compress)
+        sampled = filesampler.get_dest(cleaned, args.compress)
+        parsed = parse_dest(sampled, args.compress, args.format)
+        ccps = ccpfinder.get_dest(parsed)
+
+        chain = [
+            Job('clean', name, genre, file, cleaned,
+                python + [script('COCAcleaner.py'), file] + compress + force,
+                COCAcleaner.PARAMS),
+            Job('sample', name, genre, cleaned, sampled,
+                python + [script('filesampler.py'), cleaned, '--bytes',
+                          str(args.bytes)] + seed + compress + force,
+                {'bytes': args.bytes, 'seed': args.seed}),
+            # The parameters of a parse are checked by fileparser.py
+            Job('parse', name, genre, sampled, parsed,
+                python + [script('fileparser.py'), sampled, '--format',
+                          args.format]
+                + compress + force + shlex.split(args.parse_args),
+                None),
+            Job('ccp', name, genre, parsed, ccps,
+                python + [script('ccpfinder.py'), parsed] + force,
+                {'reference': False}),
+        ]
+
+        previous = None
+        for job in chain:
+            if job.stage not in stages:
+                continue
+            if previous is not None:
+                job.deps.append(previous)
+            jobs.append(job)
+            previous = job
+    return jobs
+
+
+def table_genre(name):
+    '''
+    Function: Get the genre of a parse table from its name, which is that
+    of its COCA file, e.g. w_acad_1990.
+    Input: name of the table, without extension (string)
+    Output: genre (string)
+    '''
+    parts = name.split('_')
+    return parts[1] if len(parts) > 2 and parts[0] == 'w' else name
+
+
+def is_up_to_date(manifest, job):
+    '''
+    Function: Check whether the manifest says that the output of a job is
+    up to date. Jobs without parameters only need an entry whose input is
+    unchanged, and leave the check of their parameters to the stage.
+    Input: Manifest, job
+    Output: boolean
+    '''
+    params = job.params
+    if params is None:
+        entry = manifest.get(job.dest)
+        if entry is None:
+            return False
+        params = entry['params']
+    return manifest.is_up_to_date(job.dest, job.source, params)
+
+
+def run_job(job):
+    '''
+    Function: Run a job, writing its output to its log file.
+    Input: job
+    Output: exit status of the job (int)
+    '''
+    log_path = LOG_DIR + job.stage + '_' + job.name + '.log'
+    job.start = time.time()
+    with open(log_path, 'w') as log:
+        status = subprocess.call(job.command, stdout=log,
+                                 stderr=subprocess.STDOUT)
+    job.end = time.time()
+    job.seconds = job.end - job.start
+    return status
+
+
+def run_jobs(jobs, max_jobs, max_parse_jobs, force=False):
+    '''
+    Function: Run jobs as soon as the jobs they depend on are done, at
+    most max_jobs at a time and max_parse_jobs parses at a time. Jobs
+    whose output is up to date are skipped, and jobs that depend on a
+    failed job are not run. Later stages come first, so that files are
+    finished one after the other rather than all at the end.
+    Input: list of jobs, job limits (ints), whether to run up-to-date jobs
+    Output: True if every job succeeded or was skipped
+    '''
+    manifest = Manifest()
+    limits = {'parse': max_parse_jobs}
+    running = {}
+    order = sorted(jobs, key=lambda job: -STAGES.index(job.stage))
+
+    def schedule(executor):
+        '''
+        Go once through the waiting jobs, starting those that can run.
+        Returns whether any job changed state.
+        '''
+        changed = False
+        for job in order:
+            if job.state != 'waiting':
+                continue
+            if any(dep.state == 'failed' or dep.state == 'blocked'
+                   for dep in job.deps):
+                job.state = 'blocked'
+                changed = True
+                print("Not running " + str(job) + ", since a job it "
+                      "depends on failed.")
+                continue
+            if any(dep.state != 'done' and dep.state != 'skipped'
+                   for dep in job.deps):
+                continue
+            # Checked once, since it reloads the manifest and may hash the
+            # input, while the job may wait many passes for a free slot.
+            if job.up_to_date is None:
+                job.up_to_date = not force and is_up_to_date(manifest, job)
+            if job.up_to_date:
+                job.state = 'skipped'
+                changed = True
+                continue
+            if not os.path.exists(job.source):
+                job.state = 'failed'
+                changed = True
+                print("Cannot run " + str(job) + ": " + job.source
+                      + " does not exist.")
+                continue
+            if len(running) >= max_jobs:
+                continue
+            if job.stage in limits and sum(
+                    1 for other in running.values()
+                    if other.stage == job.stage) >= limits[job.stage]:
+                continue
+
+            print("Starting " + str(job) + "...")
+            job.state = 'running'
+            changed = True
+            running[executor.submit(run_job, job)] = job
+        return changed
+
+    with ThreadPoolExecutor(max_jobs) as executor:
+        while True:
+            # Skipping or failing a job may free the jobs after it
+            while schedule(executor):
+                pass
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                if future.result() == 0:
+                    job.state = 'done'
+                    print("Finished " + str(job) + " in "
+                          + format_seconds(job.seconds) + ".")
+                else:
+                    job.state = 'failed'
+                    print("FAILED: " + str(job) + " (exit status "
+                          + str(future.result()) + "), see " + LOG_DIR
+                          + job.stage + '_' + job.name + '.log')
+
+    return all(job.state == 'done' or job.state == 'skipped' for job in jobs)
+
+
+def format_seconds(seconds):
+    '''
+    Function: Format a duration as h:mm:ss.
+    Input: seconds (float)
+    Output: string
+    '''
+    seconds = int(round(seconds))
+    return (str(seconds // 3600) + ":" + str(seconds // 60 % 60).zfill(2)
+            + ":" + str(seconds % 60).zfill(2))
+
+
+def print_report(jobs, wall):
+    '''
+    Function: Print the number of jobs of every stage and genre that ran,
+    were skipped or failed, the time spent in them, and the time from the
+    start of the first to the end of the last.
+    Input: list of jobs, wall-clock time of the whole run (seconds)
+    '''
+    print("======================================================================================================================")
+    for key in ['stage', 'genre']:
+        print("{:<16}{:>6}{:>9}{:>8}{:>12}{:>12}".format(
+            key.capitalize(), "Ran", "Skipped", "Failed", "Job time",
+            "Span"))
+        groups = OrderedDict()
+        for job in jobs:
+            groups.setdefault(getattr(job, key), []).append(job)
+        for group, members in groups.items():
+            ran = [job for job in members if job.state == 'done']
+            timed = [job for job in members if job.start is not None]
+            span = (max(job.end for job in timed)
+                    - min(job.start for job in timed)) if timed else 0
+            print("{:<16}{:>6}{:>9}{:>8}{:>12}{:>12}".format(
+                group, len(ran),
+                sum(1 for job in members if job.state == 'skipped'),
+                sum(1 for job in members
+                    if job.state == 'failed' or job.state == 'blocked'),
+                format_seconds(sum(job.seconds for job in timed)),
+                format_seconds(span)))
+        print("")
+
+    busy = sum(job.seconds for job in jobs)
+    print("Total: " + format_seconds(busy) + " of job time in "
+          + format_seconds(wall) + " ("
+          + "{:.1f}".format(busy / wall if wall > 0 else 0)
+          + " jobs running on average).")
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    import filesampler
+
+    parser = argparse.ArgumentParser(
+        description='Run the preprocessing stages on COCA files, as a '
+        'dependency graph of one job per stage and file.')
+    parser.add_argument('input_files', nargs='+', type=str,
+                        help='COCA files, e.g. COCA/*/*, or parse tables '
+                        'with --tables')
+    parser.add_argument('--tables', action='store_true',
+                        help='the inputs are existing parse tables, e.g. '
+                        'csv/w_acad_????/w_acad_????.csv, on which only the '
+                        'ccp stage is run')
+    parser.add_argument('--stages', nargs='+', choices=STAGES,
+                        default=STAGES,
+                        help='stages to run (default: all of them); put '
+                        '-- between them and the input files')
+    parser.add_argument('--jobs', type=int, default=0,
+                        help='jobs run at the same time; 0 for one per core '
+                        '(default: 0)')
+    parser.add_argument('--parse-jobs', type=int, default=1,
+                        help='parse jobs run at the same time, each loading '
+                        'its own models (default: 1)')
+    parser.add_argument('--parse-args', type=str, default='',
+                        help='more arguments of fileparser.py, e.g. '
+                        '"--batch-size 32 --bucket"')
+    parser.add_argument('--bytes', type=int,
+                        default=filesampler.BYTES_TO_SAMPLE,
+                        help='number of bytes to sample from each file '
+                        '(default: ' + str(filesampler.BYTES_TO_SAMPLE) + ')')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed of the sampler')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='format of the parse and ccp tables '
+                        '(default: csv)')
+    parser.add_argument('--compress', choices=['none', 'gz', 'xz', 'zst'],
+                        help='compression of the outputs (default: same as '
+                        'the input)')
+    parser.add_argument('--force', action='store_true',
+                        help='run every job, even if the manifest says its '
+                        'output is up to date')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only list the jobs and their dependencies')
+    return parser.parse_args()
+
+
+'''
+Main function.
+'''
+if __name__ == "__main__":
+
+    args = get_args()
+
+    stages = ['ccp'] if args.tables else args.stages
+    jobs = build_jobs(args.input_files, stages, args)
+    if args.dry_run:
+        for job in jobs:
+            print(str(job) + ": " + " ".join(job.command[1:])
+                  + ("  (after " + ", ".join(str(dep) for dep in job.deps)
+                     + ")" if job.deps else ""))
+        sys.exit(0)
+
+    # Made here, since jobs of the same stage would race to make them
+    for directory in [LOG_DIR, 'cleaned/', 'sampled/', 'csv/']:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    max_jobs = args.jobs or os.cpu_count()
+    print("Running " + str(len(jobs)) + " jobs, " + str(max_jobs)
+          + " at a time. The output of each job is stored in " + LOG_DIR
+          + ".\n")
+
+    start = time.time()
+    ok = run_jobs(jobs, max_jobs, args.parse_jobs, args.force)
+    print_report(jobs, time.time() - start)
+    sys.exit(0 if ok else 1)
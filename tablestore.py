@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# tablestore.py
+# Reads and writes the tables passed between the stages (the parse csvs,
+# _ccps, _heads, _sim, _syns and the rest) as either CSV or Parquet. The
+# format is chosen from the file extension, so a stage whose output is
+# named after its input keeps the format of the input. Parquet files are
+# compressed with zstd, store the category columns dictionary-encoded,
+# and can be read one column at a time, so that the parse tree column is
+# only decoded by the stages that use it.
+
+import os
+
+import pandas as pd
+
+from corpusio import open_file, split_compression, output_ext
+
+
+FORMATS = ['csv', 'parquet']
+PARQUET_COMPRESSION = 'zstd'
+
+# Rows per Parquet row group, the unit in which iter_table reads them.
+ROW_GROUP_ROWS = 100000
+
+# Columns with few distinct values, stored as pandas categoricals (and so
+# as dictionary-encoded Parquet columns).
+CATEGORY_COLUMNS = ['1st Conjunct Category', '2nd Conjunct Category',
+                    'Conjunction']
+
+# Columns of a coordination that the analysis stages compute from: every
+# column of a _ccps table but the parse tree, which they have no use for.
+# The other columns are only read once the results are ready, to be
+# carried over to the output tables (see carry_columns).
+ANALYSIS_COLUMNS = ['1st Conjunct Category', '1st Conjunct Text',
+                    '2nd Conjunct Category', '2nd Conjunct Text',
+                    'Conjunction', 'Sentence Text']
+
+# Columns added by headfinder.py
+HEAD_COLUMNS = ['1st Conjunct Head', '2nd Conjunct Head']
+
+
+def table_format(path):
+    '''
+    Function: Get the format of a table from its file extension.
+    Input: path (string)
+    Output: 'csv' or 'parquet'
+    '''
+    if split_compression(path)[0].endswith('.parquet'):
+        return 'parquet'
+    return 'csv'
+
+
+def table_path(base, input_path, fmt=None, compress=None):
+    '''
+    Function: Get the path of an output table. Like compression, the format
+    follows the input table unless fmt says otherwise. Parquet files are
+    compressed internally, so they get no compression extension.
+    Input: output path without extension (string), path of the input file
+        (string), 'csv', 'parquet' or None, and 'none', 'gz', 'xz', 'zst'
+        or None
+    Output: path (string)
+    '''
+    fmt = fmt or table_format(input_path)
+    if fmt == 'parquet':
+        return base + '.parquet'
+    return base + '.csv' + output_ext(input_path, compress)
+
+
+def read_table(path, columns=None):
+    '''
+    Function: Read a CSV or Parquet table, optionally only some of its
+    columns. The category columns of Parquet tables are always read as
+    categoricals, however they were written.
+    Input: path (string), list of column names or None for all of them
+    Output: pandas DataFrame
+    '''
+    if table_format(path) == 'parquet':
+        return to_categories(pd.read_parquet(path, columns=columns))
+    with open_file(path) as f:
+        return pd.read_csv(f, usecols=columns)
+
+
+def iter_table(path, columns=None, chunk_rows=ROW_GROUP_ROWS):
+    '''
+    Function: Read a CSV or Parquet table in chunks of at most chunk_rows
+    rows, so that memory stays bounded however large the table is.
+    Input: path (string), list of column names or None for all of them,
+        rows per chunk (int)
+    Output: generator of pandas DataFrames
+    '''
+    if table_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+
+        table = pq.ParquetFile(path)
+        for k in range(table.num_row_groups):
+            group = table.read_row_group(k, columns=columns)
+            for start in range(0, group.num_rows, chunk_rows):
+                yield to_categories(
+                    group.slice(start, chunk_rows).to_pandas())
+        return
+
+    with open_file(path) as f:
+        for chunk in pd.read_csv(f, usecols=columns, chunksize=chunk_rows):
+            yield chunk
+
+
+def table_columns(path):
+    '''
+    Function: Get the column names of a CSV or Parquet table, without
+    reading its rows.
+    Input: path (string)
+    Output: list of column names
+    '''
+    if table_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+    with open_file(path) as f:
+        return list(pd.read_csv(f, nrows=0).columns)
+
+
+def carry_columns(path, df, rows=None):
+    '''
+    Function: Add back the columns of the table at path that df lacks,
+    where df holds some of the rows of that table, read with only some of
+    its columns, and the columns computed from them. The rows of df are
+    those at the given positions in the table, or at the positions in the
+    index of df, as read_table gives them, if rows is None.
+    Input: path (string), pandas DataFrame, list of row positions or None
+    Output: pandas DataFrame with every column of the table, in its order,
+        followed by the columns added to df
+    '''
+    columns = table_columns(path)
+    rest = [column for column in columns if column not in df.columns]
+    if rest:
+        other = read_table(path, columns=rest).iloc[
+            df.index if rows is None else rows]
+        other.index = df.index
+        df = pd.concat([df, other], axis=1)
+    return df[columns + [column for column in df.columns
+                         if column not in columns]]
+
+
+def to_categories(df):
+    '''
+    Function: Convert the category columns of a table to categoricals.
+    Input: pandas DataFrame
+    Output: pandas DataFrame
+    '''
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def write_table(df, path, index=False):
+    '''
+    Function: Write a table as CSV or Parquet, depending on the extension
+    of path. The file is written under a temporary name and only renamed
+    once it is complete.
+    Input: pandas DataFrame, path (string), whether to write the index
+    '''
+    head, tail = os.path.split(path)
+    tmp = os.path.join(head, '.' + tail + '.tmp')
+    if table_format(path) == 'parquet':
+        to_categories(df.copy()).to_parquet(
+            tmp, engine='pyarrow', compression=PARQUET_COMPRESSION,
+            index=index, row_group_size=ROW_GROUP_ROWS)
+    else:
+        # Keep the compression extension, which open_file goes by
+        tmp += split_compression(path)[1]
+        with open_file(tmp, 'w') as f:
+            df.to_csv(f, index=index)
+    os.replace(tmp, path)
+
+
+class TableAppender:
+    '''
+    Writes a CSV or Parquet table one chunk of rows at a time, so that the
+    whole table never has to be in memory. The file is written under a
+    temporary name and only renamed once it is closed. In Parquet files,
+    each chunk becomes a row group, and columns are not converted to
+    categoricals, since the dictionaries of the chunks would differ, but
+    read_table and iter_table read the category columns back as
+    categoricals. A Parquet schema can be given for the columns whose type
+    pandas cannot tell from every chunk, such as list columns.
+    '''
+
+    def __init__(self, path, columns, schema=None):
+        self.path = path
+        self.columns = columns
+        self.schema = schema
+        head, tail = os.path.split(path)
+        self.tmp = os.path.join(head, '.' + tail + '.tmp')
+        self.writer = None
+        self.file = None
+        if table_format(path) == 'csv':
+            # Keep the compression extension, which open_file goes by
+            self.tmp += split_compression(path)[1]
+            self.file = open_file(self.tmp, 'w')
+            self.file.write(pd.DataFrame(columns=columns).to_csv(index=False))
+
+    def append(self, df):
+        '''
+        Function: Write a chunk of rows.
+        Input: pandas DataFrame with the columns of the table
+        '''
+        if self.file is not None:
+            df.to_csv(self.file, header=False, index=False)
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, schema=self.schema,
+                                     preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(
+                self.tmp, table.schema, compression=PARQUET_COMPRESSION)
+        self.writer.write_table(table)
+
+    def close(self):
+        '''
+        Function: Finish the table and move it into place.
+        '''
+        if self.file is not None:
+            self.file.close()
+        elif self.writer is None:
+            # A Parquet table without any rows
+            if self.schema is None:
+                write_table(pd.DataFrame(columns=self.columns), self.path)
+                return
+            import pyarrow.parquet as pq
+            pq.write_table(self.schema.empty_table(), self.tmp,
+                           compression=PARQUET_COMPRESSION)
+        else:
+            self.writer.close()
+        os.replace(self.tmp, self.path)
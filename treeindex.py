@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# treeindex.py
+# Inverted index over the trees of a tree store (see treestore.py), so
+# that a question such as "all ADJP+PP coordinations with 'but'" only
+# looks at the trees that can answer it, instead of running ccpfinder.py
+# over every table again. For every tree, the index records the labels of
+# its nodes ('L:ADJP'), the label of each node under the label of its
+# parent ('P:VP>CC') and its words, lowercased ('T:but'). Each of these
+# terms has a posting list: the sorted numbers of the trees that contain
+# it, stored as varint-encoded gaps and compressed with zlib. A query
+# intersects the posting lists of the terms that its answers must contain,
+# keeps the trees in which the conjunction and both conjuncts can be
+# children of the same node, and runs the exact matcher (StoredTree.coordphrases) on those trees
+# alone. Trees that the store keeps without nodes are always candidates.
+#
+# The index is written into the store, as index.bin and index.json:
+#     python treeindex.py build csv/*/*.trees
+#     python treeindex.py query csv/*/*.trees --first ADJP --second PP \
+#         --conj but --output adjp_pp_but.csv
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from manifest import Manifest
+from tablestore import TableAppender
+from treestore import TreeStore, store_meta
+
+
+INDEX_VERSION = 3
+
+# Posting list of the trees that the store keeps without nodes
+NODELESS = '*'
+
+# zlib compression level of the posting lists
+ZLIB_LEVEL = 6
+
+# Trees matched at a time by a query
+QUERY_CHUNK = 10000
+
+
+def encode_postings(trees):
+    '''
+    Function: Encode a sorted array of tree numbers as the varints of its
+    gaps, 7 bits per byte with the high bit set on all but the last byte
+    of each number, compressed with zlib.
+    Input: sorted numpy array of ints
+    Output: bytes
+    '''
+    gaps = np.diff(trees, prepend=0).astype(np.int64)
+    sizes = np.ones(len(gaps), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += gaps >= (1 << (7 * k))
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        has = sizes > k
+        byte = (gaps[has] >> (7 * k)) & 0x7f
+        more = sizes[has] > k + 1
+        out[starts[has] + k] = byte | (more << 7)
+    return zlib.compress(out.tobytes(), ZLIB_LEVEL)
+
+
+def decode_postings(data):
+    '''
+    Function: Decode a posting list written by encode_postings.
+    Input: bytes
+    Output: sorted numpy array of ints
+    '''
+    raw = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    number = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(len(raw)) - starts[number]) * 7
+    values = (raw & 0x7f).astype(np.int64) << shifts
+    gaps = np.zeros(len(ends), dtype=np.int64)
+    np.add.at(gaps, number, values)
+    return np.cumsum(gaps)
+
+
+def tree_of_nodes(offsets):
+    '''
+    Function: Get the tree of every node (or leaf) from the offsets of the
+    trees in a store.
+    Input: offsets (numpy array, one more than the trees)
+    Output: numpy array
+    '''
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int64),
+                     np.diff(offsets))
+
+
+def group_postings(keys, trees):
+    '''
+    Function: Get the sorted, unique trees of each key, from the key and
+    tree of every occurrence.
+    Input: numpy arrays of keys and of trees
+    Output: dict from key to numpy array of trees
+    '''
+    n = int(trees.max()) + 1 if len(trees) else 1
+    pairs = np.unique(keys.astype(np.int64) * n + trees)
+    keys = pairs // n
+    trees = pairs % n
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    postings = {}
+    for group in np.split(np.arange(len(keys)), bounds):
+        if len(group):
+            postings[int(keys[group[0]])] = trees[group]
+    return postings
+
+
+def build_index(path):
+    '''
+    Function: Build the index of a tree store and write it into the store.
+    Input: path of the store (string)
+    Output: number of terms (int)
+    '''
+    store = TreeStore(path)
+    node_trees = tree_of_nodes(store.tree_nodes)
+    leaf_trees = tree_of_nodes(store.tree_leaves)
+    labels = store.node_labels.astype(np.int64)
+    num_labels = len(store.labels)
+
+    terms = {}
+    for label, trees in group_postings(labels, node_trees).items():
+        terms['L:' + store.labels[label]] = trees
+
+    # Parent labels, from the parent of each node within its tree
+    has_parent = store.node_parents >= 0
+    parents = (store.tree_nodes[node_trees[has_parent]]
+               + store.node_parents[has_parent])
+    pairs = labels[parents] * num_labels + labels[has_parent]
+    for pair, trees in group_postings(pairs,
+                                      node_trees[has_parent]).items():
+        terms['P:' + store.labels[pair // num_labels] + '>'
+              + store.labels[pair % num_labels]] = trees
+
+    # Words are indexed lowercased, so that queries can ignore case
+    lower = {}
+    token_ids = np.array([lower.setdefault(token.lower(), len(lower))
+                          for token in store.tokens], dtype=np.int64)
+    words = list(lower)
+    for word, trees in group_postings(token_ids[store.leaf_tokens],
+                                      leaf_trees).items():
+        terms['T:' + words[word]] = trees
+
+    nodeless = np.flatnonzero(np.diff(store.tree_nodes) == 0)
+    terms[NODELESS] = nodeless
+
+    entries = {}
+    tmp = os.path.join(path, '.index.bin.tmp')
+    with open(tmp, 'wb') as f:
+        offset = 0
+        for term in sorted(terms):
+            data = encode_postings(terms[term])
+            f.write(data)
+            entries[term] = [offset, len(data), len(terms[term])]
+            offset += len(data)
+    os.replace(tmp, os.path.join(path, 'index.bin'))
+
+    tmp = os.path.join(path, '.index.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'trees': len(store),
+                   'terms': entries}, f)
+    os.replace(tmp, os.path.join(path, 'index.json'))
+    return len(entries)
+
+
+class TreeIndex:
+    '''
+    Reader of the index of a tree store.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'index.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError("The index of " + path + " is of version "
+                             + str(meta['version']) + ", not "
+                             + str(INDEX_VERSION) + ". Build it again.")
+        self.num_trees = meta['trees']
+        self.terms = meta['terms']
+        self.file = open(os.path.join(path, 'index.bin'), 'rb')
+
+    def postings(self, term):
+        '''
+        Function: Get the posting list of a term.
+        Input: term (string)
+        Output: sorted numpy array of trees, empty for unknown terms
+        '''
+        entry = self.terms.get(term)
+        if entry is None:
+            return np.zeros(0, dtype=np.int64)
+        self.file.seek(entry[0])
+        return decode_postings(self.file.read(entry[1]))
+
+    def intersect(self, terms, trees=None):
+        '''
+        Function: Get the trees that contain all of the given terms, out of
+        the given trees.
+        Input: list of terms (strings), sorted numpy array of trees or None
+            for all of them
+        Output: sorted numpy array of trees, or None if there are neither
+            terms nor trees
+        '''
+        # Rarest first, so that the intersection shrinks fastest
+        for term in sorted(terms,
+                           key=lambda t: self.terms.get(t, [0, 0, 0])[2]):
+            if trees is not None and not len(trees):
+                break
+            postings = self.postings(term)
+            trees = postings if trees is None else np.intersect1d(
+                trees, postings, assume_unique=True)
+        return trees
+
+    def candidates(self, terms, alternatives=None):
+        '''
+        Function: Get the trees that contain all of the given terms and,
+        if alternatives are given, all the terms of at least one of them,
+        along with the trees without nodes, which the index knows nothing
+        about.
+        Input: list of terms (strings), list of non-empty lists of terms or
+            None
+        Output: sorted numpy array of trees
+        '''
+        trees = self.intersect(terms)
+        if alternatives is not None and (trees is None or len(trees)):
+            trees = np.unique(np.concatenate(
+                [np.zeros(0, dtype=np.int64)]
+                + [self.intersect(alternative, trees)
+                   for alternative in alternatives]))
+        if trees is None:
+            trees = np.arange(self.num_trees)
+        return np.union1d(trees, self.postings(NODELESS))
+
+    def parent_labels(self, label):
+        '''
+        Function: Get the labels of the nodes that have a child with the
+        given label somewhere in the store.
+        Input: label (string)
+        Output: list of labels
+        '''
+        suffix = '>' + label
+        return [term[2:-len(suffix)] for term in self.terms
+                if term.startswith('P:') and term.endswith(suffix)]
+
+    def close(self):
+        self.file.close()
+
+
+def ccp_terms(first=None, second=None, conj=None):
+    '''
+    Function: Get the terms that every tree with a matching coordination
+    phrase contains, whichever the order of its conjuncts.
+    Input: category of the first and second conjunct, conjunction (strings
+        or None for any)
+    Output: list of terms
+    '''
+    terms = ['L:CC']
+    for label in [first, second]:
+        if label is not None:
+            terms.append('L:' + label)
+    if conj is not None:
+        terms.extend('T:' + word.lower() for word in conj.split())
+    return terms
+
+
+def ccp_parent_terms(parents, first=None, second=None):
+    '''
+    Function: Get the parent-label terms of a coordination phrase query.
+    The conjunction and both conjuncts of a phrase are children of the
+    same node, so every tree with a matching phrase contains all the terms
+    of at least one of the returned lists, one for each label that node
+    can have, whichever the order of the conjuncts.
+    Input: labels of the nodes with a CC child (list of strings), category
+        of the first and second conjunct (strings or None for any)
+    Output: list of lists of terms
+    '''
+    return [['P:' + parent + '>' + child
+             for child in ['CC', first, second] if child is not None]
+            for parent in parents]
+
+
+def ccp_matches(phrase, first=None, second=None, conj=None,
+                either_order=False, ignore_case=False):
+    '''
+    Function: Check whether a coordination phrase matches a query.
+    Input: phrase (as returned by StoredTree.coordphrases), and the query,
+        as for ccp_terms, and whether to compare the conjunction ignoring
+        case
+    Output: boolean
+    '''
+    (category1, _), conjunction, (category2, _) = phrase
+    if conj is not None:
+        if ignore_case:
+            if conjunction.lower() != conj.lower():
+                return False
+        elif conjunction != conj:
+            return False
+    if (first is None or category1 == first) and \
+            (second is None or category2 == second):
+        return True
+    return either_order and (first is None or category2 == first) and \
+        (second is None or category1 == second)
+
+
+def query_store(path, first=None, second=None, conj=None,
+                either_order=False, ignore_case=False, out=None):
+    '''
+    Function: Find the coordination phrases of a tree store that match a
+    query, running the exact matcher on the candidates of the index only.
+    The rows are those that ccpfinder.py writes for the store and that
+    match the query, in the same order. Candidates come in store order, so
+    repeated rows are dropped within each tree, and a tree is dropped if
+    an earlier one had the same string (and so the same rows), which only
+    takes the digests of the trees with matches, spilled to disk beyond
+    ccpfinder's MAX_SEEN.
+    Input: path of the store (string), the query, as for ccp_matches,
+        TableAppender to write the rows to (or None)
+    Output: number of candidate trees, number of trees, number of rows
+        (ints)
+    '''
+    from ccpfinder import COLUMNS, SeenRows
+
+    store = TreeStore(path)
+    index = TreeIndex(path)
+    try:
+        candidates = index.candidates(
+            ccp_terms(first, second, conj),
+            ccp_parent_terms(index.parent_labels('CC'), first, second))
+    finally:
+        index.close()
+
+    seen = SeenRows(os.path.dirname(os.path.abspath(path)))
+    written = 0
+    try:
+        for k in range(0, len(candidates), QUERY_CHUNK):
+            matched = []
+            for i in candidates[k:k + QUERY_CHUNK].tolist():
+                tree = store[i]
+                phrases, sent = tree.coordphrases()
+                tree_rows = []
+                for coord in phrases:
+                    if not ccp_matches(coord, first, second, conj,
+                                       either_order, ignore_case):
+                        continue
+                    row = (coord[0][0], coord[0][1], coord[2][0],
+                           coord[2][1], coord[1], sent, tree.string())
+                    if row not in tree_rows:
+                        tree_rows.append(row)
+                if tree_rows:
+                    matched.append(tree_rows)
+
+            digests = [hashlib.blake2b(tree_rows[0][-1].encode('utf-8'),
+                                       digest_size=16).digest()
+                       for tree_rows in matched]
+            rows = [row for tree_rows, new
+                    in zip(matched, seen.add_many(digests)) if new
+                    for row in tree_rows]
+            if rows and out is not None:
+                out.append(pd.DataFrame(rows, columns=COLUMNS))
+            written += len(rows)
+    finally:
+        seen.close()
+    return len(candidates), len(store), written
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Build and query the inverted index of tree stores.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build = subparsers.add_parser(
+        'build', help='build the index of tree store(s)')
+    build.add_argument('stores', nargs='+', type=str,
+                       help='path to tree store(s), e.g. csv/*/*.trees')
+    build.add_argument('--force', action='store_true',
+                       help='build indexes even if the manifest says they '
+                       'are up to date')
+
+    query = subparsers.add_parser(
+        'query', help='find matching coordination phrases')
+    query.add_argument('stores', nargs='+', type=str,
+                       help='path to indexed tree store(s)')
+    query.add_argument('--first', type=str, default=None,
+                       help='category of the first conjunct, e.g. ADJP')
+    query.add_argument('--second', type=str, default=None,
+                       help='category of the second conjunct, e.g. PP')
+    query.add_argument('--conj', type=str, default=None,
+                       help='conjunction, e.g. but')
+    query.add_argument('--either-order', action='store_true',
+                       help='also match the conjuncts the other way round')
+    query.add_argument('--ignore-case', action='store_true',
+                       help='compare the conjunction ignoring case')
+    query.add_argument('--output', type=str, default='query_ccps.csv',
+                       help='table to write the matches to, csv or Parquet '
+                       '(default: query_ccps.csv)')
+    return parser.parse_args()
+
+
+'''
+Main function.
+'''
+if __name__ == "__main__":
+
+    args = get_args()
+
+    i = 1
+    tot = str(len(args.stores))
+
+    if args.command == 'build':
+        manifest = Manifest()
+        params = {'version': INDEX_VERSION}
+
+        for path in args.stores:
+
+            print("(" + str(i) + "/" + tot + ")")
+            dest = os.path.join(path, 'index.json')
+            if not args.force and manifest.is_up_to_date(
+                    dest, store_meta(path), params):
+                print("The index of " + path + " is up to date, "
+                      "skipping.\n")
+                i = i + 1
+                continue
+
+            print("Indexing " + path + "...")
+            start = time.time()
+            num_terms = build_index(path)
+            manifest.record('index', dest, store_meta(path), params)
+            size = (os.path.getsize(os.path.join(path, 'index.bin'))
+                    + os.path.getsize(dest))
+            print(str(num_terms) + " terms, "
+                  + "{:.1f}".format(size / 1000000) + " MB, in "
+                  + "{:.1f}".format(time.time() - start) + " seconds.")
+            print("All done! The index is stored in " + path + ".\n")
+            i = i + 1
+
+    else:
+        from ccpfinder import COLUMNS
+
+        out = TableAppender(args.output, COLUMNS)
+        start = time.time()
+        total_candidates = 0
+        total_trees = 0
+        total_rows = 0
+
+        for path in args.stores:
+            candidates, trees, rows = query_store(
+                path, args.first, args.second, args.conj, args.either_order,
+                args.ignore_case, out)
+            print("(" + str(i) + "/" + tot + ") " + path + ": "
+                  + str(rows) + " matches in " + str(candidates) + " of "
+                  + str(trees) + " trees.")
+            total_candidates += candidates
+            total_trees += trees
+            total_rows += rows
+            i = i + 1
+        out.close()
+
+        print("\n" + str(total_rows) + " matches, after matching "
+              + str(total_candidates) + " of " + str(total_trees)
+              + " trees in " + "{:.1f}".format(time.time() - start)
+              + " seconds.")
+        print("All done! The result is stored in " + args.output + ".")
@@ -0,0 +1,566 @@
+#!/usr/bin/env python
+# treequery.py
+# A small tgrep-style pattern language over parse trees, so that a new
+# construction is a pattern rather than another hand-written function like
+# ccpfinder.get_simple_coordphrases. A query is anchored at a node, and
+# describes the node, its parent and all of the parent's children:
+#
+#     ANCHOR in [PARENT] ( CHILD CHILD ... )
+#
+# where ANCHOR and PARENT are tests, and the parent must have exactly the
+# children listed. A test is a label (CC), * for any node, a word in
+# double quotes for a node (or leaf) with that text ("neither"), or both
+# (CC="but"). ^ stands for the anchor itself, at that position; without
+# it, the anchor may be any of the children. A child prefixed by @NAME=
+# is captured, as its label and text. Alternatives are separated by |
+# and tried in order, and the first that matches a given anchor wins.
+# The three cases of get_simple_coordphrases are the reference query:
+#
+#     CC in *(@first=* @conj=^ @second=*)
+#   | CC in *("neither" @first=* @conj="nor" @second=*)
+#   | CC in VP(* @first=* @conj=CC @second=*)
+#
+# Queries are compiled into matchers, grouped by the label of their
+# anchor, so that any number of them run in a single pass over the nodes
+# of each tree, and chunks of trees are matched on a pool of worker
+# processes, as in ccpfinder.py. The input is a parse table or a tree
+# store (see treestore.py), e.g.:
+#     python treequery.py csv/*/*.trees --query 'adjp_pp=CC="but" in
+#         *(@first=ADJP ^ @second=PP)'
+# With --ccp, the reference query is run, and the result is written as
+# ccpfinder.py writes it.
+
+import argparse
+import multiprocessing as mp
+import os
+import re
+
+from collections import OrderedDict
+
+from corpusio import split_compression
+from tablestore import iter_table, table_path, FORMATS
+from treescan import scan, reference_coordphrases, Fallback
+from treestore import TreeStore, is_store
+from ccpfinder import (write_results, row_digests, COLUMNS as CCP_COLUMNS,
+                       CHUNK_ROWS, MAX_SEEN)
+
+
+REFERENCE_QUERIES = OrderedDict([
+    ('ccp', 'CC in *(@first=* @conj=^ @second=*)'
+            ' | CC in *("neither" @first=* @conj="nor" @second=*)'
+            ' | CC in VP(* @first=* @conj=CC @second=*)'),
+])
+
+# Tokens of a query: | ( ) ^ * = @NAME= "word" label
+TOKEN_PATTERN = re.compile(r'\s*(?:(\|)|(\()|(\))|(\^)|(\*)|(=)'
+                           r'|@([^\s()|"=^@*]+)=|"([^"]*)"|([^\s()|"=^@*]+))')
+
+
+class QueryError(Exception):
+    '''
+    Raised for queries that cannot be compiled.
+    '''
+
+
+class Test:
+    '''
+    Test of a node by its label, its text, both or neither. Leaves match a
+    test of text alone.
+    '''
+
+    def __init__(self, label=None, text=None):
+        self.label = label
+        self.text = text
+
+    def __call__(self, tree, ref):
+        if ref < 0:
+            return self.label is None and self.text is not None and \
+                tree.word(ref) == self.text
+        if self.label is not None and tree.label(ref) != self.label:
+            return False
+        return self.text is None or tree.text(ref) == self.text
+
+
+class Pattern:
+    '''
+    One alternative of a query: a test of the anchor, of its parent, and
+    of each of the parent's children, with the position of the anchor
+    among them (or None for any) and the children to capture.
+    '''
+
+    def __init__(self, anchor, parent, children, position, captures):
+        self.anchor = anchor
+        self.parent = parent
+        self.children = children
+        self.position = position
+        self.captures = captures
+
+    def match(self, tree, node):
+        '''
+        Function: Match the pattern at an anchor node.
+        Input: tree (ScannedTree or StoredView), node (int)
+        Output: list of (name, child) captures, or None
+        '''
+        parent = tree.parent(node)
+        if parent < 0:
+            return None
+        if self.parent is not None and not self.parent(tree, parent):
+            return None
+        kids = tree.children(parent)
+        if len(kids) != len(self.children):
+            return None
+        if self.position is not None and kids[self.position] != node:
+            return None
+        for test, kid in zip(self.children, kids):
+            if test is None:
+                if kid != node:
+                    return None
+            elif not test(tree, kid):
+                return None
+        return [(name, kids[i]) for name, i in self.captures]
+
+
+def tokenize(query):
+    '''
+    Function: Split a query into tokens.
+    Input: query (string)
+    Output: list of (kind, value) tuples
+    '''
+    kinds = ['|', '(', ')', '^', '*', '=', '@', 'word', 'label']
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        m = TOKEN_PATTERN.match(query, pos)
+        if m is None or m.end() == pos:
+            raise QueryError("cannot read the query at " + repr(query[pos:]))
+        for kind, value in zip(kinds, m.groups()):
+            if value is not None:
+                tokens.append((kind, value))
+                break
+        pos = m.end()
+    return tokens
+
+
+def compile_query(query):
+    '''
+    Function: Compile a query into its alternatives.
+    Input: query (string)
+    Output: list of Patterns, in order
+    '''
+    tokens = tokenize(query)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]][0] if pos[0] < len(tokens) else None
+
+    def take(kind=None):
+        if pos[0] >= len(tokens) or (kind and tokens[pos[0]][0] != kind):
+            raise QueryError("expected " + (kind or 'more') + " in "
+                             + repr(query))
+        pos[0] += 1
+        return tokens[pos[0] - 1][1]
+
+    def test():
+        if peek() == '*':
+            take()
+            return Test()
+        if peek() == 'word':
+            return Test(text=take())
+        label = take('label')
+        if peek() == '=':
+            take()
+            return Test(label, take('word'))
+        return Test(label)
+
+    patterns = []
+    while True:
+        anchor = test()
+        if take('label') != 'in':
+            raise QueryError("expected 'in' after the anchor in "
+                             + repr(query))
+        parent = None if peek() == '(' else test()
+        if parent is not None and parent.label is None and \
+                parent.text is None:
+            parent = None
+        take('(')
+        children = []
+        position = None
+        captures = []
+        while peek() != ')':
+            name = take() if peek() == '@' else None
+            if peek() == '^':
+                take()
+                if position is not None:
+                    raise QueryError("more than one ^ in " + repr(query))
+                position = len(children)
+                children.append(None)
+            else:
+                children.append(test())
+            if name is not None:
+                captures.append((name, len(children) - 1))
+        take(')')
+        if not children:
+            raise QueryError("no children in " + repr(query))
+        patterns.append(Pattern(anchor, parent, children, position,
+                                captures))
+        if peek() is None:
+            return patterns
+        take('|')
+
+
+class Matcher:
+    '''
+    Compiled queries, run together in one pass over the nodes of a tree.
+    The patterns are grouped by the label of their anchor, so that each
+    node is only matched against the queries that can be anchored there.
+    '''
+
+    def __init__(self, queries):
+        self.names = list(queries)
+        self.by_label = {}
+        self.any_label = []
+        for name, query in queries.items():
+            patterns = compile_query(query)
+            # Queries whose alternatives all share an anchor label are
+            # only tried at nodes with that label.
+            labels = set(p.anchor.label for p in patterns)
+            if len(labels) == 1 and None not in labels:
+                self.by_label.setdefault(labels.pop(), []).append(
+                    (name, patterns))
+            else:
+                self.any_label.append((name, patterns))
+
+    def match(self, tree):
+        '''
+        Function: Find all matches of the queries in a tree, in preorder of
+        their anchors, and in order of the queries at each anchor.
+        Input: tree (ScannedTree or StoredView)
+        Output: list of (query name, captures) tuples, where captures are
+            (name, label, text) tuples
+        '''
+        matches = []
+        for node in range(tree.size()):
+            queries = self.by_label.get(tree.label(node), [])
+            if self.any_label:
+                queries = sorted(queries + self.any_label,
+                                 key=lambda q: self.names.index(q[0]))
+            for name, patterns in queries:
+                for pattern in patterns:
+                    if not pattern.anchor(tree, node):
+                        continue
+                    captures = pattern.match(tree, node)
+                    if captures is not None:
+                        matches.append((name, [
+                            (capture, tree.label(ref), tree.text(ref))
+                            for capture, ref in captures]))
+                        break
+        return matches
+
+
+class ScannedTree:
+    '''
+    Tree scanned from a parse string with treescan.scan.
+    '''
+
+    def __init__(self, parse_string):
+        (self.labels, self.parents, self.kids, self.starts, self.ends,
+         self.leaves) = scan(parse_string)
+        self.parse_string = parse_string
+
+    def size(self):
+        return len(self.labels)
+
+    def label(self, ref):
+        return self.labels[ref] if ref >= 0 else None
+
+    def parent(self, node):
+        return self.parents[node]
+
+    def children(self, node):
+        return self.kids[node]
+
+    def word(self, ref):
+        return self.leaves[~ref]
+
+    def text(self, ref=0):
+        if ref < 0:
+            return self.leaves[~ref]
+        return " ".join(self.leaves[self.starts[ref]:self.ends[ref]])
+
+    def string(self):
+        return self.parse_string
+
+
+class StoredView:
+    '''
+    Tree of a tree store, with the interface of ScannedTree.
+    '''
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.labels = [tree.store.labels[label]
+                       for label in tree.labels.tolist()]
+        self.parents = tree.parents.tolist()
+
+    def size(self):
+        return len(self.labels)
+
+    def label(self, ref):
+        return self.labels[ref] if ref >= 0 else None
+
+    def parent(self, node):
+        return self.parents[node]
+
+    def children(self, node):
+        return self.tree.children(node).tolist()
+
+    def word(self, ref):
+        return self.tree.store.tokens[self.tree.leaves[~ref]]
+
+    def text(self, ref=0):
+        if ref < 0:
+            return self.word(ref)
+        return self.tree.text(ref)
+
+    def string(self):
+        return self.tree.string()
+
+
+# Matchers of each worker process, compiled once per set of queries
+_matchers = {}
+_stores = {}
+
+
+def get_matcher(queries):
+    key = tuple(queries.items())
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = _matchers[key] = Matcher(queries)
+    return matcher
+
+
+def match_trees(trees, queries, captures, ccp):
+    '''
+    Function: Match queries against trees and make the rows of the result.
+    Input: list of ScannedTrees or StoredViews, or parse strings that could
+        not be scanned; queries (dict from name to query), names of the
+        captures (list), whether to make the rows of ccpfinder.py from the
+        ccp query
+    Output: list of rows, their digests, and the number of trees
+    '''
+    matcher = get_matcher(queries)
+    rows = []
+    for tree in trees:
+        if not isinstance(tree, (ScannedTree, StoredView)):
+            if ccp:
+                # As ccpfinder.py, leave the trees that cannot be scanned
+                # to the nltk implementation
+                phrases, sent = reference_coordphrases(tree)
+                for coord in phrases:
+                    rows.append([coord[0][0], coord[0][1], coord[2][0],
+                                 coord[2][1], coord[1], sent, tree])
+            continue
+
+        matches = matcher.match(tree)
+        if not matches:
+            continue
+        sent = tree.text()
+        parse_string = tree.string()
+        for name, found in matches:
+            found = {capture: (label, text) for capture, label, text in found}
+            if ccp:
+                rows.append([found['first'][0], found['first'][1],
+                             found['second'][0], found['second'][1],
+                             found['conj'][1], sent, parse_string])
+                continue
+            row = [name]
+            for capture in captures:
+                label, text = found.get(capture, (None, None))
+                row.extend([label, text])
+            rows.append(row + [sent, parse_string])
+    return rows, row_digests(rows), len(trees)
+
+
+def match_chunk(parse_strings, queries, captures, ccp):
+    '''
+    Function: Match queries against a chunk of parse strings. Run in the
+    worker processes.
+    Input: list of parse strings, and as match_trees
+    Output: as match_trees
+    '''
+    trees = []
+    for parse_string in parse_strings:
+        try:
+            trees.append(ScannedTree(parse_string))
+        except (Fallback, AttributeError):
+            trees.append(parse_string)
+    return match_trees(trees, queries, captures, ccp)
+
+
+def match_store_chunk(path, start, stop, queries, captures, ccp):
+    '''
+    Function: Match queries against the trees start to stop of a tree
+    store. Run in the worker processes.
+    Input: path to tree store (string), first and last tree (ints), and as
+        match_trees
+    Output: as match_trees
+    '''
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = TreeStore(path)
+    trees = []
+    for i in range(start, stop):
+        tree = store[i]
+        trees.append(StoredView(tree) if len(tree) else tree.string())
+    return match_trees(trees, queries, captures, ccp)
+
+
+def capture_names(queries):
+    '''
+    Function: Get the names of the captures of a set of queries, in order
+    of first appearance.
+    Input: dict from name to query
+    Output: list of names
+    '''
+    names = []
+    for query in queries.values():
+        for pattern in compile_query(query):
+            for name, _ in pattern.captures:
+                if name not in names:
+                    names.append(name)
+    return names
+
+
+def query_columns(captures):
+    '''
+    Function: Get the columns of the result of a set of queries.
+    Input: names of the captures (list)
+    Output: list of column names
+    '''
+    columns = ['Query']
+    for name in captures:
+        columns.extend([name + ' Category', name + ' Text'])
+    return columns + ['Sentence Text', 'Sentence Parse Tree']
+
+
+def query_file(file, dest, queries, ccp=False, chunk_rows=CHUNK_ROWS,
+               pool=None, workers=1, max_seen=MAX_SEEN):
+    '''
+    Function: Match queries against a parse table or tree store, chunk by
+    chunk, and write the matches to a table without duplicate rows.
+    Input: input path (string), output path (string), queries (dict from
+        name to query), whether to write the rows of ccpfinder.py from the
+        ccp query, parse trees per chunk (int), process pool (or None) and
+        its number of processes (int), row digests kept in memory (int)
+    Output: number of rows written (int)
+    '''
+    captures = capture_names(queries)
+    if ccp:
+        missing = set(['first', 'conj', 'second']) - set(captures)
+        if 'ccp' not in queries or missing:
+            raise QueryError("--ccp needs a query named ccp that captures "
+                             "first, conj and second")
+        queries = OrderedDict([('ccp', queries['ccp'])])
+        columns = CCP_COLUMNS
+    else:
+        columns = query_columns(captures)
+
+    if is_store(file):
+        tasks = ((match_store_chunk, (file, start,
+                                      min(start + chunk_rows, num_trees),
+                                      queries, captures, ccp))
+                 for num_trees in [len(TreeStore(file))]
+                 for start in range(0, num_trees, chunk_rows))
+    else:
+        tasks = ((match_chunk, (chunk["Sentence Parse Tree"].tolist(),
+                                queries, captures, ccp))
+                 for chunk in iter_table(file, ["Sentence Parse Tree"],
+                                         chunk_rows))
+    return write_results(tasks, dest, columns, pool, workers, max_seen)
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Match tree patterns against parse tables or tree '
+        'stores.')
+    parser.add_argument('input_files', nargs='+', type=str,
+                        help='path to parse table(s) or tree store(s)')
+    parser.add_argument('--query', action='append', default=[],
+                        metavar='NAME=QUERY',
+                        help='a named query; may be given more than once')
+    parser.add_argument('--reference', action='store_true',
+                        help='also run the reference queries: '
+                        + ', '.join(REFERENCE_QUERIES))
+    parser.add_argument('--ccp', action='store_true',
+                        help='run the ccp reference query and write the '
+                        'result as ccpfinder.py does')
+    parser.add_argument('--suffix', type=str, default=None,
+                        help='suffix of the output tables (default: _ccps '
+                        'with --ccp, _matches otherwise)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes, 0 for one per core '
+                        '(default: 1, which works in this process)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='parse trees matched at a time (default: '
+                        + str(CHUNK_ROWS) + ')')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='format of the output tables (default: same as '
+                        'the input)')
+    parser.add_argument('--compress', choices=['none', 'gz', 'xz', 'zst'],
+                        help='compression of the output csv files (default: '
+                        'same as the input)')
+    return parser.parse_args()
+
+
+'''
+Main function.
+'''
+if __name__ == "__main__":
+
+    args = get_args()
+
+    queries = OrderedDict()
+    if args.reference or args.ccp:
+        queries.update(REFERENCE_QUERIES)
+    for item in args.query:
+        name, sep, query = item.partition('=')
+        if not sep:
+            raise SystemExit("A query must be given as NAME=QUERY: "
+                             + repr(item))
+        queries[name.strip()] = query
+    if not queries:
+        raise SystemExit("No queries given; use --query, --reference or "
+                         "--ccp.")
+    for name, query in queries.items():
+        compile_query(query)
+
+    suffix = args.suffix or ('_ccps' if args.ccp else '_matches')
+    workers = args.workers or os.cpu_count()
+    pool = mp.Pool(workers) if workers > 1 else None
+
+    i = 1
+    tot = str(len(args.input_files))
+
+    for file in args.input_files:
+
+        print("(" + str(i) + "/" + tot + ")")
+        print("Matching " + str(len(queries)) + " queries against " + file
+              + "...")
+
+        dest = table_path(
+            os.path.splitext(split_compression(file)[0])[-2] + suffix, file,
+            args.format, args.compress)
+        rows = query_file(file, dest, queries, args.ccp, args.chunk_rows,
+                          pool, workers)
+
+        print(str(rows) + " matches.")
+        print("All done! The result is stored in " + dest + ".\n")
+        i = i + 1
+
+    if pool is not None:
+        pool.close()
+        pool.join()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# treescan.py
+# Fast extraction of coordination phrases from bracketed parse strings.
+# ccpfinder.get_simple_coordphrases builds an nltk.ParentedTree for every
+# sentence and walks all of its subtrees. Here the parse string is instead
+# scanned once with a stack into flat arrays (label, parent, children and
+# leaf span of every node), from which the same phrases are read off
+# directly. The result is identical to get_simple_coordphrases, including
+# the order of the phrases and their repeats. Parse strings that the
+# reference would reject, or trip over (a CC at the root, or a leaf where
+# it expects a subtree), are handed to the reference itself, so that they
+# fail or succeed exactly as they always did.
+
+
+class Fallback(Exception):
+    '''
+    Raised when a parse string must be handled by the reference.
+    '''
+
+
+def scan(parse_string):
+    '''
+    Function: Scan a bracketed parse string into flat arrays, tokenizing
+    it exactly as nltk.Tree.fromstring does. Nodes are numbered in
+    preorder, which is the order of Tree.subtrees. A child is either a
+    node number, or ~i for the i-th leaf.
+    Input: parse string
+    Output: labels, parents (-1 for the root), children (lists), leaf
+        start and end of each node, and leaves (all lists)
+    '''
+    tokens = parse_string.replace('(', ' ( ').replace(')', ' ) ').split()
+    labels = []
+    parents = []
+    children = []
+    starts = []
+    ends = []
+    leaves = []
+    stack = []
+    done = False
+
+    i = 0
+    n = len(tokens)
+    while i < n:
+        token = tokens[i]
+        if token == '(':
+            if done:
+                raise Fallback()
+            label = ''
+            if i + 1 < n and tokens[i + 1] != '(' and tokens[i + 1] != ')':
+                label = tokens[i + 1]
+                i += 1
+            node = len(labels)
+            labels.append(label)
+            children.append([])
+            starts.append(len(leaves))
+            ends.append(0)
+            if stack:
+                parents.append(stack[-1])
+                children[stack[-1]].append(node)
+            else:
+                parents.append(-1)
+            stack.append(node)
+        elif token == ')':
+            if not stack:
+                raise Fallback()
+            node = stack.pop()
+            ends[node] = len(leaves)
+            done = not stack
+        else:
+            if not stack:
+                raise Fallback()
+            children[stack[-1]].append(~len(leaves))
+            leaves.append(token)
+        i += 1
+
+    if not done:
+        raise Fallback()
+    return labels, parents, children, starts, ends, leaves
+
+
+def scan_coordphrases(parse_string):
+    '''
+    Function: Find all simple coordination phrases of a parse string, as
+    ccpfinder.get_simple_coordphrases does, without building a tree.
+    Input: parse string
+    Output: list of phrases, and the sentence text (string)
+    Raises Fallback if the reference must handle the parse string.
+    '''
+    labels, parents, children, starts, ends, leaves = scan(parse_string)
+
+    def label(node):
+        if node < 0:
+            raise Fallback()
+        return labels[node]
+
+    def text(node):
+        if node < 0:
+            raise Fallback()
+        return " ".join(leaves[starts[node]:ends[node]])
+
+    cc_nodes = [node for node in range(len(labels)) if labels[node] == "CC"]
+    phrases = collect_coordphrases(cc_nodes, label, parents,
+                                   children.__getitem__, text)
+    return phrases, " ".join(leaves)
+
+
+def collect_coordphrases(cc_nodes, label, parents, children, text):
+    '''
+    Function: Read the simple coordination phrases off a tree stored as
+    flat arrays, given its CC nodes in preorder. Shared by the scanner and
+    treestore.py.
+    Input: CC nodes (ints), label of a node (function), parent of each
+        node (-1 for the root), children of a node (function), text of a
+        node (function); label and text raise Fallback for leaves
+    Output: list of phrases
+    Raises Fallback if the reference must handle the tree.
+    '''
+    def conjunct(node):
+        return (label(node), text(node))
+
+    phrases = []
+    for node in cc_nodes:
+        parent = parents[node]
+        if parent < 0:
+            raise Fallback()
+        siblings = children(parent)
+
+        # Simple three-prong coordination phrases
+        if len(siblings) == 3:
+            if siblings[1] != node:
+                continue
+            phrases.append((conjunct(siblings[0]), text(node),
+                            conjunct(siblings[2])))
+
+        # "neither-nor" coordination phrases
+        elif len(siblings) == 4:
+            if text(siblings[0]) == 'neither' and text(siblings[2]) == 'nor':
+                phrases.append((conjunct(siblings[1]), 'nor',
+                                conjunct(siblings[3])))
+
+            # VPs with both conjuncts as complements
+            elif label(parent) == 'VP':
+                if label(siblings[2]) == 'CC':
+                    phrases.append((conjunct(siblings[1]),
+                                    text(siblings[2]),
+                                    conjunct(siblings[3])))
+
+    return phrases
+
+
+def find_coordphrases(parse_string):
+    '''
+    Function: Find all simple coordination phrases of a parse string and
+    its sentence text, falling back to ccpfinder.get_simple_coordphrases
+    on an nltk.ParentedTree when the scan cannot handle it.
+    Input: parse string
+    Output: list of phrases, and the sentence text (string)
+    '''
+    try:
+        return scan_coordphrases(parse_string)
+    except Fallback:
+        return reference_coordphrases(parse_string)
+
+
+def reference_coordphrases(parse_string):
+    '''
+    Function: Find all simple coordination phrases of a parse string and
+    its sentence text with the original nltk implementation.
+    Input: parse string
+    Output: list of phrases, and the sentence text (string)
+    '''
+    from nltk import ParentedTree
+    from ccpfinder import get_simple_coordphrases, get_tree_text
+
+    tree = ParentedTree.fromstring(parse_string)
+    return get_simple_coordphrases(tree), get_tree_text(tree)
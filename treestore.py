@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# treestore.py
+# Compact binary store of the parse trees of a table, built once per
+# corpus, so that the bracketed strings are not tokenized into nltk trees
+# again by every script that reads them. A store is a directory (e.g.
+# csv/w_acad_1990/w_acad_1990.trees/) of flat integer arrays, read through
+# numpy memory maps without copying:
+#     tree_nodes, tree_leaves, tree_refs   offsets of the nodes, leaves and
+#                                          child references of each tree
+#                                          (int64, one more than the trees)
+#     node_labels                          label ID of each node
+#     node_parents                         parent of each node, -1 for the
+#                                          root
+#     node_child_starts                    start of the children of each
+#                                          node in child_refs, which end
+#                                          where those of the next node
+#                                          start
+#     node_starts, node_ends               span of the leaves of each node
+#     child_refs                           children, as a node, or ~i for
+#                                          the i-th leaf
+#     leaf_tokens                          token ID of each leaf (int32)
+# All node, leaf and child numbers are relative to their tree, so that
+# they fit in int16. Labels and tokens are interned in labels.txt and
+# tokens.txt, one per line, and meta.json holds the counts. The tree
+# strings are rebuilt from the arrays; the few that would not come back
+# exactly as they were read are kept verbatim in raw.json, along with
+# those that cannot be scanned at all or are too large for int16, which
+# are stored without nodes and handed to the nltk implementation.
+#
+# Build the store of a parse table with:
+#     python treestore.py csv/w_acad_1990/w_acad_1990.csv
+# and pass the store to ccpfinder.py in place of the table.
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+from tqdm import tqdm
+
+from manifest import Manifest, file_hash
+from corpusio import split_compression
+from tablestore import iter_table, ROW_GROUP_ROWS
+from treescan import (scan, collect_coordphrases, reference_coordphrases,
+                      Fallback)
+
+
+STORE_VERSION = 1
+STORE_EXT = '.trees'
+
+# Arrays of a store, with their types
+DTYPES = {
+    'tree_nodes': np.int64,
+    'tree_leaves': np.int64,
+    'tree_refs': np.int64,
+    'node_labels': np.int16,
+    'node_parents': np.int16,
+    'node_child_starts': np.int16,
+    'node_starts': np.int16,
+    'node_ends': np.int16,
+    'child_refs': np.int16,
+    'leaf_tokens': np.int32,
+}
+OFFSET_ARRAYS = ['tree_nodes', 'tree_leaves', 'tree_refs']
+ARRAYS = list(DTYPES)
+
+# Largest number of nodes, leaves or child references of a stored tree,
+# and of labels
+MAX_INT16 = 32767
+
+
+def store_path(file):
+    '''
+    Function: Get the path of the tree store of a parse table.
+    Input: path to parse table (string)
+    Output: path of the store directory (string)
+    '''
+    return os.path.splitext(split_compression(file)[0])[0] + STORE_EXT
+
+
+def store_meta(path):
+    '''
+    Function: Get the path of the metadata of a tree store, which stands
+    for the whole store in the manifest.
+    Input: path of the store (string)
+    Output: path (string)
+    '''
+    return os.path.join(path, 'meta.json')
+
+
+def is_store(path):
+    '''
+    Function: Check whether a path is a tree store.
+    Input: path (string)
+    Output: boolean
+    '''
+    return os.path.isfile(store_meta(path))
+
+
+def render(labels, children, leaves, node=0):
+    '''
+    Function: Write a scanned tree back as a bracketed string, with single
+    spaces, as benepar writes them.
+    Input: labels, children (lists, as returned by treescan.scan), leaves
+        (list of strings), node to start at (int)
+    Output: parse string
+    '''
+    parts = ['(' + labels[node]]
+    stack = [iter(children[node])]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            parts.append(')')
+            stack.pop()
+        elif child < 0:
+            parts.append(' ' + leaves[~child])
+        else:
+            parts.append(' (' + labels[child])
+            stack.append(iter(children[child]))
+    return ''.join(parts)
+
+
+class Interner:
+    '''
+    Assigns consecutive IDs to strings, in order of first appearance.
+    '''
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __call__(self, string):
+        i = self.ids.get(string)
+        if i is None:
+            i = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return i
+
+
+def build_store(file, dest, chunk_rows=ROW_GROUP_ROWS):
+    '''
+    Function: Build the tree store of a parse table, reading its parse tree
+    column in chunks and appending to the arrays on disk as it goes.
+    Input: path to parse table (string), path of the store (string), rows
+        read at a time (int)
+    Output: number of trees (int)
+    '''
+    tmp = dest + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    files = {name: open(os.path.join(tmp, name + '.bin'), 'wb')
+             for name in ARRAYS}
+    labels = Interner()
+    tokens = Interner()
+    raw = {}
+    totals = {'tree_nodes': 0, 'tree_leaves': 0, 'tree_refs': 0}
+    for name in OFFSET_ARRAYS:
+        files[name].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    n = 0
+    with tqdm(unit=' trees') as progress:
+        for chunk in iter_table(file, ["Sentence Parse Tree"], chunk_rows):
+            arrays = {name: [] for name in ARRAYS}
+            for parse_string in chunk["Sentence Parse Tree"]:
+                try:
+                    tree = scan(parse_string)
+                except (Fallback, AttributeError):
+                    tree = None
+                if tree is not None and not fits(tree, labels):
+                    tree = None
+                if tree is None or render(tree[0], tree[2], tree[5]) \
+                        != parse_string:
+                    raw[n] = parse_string
+                if tree is not None:
+                    add_tree(arrays, tree, labels, tokens)
+                    totals['tree_nodes'] += len(tree[0])
+                    totals['tree_leaves'] += len(tree[5])
+                    totals['tree_refs'] += sum(len(c) for c in tree[2])
+                for name in OFFSET_ARRAYS:
+                    arrays[name].append(totals[name])
+                n += 1
+
+            for name in ARRAYS:
+                files[name].write(np.array(arrays[name], dtype=DTYPES[name])
+                                  .tobytes())
+            progress.update(len(chunk.index))
+
+    for f in files.values():
+        f.close()
+
+    for name, strings in [('labels', labels.strings),
+                          ('tokens', tokens.strings)]:
+        with open(os.path.join(tmp, name + '.txt'), 'w',
+                  encoding='utf-8') as f:
+            f.write(''.join(string + '\n' for string in strings))
+    with open(os.path.join(tmp, 'raw.json'), 'w', encoding='utf-8') as f:
+        json.dump(raw, f)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': STORE_VERSION, 'source': file,
+                   'source_hash': file_hash(file), 'trees': n,
+                   'nodes': totals['tree_nodes'],
+                   'leaves': totals['tree_leaves'],
+                   'refs': totals['tree_refs']}, f, indent=2)
+
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    os.replace(tmp, dest)
+    return n
+
+
+def fits(tree, labels):
+    '''
+    Function: Check whether the numbers of a scanned tree fit in int16.
+    Input: tree (as returned by treescan.scan), label Interner
+    Output: boolean
+    '''
+    new_labels = sum(1 for label in set(tree[0]) if label not in labels.ids)
+    return (len(tree[0]) <= MAX_INT16 and len(tree[5]) <= MAX_INT16
+            and sum(len(c) for c in tree[2]) <= MAX_INT16
+            and len(labels.strings) + new_labels <= MAX_INT16)
+
+
+def add_tree(arrays, tree, labels, tokens):
+    '''
+    Function: Append a scanned tree to the arrays of a chunk.
+    Input: dict of lists, tree (as returned by treescan.scan), label and
+        token Interners
+    '''
+    node_labels, parents, children, starts, ends, leaves = tree
+    refs = arrays['child_refs']
+    ref = 0
+    for node in range(len(node_labels)):
+        arrays['node_labels'].append(labels(node_labels[node]))
+        arrays['node_child_starts'].append(ref)
+        refs.extend(children[node])
+        ref += len(children[node])
+    arrays['node_parents'].extend(parents)
+    arrays['node_starts'].extend(starts)
+    arrays['node_ends'].extend(ends)
+    arrays['leaf_tokens'].extend(tokens(leaf) for leaf in leaves)
+
+
+class TreeStore:
+    '''
+    Reader of a tree store. The arrays are memory-mapped, so opening a store
+    reads nothing but its vocabularies, and every tree is a view into them.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(store_meta(path), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError(path + " is a tree store of version "
+                             + str(self.meta['version']) + ", not "
+                             + str(STORE_VERSION) + ". Build it again.")
+
+        for name in ARRAYS:
+            array_path = os.path.join(path, name + '.bin')
+            if os.path.getsize(array_path) == 0:
+                array = np.zeros(0, dtype=DTYPES[name])
+            else:
+                # A plain view of the memory map, since indexing np.memmap
+                # itself goes through Python code
+                array = np.memmap(array_path, dtype=DTYPES[name],
+                                  mode='r').view(np.ndarray)
+            setattr(self, name, array)
+
+        self.labels = read_lines(os.path.join(path, 'labels.txt'))
+        # An object array, so that the words of a span are looked up at once
+        self.tokens = np.array(read_lines(os.path.join(path, 'tokens.txt')),
+                               dtype=object)
+        self.label_ids = {label: i for i, label in enumerate(self.labels)}
+        with open(os.path.join(path, 'raw.json'), encoding='utf-8') as f:
+            self.raw = {int(i): string for i, string in json.load(f).items()}
+
+    def __len__(self):
+        return self.meta['trees']
+
+    def __getitem__(self, i):
+        return StoredTree(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield StoredTree(self, i)
+
+
+def read_lines(path):
+    '''
+    Function: Read a vocabulary file, one string per line.
+    Input: path (string)
+    Output: list of strings
+    '''
+    with open(path, encoding='utf-8') as f:
+        return f.read().split('\n')[:-1]
+
+
+class StoredTree:
+    '''
+    One tree of a TreeStore. Its arrays are slices of the memory maps of
+    the store, and its nodes are numbered in preorder, as in treescan.scan.
+    '''
+
+    def __init__(self, store, i):
+        self.store = store
+        self.index = i
+        nodes = slice(store.tree_nodes[i], store.tree_nodes[i + 1])
+        self.labels = store.node_labels[nodes]
+        self.parents = store.node_parents[nodes]
+        self.child_starts = store.node_child_starts[nodes]
+        self.starts = store.node_starts[nodes]
+        self.ends = store.node_ends[nodes]
+        self.refs = store.child_refs[store.tree_refs[i]:store.tree_refs[i + 1]]
+        self.leaves = store.leaf_tokens[
+            store.tree_leaves[i]:store.tree_leaves[i + 1]]
+        # Words of the leaves, looked up on the first call of text
+        self.words = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def label(self, node):
+        '''
+        Function: Get the label of a node.
+        Input: node (int)
+        Output: label (string)
+        '''
+        if node < 0:
+            raise Fallback()
+        return self.store.labels[self.labels[node]]
+
+    def children(self, node):
+        '''
+        Function: Get the children of a node, as nodes or ~leaf.
+        Input: node (int)
+        Output: array of ints
+        '''
+        end = (self.child_starts[node + 1] if node + 1 < len(self.labels)
+               else len(self.refs))
+        return self.refs[self.child_starts[node]:end]
+
+    def text(self, node=0):
+        '''
+        Function: Get the text of a node, the words of its leaves joined by
+        spaces, as ccpfinder.get_tree_text does.
+        Input: node (int, the root by default)
+        Output: string
+        '''
+        if node < 0:
+            raise Fallback()
+        if not len(self.labels):
+            return reference_coordphrases(self.string())[1]
+        if self.words is None:
+            self.words = self.store.tokens[self.leaves].tolist()
+        return " ".join(self.words[self.starts[node]:self.ends[node]])
+
+    def string(self):
+        '''
+        Function: Get the bracketed parse string of the tree, exactly as it
+        was in the parse table.
+        Output: parse string
+        '''
+        raw = self.store.raw.get(self.index)
+        if raw is not None:
+            return raw
+        labels = [self.store.labels[label] for label in self.labels]
+        children = [self.children(node).tolist() for node in range(len(self))]
+        leaves = [self.store.tokens[token] for token in self.leaves]
+        return render(labels, children, leaves)
+
+    def coordphrases(self):
+        '''
+        Function: Find all simple coordination phrases of the tree, as
+        treescan.find_coordphrases does on its parse string.
+        Output: list of phrases, and the sentence text (string)
+        '''
+        cc = self.store.label_ids.get("CC")
+        if len(self.labels) and cc is not None:
+            try:
+                phrases = collect_coordphrases(
+                    np.flatnonzero(self.labels == cc).tolist(), self.label,
+                    self.parents, self.children, self.text)
+                return phrases, self.text()
+            except Fallback:
+                pass
+        elif len(self.labels):
+            return [], self.text()
+        return reference_coordphrases(self.string())
+
+
+'''
+Parse command-line arguments.
+'''
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Build the binary tree store of parse table(s).')
+    parser.add_argument('input_files', nargs='+', type=str,
+                        help='path to parse table(s)')
+    parser.add_argument('--chunk-rows', type=int, default=ROW_GROUP_ROWS,
+                        help='parse trees read at a time (default: '
+                        + str(ROW_GROUP_ROWS) + ')')
+    parser.add_argument('--force', action='store_true',
+                        help='build stores even if the manifest says they '
+                        'are up to date')
+    return parser.parse_args()
+
+
+'''
+Main function.
+'''
+if __name__ == "__main__":
+
+    args = get_args()
+
+    manifest = Manifest()
+    params = {'version': STORE_VERSION}
+
+    i = 1
+    tot = str(len(args.input_files))
+
+    for file in args.input_files:
+
+        print("(" + str(i) + "/" + tot + ")")
+
+        dest = store_path(file)
+        if not args.force and manifest.is_up_to_date(store_meta(dest), file,
+                                                     params):
+            print(dest + " is up to date, skipping.\n")
+            i = i + 1
+            continue
+
+        print("Building the tree store of " + file + "...")
+        n = build_store(file, dest, args.chunk_rows)
+        manifest.record('store', store_meta(dest), file, params)
+        store = TreeStore(dest)
+        size = sum(os.path.getsize(os.path.join(dest, name))
+                   for name in os.listdir(dest))
+        print(str(n) + " trees, " + str(store.meta['nodes']) + " nodes, "
+              + str(len(store.raw)) + " kept verbatim, "
+              + "{:.1f}".format(size / 1000000) + " MB.")
+
+        print("All done! The result is stored in " + dest + ".\n")
+        i = i + 1
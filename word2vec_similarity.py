@@ -13,6 +13,9 @@ import argparse
 import pandas as pd
 from nltk.stem import WordNetLemmatizer
 
+from tablestore import (read_table, write_table, carry_columns,
+                        ANALYSIS_COLUMNS, HEAD_COLUMNS)
+
 
 # Load Google's pre-trained Word2Vec model.
 model = gensim.models.KeyedVectors.load_word2vec_format(
@@ -191,13 +194,13 @@ def get_args():
 def measure_docsim(file):
     print("Getting document similarity of conjuncts in " + file + "...")
 
-    df = pd.read_csv(file)
+    df = read_table(file, columns=ANALYSIS_COLUMNS)
 
     df['Document Similarity'] = df.apply(lambda row: doc_similarity(
         str(row['1st Conjunct Text']), str(row['2nd Conjunct Text'])), axis=1)
 
     dest = file.replace('_heads', '_docsim')
-    df.to_csv(dest, index=False)
+    write_table(carry_columns(file, df), dest)
 
     print("Document similarity analysis done! Result stored in " + dest + ".")
 
@@ -205,7 +208,7 @@ def measure_docsim(file):
 def measure_sim(file):
     print("Getting head similarity of conjuncts in " + file + "...")
 
-    df = pd.read_csv(file)
+    df = read_table(file, columns=ANALYSIS_COLUMNS + HEAD_COLUMNS)
 
     df = df[df['1st Conjunct Category'].isin(CATEGORIES)]
     df = df[df['2nd Conjunct Category'].isin(CATEGORIES)]
@@ -218,7 +221,7 @@ def measure_sim(file):
     ), axis=1)
 
     dest = file.replace('_heads', '_sim')
-    df.to_csv(dest, index=False)
+    write_table(carry_columns(file, df), dest)
 
     print("Similarity analysis done! Result stored in " + dest + ".")
 
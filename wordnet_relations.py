@@ -5,6 +5,9 @@ from nltk.corpus import wordnet as wn
 import argparse
 import pandas as pd
 
+from tablestore import (read_table, write_table, carry_columns,
+                        ANALYSIS_COLUMNS, HEAD_COLUMNS)
+
 
 NOUN_CATEGORIES = ['NN', 'NNS', 'NNP', 'NNPS', 'NP', 'NX']
 VERB_CATEGORIES = ['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ', 'VP']
@@ -125,7 +128,7 @@ def analyze_synonymy(file):
     Output written to a file "_syns.csv".
     """
 
-    df = pd.read_csv(file)
+    df = read_table(file, columns=ANALYSIS_COLUMNS + HEAD_COLUMNS)
 
     df = df[(df['1st Conjunct Category'].isin(NOUN_CATEGORIES) & df['2nd Conjunct Category'].isin(NOUN_CATEGORIES)) |
             (df['1st Conjunct Category'].isin(VERB_CATEGORIES) & df['2nd Conjunct Category'].isin(VERB_CATEGORIES)) |
@@ -138,7 +141,7 @@ def analyze_synonymy(file):
         str(row['1st Conjunct Category'])), axis=1)
 
     dest = file.replace('_heads', '_syns')
-    df.to_csv(dest, index=False)
+    write_table(carry_columns(file, df), dest)
 
     print("Synonymy analysis done! Result stored in " + dest + ".")
 
@@ -149,7 +152,7 @@ def analyze_antonymy(file):
     in the given csv file. Output written to a file "_ants.csv".
     """
 
-    df = pd.read_csv(file)
+    df = read_table(file, columns=ANALYSIS_COLUMNS + HEAD_COLUMNS)
 
     df = df[(df['1st Conjunct Category'].isin(ADJ_CATEGORIES) & df['2nd Conjunct Category'].isin(ADJ_CATEGORIES)) |
             (df['1st Conjunct Category'].isin(ADV_CATEGORIES) & df['2nd Conjunct Category'].isin(ADV_CATEGORIES))]
@@ -160,7 +163,7 @@ def analyze_antonymy(file):
         str(row['1st Conjunct Category'])), axis=1)
 
     dest = file.replace('_heads', '_ants')
-    df.to_csv(dest, index=False)
+    write_table(carry_columns(file, df), dest)
 
     print("Antonymy analysis done! Result stored in " + dest + ".")
 
@@ -171,7 +174,7 @@ def analyze_hypernymy(file):
     categories in the given csv file. Output written to a file "_hyp.csv".
     """
 
-    df = pd.read_csv(file)
+    df = read_table(file, columns=ANALYSIS_COLUMNS + HEAD_COLUMNS)
 
     df = df[(df['1st Conjunct Category'].isin(NOUN_CATEGORIES) & df['2nd Conjunct Category'].isin(NOUN_CATEGORIES)) |
             (df['1st Conjunct Category'].isin(VERB_CATEGORIES) & df['2nd Conjunct Category'].isin(VERB_CATEGORIES))]
@@ -191,7 +194,7 @@ def analyze_hypernymy(file):
         str(row['1st Conjunct Category'])), axis=1)
 
     dest = file.replace('_heads', '_hyp')
-    df.to_csv(dest, index=False)
+    write_table(carry_columns(file, df), dest)
 
     print("Hypernymy and co-hyponymy analysis done! Result stored in " + dest + ".")
 
@@ -202,7 +205,7 @@ def analyze_entailment(file):
     Output written to a file "_entl.csv".
     """
 
-    df = pd.read_csv(file)
+    df = read_table(file, columns=ANALYSIS_COLUMNS + HEAD_COLUMNS)
 
     df = df[df['1st Conjunct Category'].isin(VERB_CATEGORIES)]
     df = df[df['2nd Conjunct Category'].isin(VERB_CATEGORIES)]
@@ -217,7 +220,7 @@ def analyze_entailment(file):
         str(row['1st Conjunct Category'])), axis=1)
 
     dest = file.replace('_heads', '_entl')
-    df.to_csv(dest, index=False)
+    write_table(carry_columns(file, df), dest)
 
     print("Entailment analysis done! Result stored in " + dest + ".")
 